@@ -1,15 +1,26 @@
 try:
-    import os
-    import sys
     import traceback
-    from io import BytesIO
+    import uuid
+    from functools import partial
 
     import streamlit as st
-    from pypdf import PaperSize, PdfReader, PdfWriter, Transformation
+    from pypdf import PaperSize, PdfReader
     from pypdf.errors import FileNotDecryptedError
     from streamlit import session_state
 
-    from utils import helpers, init_session_states, page_config, render_sidebar
+    from utils import (
+        cache,
+        documents,
+        helpers,
+        init_session_states,
+        jobs,
+        metrics,
+        page_config,
+        pipeline,
+        render_sidebar,
+        storage,
+        tasks,
+    )
 
     page_config.set()
 
@@ -22,28 +33,21 @@ try:
     init_session_states.init()
 
     render_sidebar.render()
+    metrics.serve()
 
     # ---------- OPERATIONS ----------
     # TODO: Extract attachments (https://pypdf.readthedocs.io/en/stable/user/extract-attachments.html)
-    # TODO: Undo last operation
     # TODO: Update metadata (https://pypdf.readthedocs.io/en/stable/user/metadata.html)
 
-    try:
-        (
-            pdf,
-            reader,
-            session_state["password"],
-            session_state["is_encrypted"],
-        ) = helpers.load_pdf(key="main")
-
-    except FileNotDecryptedError:
-        pdf = "password_required"
+    # Each panel is a fragment: interacting with its widgets reruns only that panel,
+    # and any heavy work only happens on an explicit submit.
 
-    if pdf == "password_required":
-        st.error("PDF is password protected. Please enter the password to proceed.")
-    elif pdf:
-        lcol, rcol = st.columns(2)
-        with lcol.expander(label="🔍 Extract text"):
+    @st.fragment
+    @metrics.instrument("Extract text")
+    def extract_text_panel(
+        document: documents.DocumentHandle, reader: PdfReader
+    ) -> None:
+        with st.form("extract_text"):
             extract_text_lcol, extract_text_rcol = st.columns(2)
 
             page_numbers_str = helpers.select_pages(
@@ -58,65 +62,222 @@ try:
                 help="Layout mode extracts text in a format resembling the layout of the source PDF",
             )
 
-            if page_numbers_str:
-                try:
-                    text = helpers.extract_text(reader, page_numbers_str, mode)
-                except (IndexError, ValueError):
-                    st.error("Specified pages don't exist. Check the format.", icon="⚠️")
-                else:
-                    st.text(text)
+            submitted = st.form_submit_button("Extract text", use_container_width=True)
 
-                    with open("text.txt", "w", encoding="utf-8") as f:
-                        f.write(text)
+        if submitted and page_numbers_str:
+            try:
+                pages = helpers.extract_text(
+                    reader,
+                    document,
+                    page_numbers_str,
+                    mode,
+                    password=session_state.password,
+                )
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+            else:
+                # Show each page as soon as it is extracted. Pages are extracted
+                # while they're iterated over, so that's what is measured.
+                text = []
+                with (
+                    metrics.timed("extract_text") as measurement,
+                    st.container(height=400),
+                ):
+                    measurement.input_bytes = document.size
+                    for page_text in pages:
+                        text.append(page_text)
+                        st.text(page_text)
+                    measurement.pages = len(text)
+                    measurement.output_bytes = sum(len(page.encode()) for page in text)
 
-                    with open("text.txt") as f:
-                        st.download_button(
-                            "💾 Download extracted text",
-                            data=f,
-                            use_container_width=True,
-                        )
+                st.download_button(
+                    "💾 Download extracted text",
+                    data=lambda: "\n".join(text),
+                    file_name="text.txt",
+                    mime="text/plain",
+                    on_click="ignore",
+                    use_container_width=True,
+                )
 
-        with rcol.expander(label="️🖼️ Extract images"):
-            if page_numbers_str := helpers.select_pages(
+    @st.fragment
+    @metrics.instrument("Extract images")
+    def extract_images_panel(document: documents.DocumentHandle) -> None:
+        with st.form("extract_images"):
+            page_numbers_str = helpers.select_pages(
                 container=st,
                 key="extract_image_pages",
-            ):
-                try:
-                    images = helpers.extract_images(reader, page_numbers_str)
-                except (IndexError, ValueError):
-                    st.error("Specified pages don't exist. Check the format.", icon="⚠️")
-                else:
-                    if images:
-                        for data, name in images.items():
-                            st.image(data, caption=name)
-                    else:
-                        st.info("No images found")
+            )
+            submitted = st.form_submit_button(
+                "Extract images", use_container_width=True
+            )
 
-        with lcol.expander("📊 Extract table"):
-            if page_numbers_str := helpers.select_pages(
+        if submitted:
+            session_state["images_request"] = (document.digest, page_numbers_str)
+            session_state["images_page"] = 1
+
+        # Only the index is kept; thumbnails are rendered (and cached) page by page
+        request = session_state.get("images_request")
+        if not request or not request[1] or request[0] != document.digest:
+            return
+
+        try:
+            images = helpers.index_images(
+                document, request[1], password=session_state.password
+            )
+        except (IndexError, ValueError):
+            st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+            return
+
+        if not images:
+            st.info("No images found")
+            return
+
+        pages = -(-len(images) // helpers.IMAGES_PER_PAGE)
+        lcol, rcol = st.columns([1, 2])
+        page = lcol.number_input(
+            f"Page (of {pages})",
+            min_value=1,
+            max_value=pages,
+            key="images_page",
+        )
+        rcol.caption(f"{len(images)} distinct images")
+        rcol.download_button(
+            "💾 Download all images",
+            data=partial(
+                helpers.export_images, document, images, session_state.password
+            ),
+            file_name=f"{session_state['name'].rsplit('.')[0]}_images.zip",
+            mime="application/zip",
+            on_click="ignore",
+            use_container_width=True,
+        )
+
+        columns = st.columns(3)
+        start = (page - 1) * helpers.IMAGES_PER_PAGE
+        for i, image in enumerate(images[start : start + helpers.IMAGES_PER_PAGE]):
+            columns[i % 3].image(
+                helpers.image_thumbnail(document, image, session_state.password),
+                caption=f"{image.name} · {image.width}×{image.height} · "
+                f"{image.size / 1024:.0f} KB · page "
+                + ", ".join(str(image_page + 1) for image_page in image.pages),
+            )
+
+    @st.fragment
+    @metrics.instrument("Extract table")
+    def extract_tables_panel(document: documents.DocumentHandle) -> None:
+        with st.form("extract_tables"):
+            page_numbers_str = helpers.select_pages(
                 container=st,
                 key="extract_table_pages",
-            ):
-                helpers.extract_tables(
-                    session_state["file"],
-                    page_numbers_str,
-                )
+            )
+            vertical_strategy, horizontal_strategy = helpers.select_table_strategies()
+            submitted = st.form_submit_button(
+                "Extract tables", use_container_width=True
+            )
 
-        with rcol.expander("🔄️ Convert to Word"):
-            st.caption("Takes ~1 second/page. Will remove password if present")
+        if submitted:
+            session_state["tables_request"] = (
+                document.digest,
+                page_numbers_str,
+                vertical_strategy,
+                horizontal_strategy,
+            )
 
-            if st.button("Convert PDF to Word", use_container_width=True):
-                st.download_button(
-                    "📥 Download Word document",
-                    data=helpers.convert_pdf_to_word(pdf),
-                    file_name=f"{session_state['name'][:-4]}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                    use_container_width=True,
+        # Extracted tables are cached, so showing them again on later reruns is cheap
+        request = session_state.get("tables_request")
+        if not request or not request[1] or request[0] != document.digest:
+            return
+
+        try:
+            tables = helpers.extract_tables(
+                document, *request[1:], password=session_state.password
+            )
+        except (IndexError, ValueError):
+            st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+            return
+
+        if not tables:
+            st.info("No tables found")
+            return
+
+        header = st.checkbox("Header", key="tables_header")
+        frames = helpers.tables_to_frames(tables, header=header)
+
+        for name, frame in frames.items():
+            st.caption(name.replace("_", " ").capitalize())
+            st.dataframe(frame)
+
+        lcol, rcol = st.columns([1, 2])
+        file_format = lcol.selectbox(
+            "Export format",
+            options=["CSV", "Excel", "Parquet"],
+            label_visibility="collapsed",
+        )
+        rcol.download_button(
+            "💾 Download all tables",
+            data=partial(helpers.export_tables, frames, file_format),
+            file_name=f"{session_state['name'].rsplit('.')[0]}_tables."
+            + ("xlsx" if file_format == "Excel" else "zip"),
+            mime=(
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                if file_format == "Excel"
+                else "application/zip"
+            ),
+            on_click="ignore",
+            use_container_width=True,
+        )
+
+    @st.fragment
+    @metrics.instrument("Convert to Word")
+    def convert_to_word_panel(document: documents.DocumentHandle) -> None:
+        st.caption(
+            "Takes ~1 second/page, spread across CPU cores. Will remove password if present"
+        )
+
+        page_numbers_str = helpers.select_pages(
+            container=st, key="convert_pages", label="Pages to convert"
+        )
+
+        if st.button("Convert PDF to Word", use_container_width=True):
+            try:
+                pages = helpers.selected_pages(
+                    document, page_numbers_str, session_state.password
                 )
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+                return
+            session_state["word_job"] = (
+                document.digest,
+                jobs.submit(
+                    "Convert to Word",
+                    tasks.convert_to_word,
+                    *helpers.job_input(document, session_state.password),
+                    pages=pages,
+                    key=(
+                        document.digest,
+                        "docx",
+                        pages,
+                        cache.password_key(session_state.password),
+                    ),
+                    file_name=f"{session_state['name'][:-4]}.docx",
+                ),
+            )
 
-        with lcol.expander(
-            f"🔐 {'Change' if session_state['is_encrypted'] else 'Add'} password"
-        ):
+        digest, job_id = session_state.get("word_job", (None, None))
+        if digest == document.digest and (job := helpers.show_job(job_id)):
+            st.download_button(
+                "📥 Download Word document",
+                data=job.result,
+                file_name=job.file_name,
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                on_click="ignore",
+                use_container_width=True,
+            )
+
+    @st.fragment
+    @metrics.instrument("Add password")
+    def add_password_panel(document: documents.DocumentHandle) -> None:
+        with st.form("add_password"):
             new_password = st.text_input(
                 "Enter password",
                 type="password",
@@ -124,54 +285,40 @@ try:
 
             algorithm = st.selectbox(
                 "Algorithm",
-                options=["RC4-40", "RC4-128", "AES-128", "AES-256-R5", "AES-256"],
+                options=tasks.ALGORITHMS,
                 index=3,
                 help="Use `RC4` for compatibility and `AES` for security",
             )
 
-            filename = f"protected_{session_state['name']}"
+            submitted = st.form_submit_button("🔒 Submit", use_container_width=True)
 
-            if st.button(
-                "🔒 Submit",
-                use_container_width=True,
-                disabled=(len(new_password) == 0),
-            ):
-                with PdfWriter() as writer:
-                    # Add all pages to the writer
-                    for page in reader.pages:
-                        writer.add_page(page)
-
-                    # Add a password to the new PDF
-                    writer.encrypt(new_password, algorithm=algorithm)
-
-                    # Save the new PDF to a file
-                    with open(filename, "wb") as f:
-                        writer.write(f)
+        if submitted:
+            if len(new_password) == 0:
+                st.error("Please enter a password", icon="🔒")
+                return
 
-            if os.path.exists(filename):
-                st.download_button(
-                    "📥 Download protected PDF",
-                    data=open(filename, "rb"),
-                    mime="application/pdf",
-                    file_name=filename,
-                    use_container_width=True,
-                )
+            # The document is cloned as a whole, replacing its current password
+            pdf, password = helpers.job_input(document, session_state.password)
+            protected = storage.keep(
+                tasks.encrypt_pdf(
+                    pdf, tasks.Protection(new_password, algorithm=algorithm), password
+                ),
+                "protected",
+            )
 
-        with rcol.expander("🔓 Remove password"):
-            if reader.is_encrypted:
-                st.download_button(
-                    "📥 Download unprotected PDF",
-                    data=open(session_state["decrypted_filename"], "rb"),
-                    mime="application/pdf",
-                    file_name=session_state["decrypted_filename"],
-                    use_container_width=True,
-                )
-            else:
-                st.info("PDF does not have a password")
+            st.download_button(
+                "📥 Download protected PDF",
+                data=storage.download_data(protected),
+                mime="application/pdf",
+                file_name=f"protected_{session_state['name']}",
+                on_click="ignore",
+                use_container_width=True,
+            )
 
-        with lcol.expander("🔃 Rotate PDF"):
-            # TODO: Add password back to converted PDF if original was protected
-            st.caption("Will remove password if present")
+    @st.fragment
+    @metrics.instrument("Rotate PDF")
+    def rotate_panel(document: documents.DocumentHandle, reader: PdfReader) -> None:
+        with st.form("rotate"):
             angle = st.slider(
                 "Clockwise angle",
                 min_value=0,
@@ -179,28 +326,38 @@ try:
                 step=90,
                 format="%d°",
             )
+            page_numbers_str = helpers.select_pages(
+                container=st, key="rotate_pages", label="Pages to rotate"
+            )
+            protection = helpers.keep_password(reader, session_state.password, "rotate")
+            submitted = st.form_submit_button("🔃 Rotate", use_container_width=True)
 
-            with PdfWriter() as writer:
-                for page in reader.pages:
-                    writer.add_page(page)
-                    writer.pages[-1].rotate(angle)
-
-                # TODO: Write to byte_stream
-                writer.write("rotated.pdf")
-
-                with open("rotated.pdf", "rb") as f:
-                    st.pdf(f.read(), height=250)
-                    st.download_button(
-                        "📥 Download rotated PDF",
-                        data=f,
-                        mime="application/pdf",
-                        file_name=f"{session_state['name'].rsplit('.')[0]}_rotated_{angle}.pdf",
-                        use_container_width=True,
-                    )
+        if submitted:
+            try:
+                rotated = helpers.rotate_pdf(
+                    document, angle, page_numbers_str, session_state.password
+                )
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+                return
+            # Thumbnails of the output, rather than another copy of it in the viewer
+            preview = documents.create_handle(rotated)
+            helpers.show_pages(preview, preview.page_count, key="rotated")
+            rotated = storage.keep(rotated, "rotated")
+            st.download_button(
+                "📥 Download rotated PDF",
+                data=helpers.protected_data(rotated, protection),
+                mime="application/pdf",
+                file_name=f"{session_state['name'].rsplit('.')[0]}_rotated_{angle}.pdf",
+                on_click="ignore",
+                use_container_width=True,
+            )
+            helpers.apply_button(rotated, f"Rotate {angle}°", "rotate")
 
-        with rcol.expander("↔ Resize/Scale PDF"):
-            # TODO: Add password back to converted PDF if original was protected
-            st.caption("Will remove password if present")
+    @st.fragment
+    @metrics.instrument("Resize/Scale PDF")
+    def scale_panel(document: documents.DocumentHandle, reader: PdfReader) -> None:
+        with st.form("scale"):
             new_size = st.selectbox(
                 "New size",
                 options={
@@ -222,182 +379,557 @@ try:
                 help="Scale content independently of the page size",
                 format="%fx",
             )
-
-            with PdfWriter() as writer:
-                for page in reader.pages:
-                    page.scale_to(
-                        width=getattr(PaperSize, new_size).width,
-                        height=getattr(PaperSize, new_size).height,
+            page_numbers_str = helpers.select_pages(
+                container=st, key="scale_pages", label="Pages to scale"
+            )
+            protection = helpers.keep_password(reader, session_state.password, "scale")
+            submitted = st.form_submit_button("↔ Scale", use_container_width=True)
+
+        if submitted:
+            try:
+                scaled = helpers.scale_pdf(
+                    document,
+                    new_size,
+                    scale_content,
+                    page_numbers_str,
+                    session_state.password,
+                )
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+                return
+            st.caption("Content scaling preview")
+            preview = documents.create_handle(scaled)
+            helpers.show_pages(preview, preview.page_count, key="scaled")
+            scaled = storage.keep(scaled, "scaled")
+            st.download_button(
+                "📥 Download scaled PDF",
+                data=helpers.protected_data(scaled, protection),
+                mime="application/pdf",
+                file_name=f"{session_state['name'].rsplit('.')[0]}_scaled_{new_size}_{scale_content}x.pdf",
+                on_click="ignore",
+                use_container_width=True,
+            )
+            helpers.apply_button(scaled, f"Scale to {new_size}", "scale")
+
+    @st.fragment
+    @metrics.instrument("Merge PDFs")
+    def merge_panel(document: documents.DocumentHandle) -> None:
+        st.caption(
+            "Documents are appended to this one, in the order given. Passwords of the other documents will be removed."
+        )
+        others = helpers.load_merge_documents()
+        names = [session_state["name"], *(name for name, _ in others)]
+        handles = [document, *(handle for _, handle in others)]
+
+        table = st.data_editor(
+            {
+                "Document": names,
+                "Pages": ["all"] * len(names),
+                "Order": list(range(1, len(names) + 1)),
+            },
+            column_config={
+                "Pages": st.column_config.TextColumn(help="e.g. all, or 1-3, 5"),
+                "Order": st.column_config.NumberColumn(min_value=1, step=1),
+            },
+            disabled=["Document"],
+            hide_index=True,
+            # Edits are kept for as long as the same documents are listed
+            key=f"merge_table_{'_'.join(handle.digest[:8] for handle in handles)}",
+            use_container_width=True,
+        )
+        bookmarks = st.toggle(
+            "Bookmark each document",
+            value=True,
+            help="Add a bookmark per document, with the document's own bookmarks under it.",
+        )
+        protection = helpers.keep_password(
+            helpers.get_reader(document, session_state.password),
+            session_state.password,
+            "merge",
+        )
+
+        if st.button(
+            "➕ Merge PDFs", disabled=len(handles) < 2, use_container_width=True
+        ):
+            sources, keys = [], []
+            try:
+                for index in sorted(
+                    range(len(handles)), key=lambda index: table["Order"][index] or 0
+                ):
+                    password = session_state.password if index == 0 else None
+                    reader = helpers.get_reader(handles[index], password)
+                    if reader.is_encrypted and not password:
+                        raise FileNotDecryptedError(names[index])
+                    pages = helpers.get_page_indices(
+                        reader, table["Pages"][index] or "all"
                     )
-                    op = Transformation().scale(sx=scale_content, sy=scale_content)
-                    page.add_transformation(op)
-                    writer.add_page(page)
-
-                # TODO: Write to byte_stream
-                writer.write("scaled.pdf")
-
-                with open("scaled.pdf", "rb") as f:
-                    st.caption("Content scaling preview")
-                    st.pdf(f.read(), height=250)
-                    st.download_button(
-                        "📥 Download scaled PDF",
-                        data=f,
-                        mime="application/pdf",
-                        file_name=f"{session_state['name'].rsplit('.')[0]}_scaled_{new_size}_{scale_content}x.pdf",
-                        use_container_width=True,
+                    keys.append(
+                        (
+                            handles[index].digest,
+                            tuple(pages),
+                            cache.password_key(password),
+                        )
                     )
+                    pdf, password = helpers.job_input(handles[index], password)
+                    sources.append(
+                        tasks.MergeSource(
+                            pdf, names[index].rsplit(".", 1)[0], password, tuple(pages)
+                        )
+                    )
+            except FileNotDecryptedError as error:
+                st.error(f"Remove the password of {error} first.", icon="🔒")
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+            else:
+                session_state["merge_job"] = document.digest, jobs.submit(
+                    "Merge PDFs",
+                    tasks.merge_pdfs,
+                    sources,
+                    storage.session_dir() / f"merged_{uuid.uuid4().hex}.pdf",
+                    bookmarks=bookmarks,
+                    protection=protection,
+                    # Per session, as the output is written to the session's directory
+                    key=(
+                        str(storage.session_dir()),
+                        "merge",
+                        bookmarks,
+                        protection is not None,
+                        *keys,
+                    ),
+                    file_name="merged.pdf",
+                )
 
-        with lcol.expander("➕ Merge PDFs"):
-            # TODO: Add password back to converted PDF if original was protected
-            st.caption(
-                "Second PDF will be appended to the first. Passwords will be removed from both."
+        digest, job_id = session_state.get("merge_job", (None, None))
+        if digest == document.digest and (job := helpers.show_job(job_id)):
+            st.download_button(
+                "📥 Download merged PDF",
+                data=storage.download_data(job.result),
+                mime="application/pdf",
+                file_name=job.file_name,
+                on_click="ignore",
+                use_container_width=True,
             )
-            # TODO: Add more merge options (https://pypdf.readthedocs.io/en/stable/user/merging-pdfs.html#showing-more-merging-options)
-            pdf_to_merge, reader_to_merge, *_ = helpers.load_pdf(key="merge")
-
-            if st.button(
-                "➕ Merge PDFs", disabled=(not pdf_to_merge), use_container_width=True
-            ):
-                with PdfWriter() as merger:
-                    for file in (reader, reader_to_merge):
-                        merger.append(file)
+            helpers.apply_button(job.result, "Merge PDFs", "merge")
 
-                    # TODO: Write to byte_stream
-                    merger.write("merged.pdf")
-
-                    st.pdf(
-                        open("merged.pdf", "rb").read(),
-                        height=250,
-                    )
-                    st.download_button(
-                        "📥 Download merged PDF",
-                        data=open("merged.pdf", "rb"),
-                        mime="application/pdf",
-                        file_name="merged.pdf",
-                        use_container_width=True,
-                    )
-        # create a watermark
-        with rcol.expander("©️ Add watermark"):
-            if text_watermark := st.text_input(
+    @st.fragment
+    @metrics.instrument("Add watermark")
+    def watermark_panel(document: documents.DocumentHandle) -> None:
+        with st.form("watermark"):
+            text_watermark = st.text_input(
                 "Enter watermark text",
                 placeholder="PDF-Workdesk Watermark",
-            ):
-                size_watermark = st.slider(
-                    "Font size", min_value=6, max_value=30, value=12
-                )
-                lcol, rcol_inner = st.columns([1, 3])
-                color = lcol.color_picker("Color", "#F90004")
-                transparency = rcol_inner.slider(
-                    "Opacity", min_value=0.0, max_value=1.0, value=0.8
-                )
+            )
+            size_watermark = st.slider("Font size", min_value=6, max_value=30, value=12)
+            lcol, rcol_inner = st.columns([1, 3])
+            color = lcol.color_picker("Color", "#F90004")
+            transparency = rcol_inner.slider(
+                "Opacity", min_value=0.0, max_value=1.0, value=0.8
+            )
+            page_numbers_str = helpers.select_pages(
+                container=st,
+                key="watermark_pages",
+                label="Pages to watermark",
+            )
+            protection = helpers.keep_password(
+                helpers.get_reader(document, session_state.password),
+                session_state.password,
+                "watermark",
+            )
+            submitted = st.form_submit_button(
+                "©️ Add watermark", use_container_width=True
+            )
 
+        if submitted and text_watermark:
+            try:
                 watermarked_pdf = helpers.watermark_pdf(
-                    pdf=pdf,
+                    document=document,
                     stamp_label=text_watermark,
                     stamp_size=size_watermark,
                     stamp_color=color,
                     stamp_transparency=transparency,
+                    pages=page_numbers_str,
+                    password=session_state.password,
                 )
-                st.pdf(watermarked_pdf, height=400)
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+                return
 
-                st.download_button(
-                    "📥 Download watermarked PDF",
-                    data=watermarked_pdf,
-                    mime="application/pdf",
-                    file_name="watermarked.pdf",
-                    use_container_width=True,
-                )
+            preview = documents.create_handle(watermarked_pdf)
+            helpers.show_pages(preview, preview.page_count, key="watermarked")
 
-        with st.expander("🤏 Reduce PDF size"):
-            # TODO: Add password back to converted PDF if original was protected
-            st.caption("Will remove password if present")
-
-            pdf_small = pdf
-
-            lcol, mcol, rcol = st.columns(3)
-
-            with lcol:
-                remove_duplication = st.toggle(
-                    "Remove duplication",
-                    help="""
-                    Some PDF documents contain the same object multiple times.  
-                    For example, if an image appears three times in a PDF it could be embedded three times. 
-                    Or it can be embedded once and referenced twice.  
-                    **Note:** This option will not remove objects, rather it will use a reference to the original object for subsequent uses.
-                    """,
-                )
+            st.download_button(
+                "📥 Download watermarked PDF",
+                data=helpers.protected_data(watermarked_pdf, protection),
+                mime="application/pdf",
+                file_name="watermarked.pdf",
+                on_click="ignore",
+                use_container_width=True,
+            )
+            helpers.apply_button(
+                watermarked_pdf, f"Watermark “{text_watermark}”", "watermark"
+            )
 
-                remove_images = st.toggle(
-                    "Remove images",
-                    help="Remove images from the PDF. Will also remove duplication.",
-                )
+    @st.fragment
+    @metrics.instrument("Reduce PDF size")
+    def reduce_size_panel(
+        document: documents.DocumentHandle, reader: PdfReader
+    ) -> None:
+        with st.expander("📊 Size breakdown"):
+            helpers.show_size_report(
+                helpers.size_report(document, session_state.password)
+            )
 
-                if remove_images or remove_duplication:
-                    pdf_small = helpers.remove_images(
-                        pdf,
-                        remove_images=remove_images,
-                        password=session_state.password,
-                    )
+        lcol, mcol, rcol = st.columns(3)
+
+        with lcol:
+            remove_duplication = st.toggle(
+                "Remove duplication",
+                help="""
+                Some PDF documents contain the same object multiple times.  
+                For example, if an image appears three times in a PDF it could be embedded three times. 
+                Or it can be embedded once and referenced twice.  
+                **Note:** This option will not remove objects, rather it will use a reference to the original object for subsequent uses.
+                """,
+            )
 
-                if st.toggle(
-                    "Reduce image quality",
-                    help="""
-                    Reduce the quality of images in the PDF. Will also remove duplication.  
-                    May not work for all cases.
-                    """,
+            remove_images = st.toggle(
+                "Remove images",
+                help="Remove images from the PDF. Will also remove duplication.",
+            )
+
+            if reduce_quality := st.toggle(
+                "Reduce image quality",
+                help="""
+                Re-encode images in the PDF as JPEG. Will also remove duplication.  
+                Images are only replaced if that makes them smaller; images with transparency masks are kept.
+                """,
+                disabled=remove_images,
+            ):
+                quality = st.slider(
+                    "Quality",
+                    min_value=0,
+                    max_value=100,
+                    value=50,
                     disabled=remove_images,
-                ):
-                    quality = st.slider(
-                        "Quality",
-                        min_value=0,
-                        max_value=100,
-                        value=50,
-                        disabled=remove_images,
+                )
+                dpi = st.selectbox(
+                    "Max resolution",
+                    [None, 300, 150, 96, 72],
+                    format_func=lambda dpi: f"{dpi} DPI" if dpi else "Original",
+                    help="Downsample images with more pixels than needed to print them at this resolution.",
+                )
+                grayscale = st.checkbox("Grayscale")
+
+            lossless = st.toggle(
+                "Lossless compression",
+                help="Compress PDF without losing quality. Also merges fonts, images and other objects embedded more than once.",
+            )
+            page_numbers_str = helpers.select_pages(
+                container=st,
+                key="reduce_pages",
+                label="Pages to reduce",
+            )
+            protection = helpers.keep_password(reader, session_state.password, "reduce")
+
+            if st.button("🤏 Reduce", use_container_width=True):
+                try:
+                    pages = helpers.selected_pages(
+                        document, page_numbers_str, session_state.password
                     )
-                    pdf_small = helpers.reduce_image_quality(
-                        pdf_small,
-                        quality,
-                        password=session_state.password,
+                except (IndexError, ValueError):
+                    st.error(
+                        "Specified pages don't exist. Check the format.", icon="⚠️"
                     )
+                    return
+                options = {
+                    "remove_duplication": remove_duplication,
+                    "remove_images": remove_images,
+                    "quality": quality if reduce_quality else None,
+                    "dpi": dpi if reduce_quality else None,
+                    "grayscale": grayscale if reduce_quality else False,
+                    "lossless": lossless,
+                    "pages": pages,
+                }
+                session_state["reduce_job"] = (
+                    document.digest,
+                    jobs.submit(
+                        "Reduce PDF size",
+                        tasks.reduce_size,
+                        *helpers.job_input(document, session_state.password),
+                        key=(
+                            document.digest,
+                            "reduce",
+                            *options.values(),
+                            protection is not None,
+                            cache.password_key(session_state.password),
+                        ),
+                        file_name=f"{session_state['name'].rsplit('.')[0]}_reduced.pdf",
+                        protection=protection,
+                        **options,
+                    ),
+                )
 
-                if st.toggle(
-                    "Lossless compression",
-                    help="Compress PDF without losing quality",
-                ):
-                    pdf_small = helpers.compress_pdf(
-                        pdf_small, password=session_state.password
+            digest, job_id = session_state.get("reduce_job", (None, None))
+            if digest != document.digest or not (job := helpers.show_job(job_id)):
+                return
+            reduced = documents.create_handle(job.result)
+
+            original_size = document.size
+            reduced_size = reduced.size
+            st.caption(f"Reduction: {100 - (reduced_size / original_size) * 100:.2f}%")
+
+        with mcol:
+            st.caption(f"Original size: {original_size / 1024:.2f} KB")
+            helpers.preview_pdf(
+                reader,
+                document,
+                key="original",
+                password=session_state.password,
+            )
+        with rcol:
+            st.caption(f"Reduced size: {reduced_size / 1024:.2f} KB")
+            helpers.preview_pdf(
+                helpers.get_reader(reduced, session_state.password),
+                reduced,
+                key="reduced",
+                password=session_state.password,
+            )
+        st.download_button(
+            "📥 Download smaller PDF",
+            data=reduced.pdf,
+            mime="application/pdf",
+            file_name=job.file_name,
+            on_click="ignore",
+            use_container_width=True,
+        )
+        helpers.apply_button(reduced.pdf, "Reduce size", "reduce")
+
+    @st.fragment
+    @metrics.instrument("Combine operations")
+    def pipeline_panel(document: documents.DocumentHandle, reader: PdfReader) -> None:
+        st.caption(
+            "Rotate, scale, watermark and compress the PDF in one pass, with a single download."
+        )
+        with st.form("pipeline"):
+            lcol, rcol = st.columns(2)
+            angle = lcol.select_slider(
+                "Rotate", options=[0, 90, 180, 270], format_func=lambda a: f"{a}°"
+            )
+            paper_size = rcol.selectbox(
+                "Scale to",
+                options=[
+                    None,
+                    *(
+                        attr
+                        for attr in dir(PaperSize)
+                        if not attr.startswith("__")
+                        and not callable(getattr(PaperSize, attr))
+                    ),
+                ],
+                format_func=lambda size: size or "Keep size",
+            )
+            stamp = lcol.text_input("Watermark text", placeholder="No watermark")
+            page_numbers_str = helpers.select_pages(
+                container=rcol,
+                key="pipeline_pages",
+                label="Pages to rotate, scale and watermark",
+            )
+            lossless = lcol.toggle("Lossless compression")
+            remove_duplication = rcol.toggle("Remove duplication")
+            quality = st.slider(
+                "Image quality",
+                min_value=0,
+                max_value=100,
+                value=100,
+                help="Re-encode images as JPEG below 100",
+            )
+            protection = helpers.keep_password(
+                reader, session_state.password, "pipeline"
+            )
+            submitted = st.form_submit_button("⛓️ Run", use_container_width=True)
+
+        if submitted:
+            stages = []
+            if angle:
+                stages.append(pipeline.Rotate(angle, page_numbers_str))
+            if paper_size:
+                stages.append(
+                    pipeline.Scale(
+                        *getattr(PaperSize, paper_size), pages=page_numbers_str
                     )
-
-                original_size = sys.getsizeof(pdf)
-                reduced_size = sys.getsizeof(pdf_small)
-                st.caption(
-                    f"Reduction: {100 - (reduced_size / original_size) * 100:.2f}%"
                 )
-
-            with mcol:
-                st.caption(f"Original size: {original_size / 1024:.2f} KB")
-                helpers.preview_pdf(
-                    reader,
-                    pdf,
-                    key="other",
-                    password=session_state.password,
+            if stamp:
+                stages.append(pipeline.Watermark(stamp, pages=page_numbers_str))
+            if lossless or remove_duplication or quality < 100:
+                stages.append(
+                    pipeline.Compress(
+                        remove_duplication=remove_duplication,
+                        quality=quality if quality < 100 else None,
+                        lossless=lossless,
+                    )
                 )
-            with rcol:
-                st.caption(f"Reduced size: {reduced_size / 1024:.2f} KB")
-                helpers.preview_pdf(
-                    PdfReader(BytesIO(pdf_small)),
-                    pdf_small,
-                    key="other",
-                    password=session_state.password,
+            if not stages:
+                st.info("Select at least one operation")
+                return
+            try:
+                helpers.selected_pages(
+                    document, page_numbers_str, session_state.password
                 )
-            st.download_button(
-                "📥 Download smaller PDF",
-                data=pdf_small,
-                mime="application/pdf",
-                file_name=f"{filename}_reduced.pdf",
-                use_container_width=True,
+            except (IndexError, ValueError):
+                st.error("Specified pages don't exist. Check the format.", icon="⚠️")
+                return
+            if protection is not None:
+                stages.append(pipeline.Encrypt(**vars(protection)))
+
+            session_state["pipeline_job"] = document.digest, jobs.submit(
+                "Combine operations",
+                pipeline.run_pipeline,
+                *helpers.job_input(document, session_state.password),
+                pipeline=pipeline.Pipeline(tuple(stages)),
+                key=(
+                    document.digest,
+                    "pipeline",
+                    # Without the passwords of the encrypt stage
+                    *(stage for stage in stages if stage.name != "encrypt"),
+                    protection is not None,
+                    cache.password_key(session_state.password),
+                ),
+                file_name=f"{session_state['name'].rsplit('.')[0]}_processed.pdf",
             )
 
+        digest, job_id = session_state.get("pipeline_job", (None, None))
+        if digest != document.digest or not (job := helpers.show_job(job_id)):
+            return
+        result = job.result
+        st.caption(
+            f"Size: {len(result.pdf) / 1024:.2f} KB. Time per stage: "
+            + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in result.timings)
+        )
+        st.download_button(
+            "📥 Download processed PDF",
+            data=result.pdf,
+            mime="application/pdf",
+            file_name=job.file_name,
+            on_click="ignore",
+            use_container_width=True,
+        )
+        helpers.apply_button(result.pdf, "Combine operations", "pipeline")
+
+    @metrics.instrument("Jobs")
+    def jobs_panel() -> None:
+        polling = any(job.active for job in jobs.session_jobs())
+
+        # Refresh while this session has unfinished jobs
+        @st.fragment(run_every=jobs.POLL_INTERVAL if polling else None)
+        def panel() -> None:
+            session_jobs = jobs.session_jobs()
+            if polling and not any(job.active for job in session_jobs):
+                # Stop polling, and let panels show the results
+                st.rerun()
+            if not session_jobs:
+                st.info("No jobs yet")
+                return
+
+            for job in reversed(session_jobs):
+                lcol, mcol, rcol = st.columns([2, 3, 1])
+                lcol.write(f"**{job.label}**")
+                if job.active:
+                    mcol.progress(
+                        job.fraction,
+                        text=(f"{job.fraction:.0%}" if job.total else job.status),
+                    )
+                    if rcol.button("Cancel", key=f"cancel_job_{job.id}"):
+                        jobs.scheduler().cancel(job.id)
+                else:
+                    mcol.caption(f"{job.status.capitalize()} in {job.elapsed:.1f} s")
+                    if job.status == "done":
+                        result = job.result
+                        if isinstance(result, pipeline.PipelineResult):
+                            result = result.pdf
+                        rcol.download_button(
+                            "📥",
+                            data=storage.download_data(result),
+                            file_name=job.file_name,
+                            on_click="ignore",
+                            key=f"download_job_{job.id}",
+                        )
+
+        panel()
+
+    try:
+        with metrics.timed("Load PDF"):
+            (
+                document,
+                reader,
+                session_state["password"],
+                session_state["is_encrypted"],
+            ) = helpers.load_pdf(key="main")
+
+    except FileNotDecryptedError:
+        document = "password_required"
+
+    if document == "password_required":
+        st.error("PDF is password protected. Please enter the password to proceed.")
+    elif document:
+        lcol, rcol = st.columns(2)
+        with lcol.expander(label="🔍 Extract text"):
+            extract_text_panel(document, reader)
+
+        with rcol.expander(label="️🖼️ Extract images"):
+            extract_images_panel(document)
+
+        with lcol.expander("📊 Extract table"):
+            extract_tables_panel(document)
+
+        with rcol.expander("🔄️ Convert to Word"):
+            convert_to_word_panel(document)
+
+        with lcol.expander(
+            f"🔐 {'Change' if session_state['is_encrypted'] else 'Add'} password"
+        ):
+            add_password_panel(document)
+
+        with rcol.expander("🔓 Remove password"):
+            if reader.is_encrypted:
+                st.download_button(
+                    "📥 Download unprotected PDF",
+                    data=partial(
+                        helpers.decrypted_pdf, document, session_state.password
+                    ),
+                    mime="application/pdf",
+                    file_name=f"unprotected_{session_state['name']}",
+                    on_click="ignore",
+                    use_container_width=True,
+                )
+            else:
+                st.info("PDF does not have a password")
+
+        with lcol.expander("🔃 Rotate PDF"):
+            rotate_panel(document, reader)
+
+        with rcol.expander("↔ Resize/Scale PDF"):
+            scale_panel(document, reader)
+
+        with lcol.expander("➕ Merge PDFs"):
+            merge_panel(document)
+
+        # create a watermark
+        with rcol.expander("©️ Add watermark"):
+            watermark_panel(document)
+
+        with st.expander("🤏 Reduce PDF size"):
+            reduce_size_panel(document, reader)
+
+        with st.expander("⛓️ Combine operations"):
+            pipeline_panel(document, reader)
+
+    with st.expander("⏳ Jobs"):
+        jobs_panel()
+
+    if metrics.DEBUG:
+        # Last, so it shows this run's measurements
+        render_sidebar.render_debug()
+
 except Exception as e:
     st.error(
         f"""The app has encountered an error:  
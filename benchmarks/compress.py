@@ -0,0 +1,57 @@
+"""
+Compare the serial `compress_content_streams` loop with the lossless compression
+engine, by output size and wall time.
+
+Run from the repository root with `python -m benchmarks.compress [pages]`.
+"""
+
+import sys
+import time
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+from benchmarks.synthetic import image_pdf, text_pdf
+from utils import tasks
+
+
+def _legacy(pdf: bytes) -> bytes:
+    writer = PdfWriter(clone_from=PdfReader(BytesIO(pdf)))
+    for page in writer.pages:
+        page.compress_content_streams()
+    with BytesIO() as fp:
+        writer.write(fp)
+        return fp.getvalue()
+
+
+def main(pages: int = 500) -> None:
+    documents = {
+        "uncompressed text": text_pdf(pages, compressed=False),
+        "compressed text": text_pdf(pages),
+        "merged copies with images": image_pdf(max(1, pages // 10), copies=10),
+    }
+
+    for name, pdf in documents.items():
+        print(
+            f"{name}: {len(PdfReader(BytesIO(pdf)).pages)} pages, {len(pdf) / 1024:.0f} KB"
+        )
+
+        start = time.perf_counter()
+        output = _legacy(pdf)
+        print(
+            f"  legacy (compress_content_streams): {time.perf_counter() - start:.2f} s, "
+            f"{len(output) / 1024:.0f} KB"
+        )
+
+        timings = {}
+        start = time.perf_counter()
+        output = tasks.compress_pdf(pdf, timings=timings)
+        print(
+            f"  compression engine: {time.perf_counter() - start:.2f} s, "
+            f"{len(output) / 1024:.0f} KB "
+            f"({', '.join(f'{stage} {seconds:.2f} s' for stage, seconds in timings.items())})"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
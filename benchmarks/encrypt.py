@@ -0,0 +1,60 @@
+"""
+Compare encrypting a page-by-page copy with encrypting a clone of the document,
+for each algorithm offered by the app, by wall time and output size.
+
+Run from the repository root with `python -m benchmarks.encrypt [pages]`.
+"""
+
+import sys
+import time
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+from benchmarks.synthetic import image_pdf, text_pdf
+from utils import tasks
+
+PASSWORD = "benchmark"
+
+
+def _legacy(pdf: bytes, algorithm: str) -> bytes:
+    writer = PdfWriter()
+    for page in PdfReader(BytesIO(pdf)).pages:
+        writer.add_page(page)
+    writer.encrypt(PASSWORD, algorithm=algorithm)
+    with BytesIO() as fp:
+        writer.write(fp)
+        return fp.getvalue()
+
+
+def main(pages: int = 500) -> None:
+    documents = {
+        "text": text_pdf(pages),
+        "images": image_pdf(max(1, pages // 10), copies=10),
+    }
+
+    for name, pdf in documents.items():
+        print(
+            f"{name}: {len(PdfReader(BytesIO(pdf)).pages)} pages, {len(pdf) / 1024:.0f} KB"
+        )
+
+        for algorithm in tasks.ALGORITHMS:
+            start = time.perf_counter()
+            output = _legacy(pdf, algorithm)
+            legacy = time.perf_counter() - start, len(output)
+
+            start = time.perf_counter()
+            output = tasks.encrypt_pdf(
+                pdf, tasks.Protection(PASSWORD, algorithm=algorithm)
+            )
+            cloned = time.perf_counter() - start, len(output)
+
+            print(
+                f"  {algorithm}: legacy (add_page) {legacy[0]:.2f} s, "
+                f"{legacy[1] / 1024:.0f} KB; clone {cloned[0]:.2f} s, "
+                f"{cloned[1] / 1024:.0f} KB"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
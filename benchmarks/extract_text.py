@@ -0,0 +1,53 @@
+"""
+Compare serial and page-parallel text extraction.
+
+Run from the repository root with `python -m benchmarks.extract_text [pages]`.
+"""
+
+import sys
+import time
+from functools import partial
+from io import BytesIO
+
+from pypdf import PdfReader
+
+from benchmarks.synthetic import text_pdf
+from utils import parallel
+
+
+def _legacy(reader: PdfReader) -> str:
+    text = ""
+    for page in reader.pages:
+        text = text + " " + page.extract_text(extraction_mode="plain")
+    return text
+
+
+def main(pages: int = 1000) -> None:
+    pdf = text_pdf(pages)
+    print(f"{pages} pages, {len(pdf) / 1024:.0f} KB")
+
+    start = time.perf_counter()
+    _legacy(PdfReader(BytesIO(pdf)))
+    print(f"legacy (string concatenation): {time.perf_counter() - start:.2f} s")
+
+    for workers in sorted({1, parallel.max_workers()}):
+        start = time.perf_counter()
+        first = None
+        for i, _ in enumerate(
+            parallel.map_pages(
+                partial(parallel.page_text, mode="plain"),
+                pdf,
+                list(range(pages)),
+                workers=workers,
+            )
+        ):
+            if i == 0:
+                first = time.perf_counter() - start
+        print(
+            f"map_pages, {workers} worker(s): {time.perf_counter() - start:.2f} s "
+            f"(first page after {first:.2f} s)"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
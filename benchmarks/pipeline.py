@@ -0,0 +1,61 @@
+"""
+Compare running rotate, scale, watermark, compress and encrypt one after the other
+with running them as one pipeline, by wall time and output size.
+
+Run from the repository root with `python -m benchmarks.pipeline [pages]`.
+"""
+
+import sys
+import time
+from functools import partial
+
+from pypdf import PaperSize
+
+from benchmarks.synthetic import text_pdf
+from utils import incremental, pipeline, tasks
+
+WATERMARK = ("PDF-Workdesk Watermark", 12, "#F90004", 0.8)
+PROTECTION = tasks.Protection("benchmark")
+
+
+def _sequential(pdf: bytes) -> bytes:
+    # Each operation parses the previous one's output and writes its own
+    pdf = tasks.rotate_pages(pdf, 90)
+    pdf = tasks.scale_pages(pdf, *PaperSize.A4)
+    update = incremental.open_update(pdf)
+    tasks.watermark_update(update, partial(tasks.create_watermark_canvas, *WATERMARK))
+    pdf = update.to_bytes()
+    pdf = tasks.reduce_size(pdf, remove_duplication=True, lossless=True)
+    return tasks.encrypt_pdf(pdf, PROTECTION)
+
+
+def main(pages: int = 500) -> None:
+    pdf = text_pdf(pages)
+    print(f"{pages} pages, {len(pdf) / 1024:.0f} KB")
+
+    start = time.perf_counter()
+    output = _sequential(pdf)
+    print(
+        f"one operation after the other: {time.perf_counter() - start:.2f} s, "
+        f"{len(output) / 1024:.0f} KB"
+    )
+
+    start = time.perf_counter()
+    result = pipeline.Pipeline(
+        (
+            pipeline.Rotate(90),
+            pipeline.Scale(*PaperSize.A4),
+            pipeline.Watermark(*WATERMARK),
+            pipeline.Compress(remove_duplication=True, lossless=True),
+            pipeline.Encrypt(PROTECTION.user_password),
+        )
+    ).run(pdf)
+    print(
+        f"pipeline: {time.perf_counter() - start:.2f} s, "
+        f"{len(result.pdf) / 1024:.0f} KB "
+        f"({', '.join(f'{name} {seconds:.2f} s' for name, seconds in result.timings)})"
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""
+Compare rotating a few pages by copying every page with rotating them in an
+incremental update.
+
+Run from the repository root with `python -m benchmarks.rotate [pages] [selection]`.
+"""
+
+import sys
+import time
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+from benchmarks.synthetic import text_pdf
+from utils import selection, tasks
+
+
+def _legacy(pdf: bytes, pages: selection.PageSelection) -> bytes:
+    writer = PdfWriter()
+    for index, page in enumerate(PdfReader(BytesIO(pdf)).pages):
+        writer.add_page(page)
+        if index in pages:
+            writer.pages[-1].rotate(90)
+    with BytesIO() as fp:
+        writer.write(fp)
+        return fp.getvalue()
+
+
+def main(pages: int = 10000, selected: str = "1, 5000, -1") -> None:
+    pdf = text_pdf(pages, lines=5)
+    print(f"{pages} pages, {len(pdf) / 1024:.0f} KB, rotating pages {selected}")
+    selected = selection.PageSelection.parse(selected, pages)
+
+    start = time.perf_counter()
+    output = _legacy(pdf, selected)
+    print(
+        f"legacy (add_page per page): {time.perf_counter() - start:.2f} s, "
+        f"{len(output) / 1024:.0f} KB"
+    )
+
+    start = time.perf_counter()
+    output = tasks.rotate_pages(pdf, 90, selected)
+    print(
+        f"incremental update: {time.perf_counter() - start:.2f} s, "
+        f"{len(output) / 1024:.0f} KB"
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]), *sys.argv[2:3])
@@ -0,0 +1,366 @@
+"""
+Measure the wall time and peak memory of every operation on synthetic documents,
+and compare them with a baseline.
+
+Run from the repository root with `python -m benchmarks.suite`, e.g.
+
+    python -m benchmarks.suite --pages 10 100 --output baseline.json
+    python -m benchmarks.suite --pages 10 100 --baseline baseline.json
+
+which exits with status 1 if any operation got slower, or used more memory, than
+in the baseline by more than `--threshold` (20% by default). See `--help` for the
+other options.
+
+Operations are measured through the functions the app's operations call (e.g.
+`tasks.rotate_pages` for "Rotate"), without the app's caches, which would return
+the first repetition's result. The documents are generated with reportlab, so no
+network access or sample files are needed.
+
+Wall time is the fastest of `--repeat` runs. Peak memory is measured with
+`tracemalloc` in a separate run, as tracing slows everything down, and only
+counts this process's Python allocations: work done by worker processes (e.g.
+extracting text from large documents, see `parallel.map_pages`) isn't included.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from functools import lru_cache, partial
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pypdf
+from pypdf import PaperSize
+
+from benchmarks import synthetic
+from utils import incremental, parallel, tasks
+
+PASSWORD = "benchmark"
+PAGE_COUNTS = (10, 100, 1000, 5000)
+# Differences smaller than this are noise, whatever the threshold
+MIN_SECONDS = 0.05
+MIN_PEAK_BYTES = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def document(kind: str, pages: int) -> bytes:
+    """A synthetic document of a kind, generated once per run."""
+    if kind == "text":
+        # Uncompressed, so compressing has content streams to compress
+        return synthetic.text_pdf(pages, compressed=False)
+    if kind == "image":
+        return synthetic.image_pdf(pages)
+    if kind == "table":
+        return synthetic.table_pdf(pages)
+    if kind == "encrypted":
+        return synthetic.encrypted_pdf(pages, PASSWORD)
+    raise ValueError(f"Unknown document kind {kind!r}")
+
+
+def _password(kind: str) -> Optional[str]:
+    return PASSWORD if kind == "encrypted" else None
+
+
+def extract_text(pdf: bytes, password: Optional[str]) -> int:
+    text = parallel.map_pages(
+        partial(parallel.page_text, mode="plain"),
+        pdf,
+        list(range(len(parallel.open_reader(pdf, password).pages))),
+        password=password,
+    )
+    return sum(len(page) for page in text)
+
+
+def extract_images(pdf: bytes, password: Optional[str]) -> int:
+    # Lists the images drawn on every page, then decodes each distinct one, as
+    # exporting them does
+    reader = parallel.open_reader(pdf, password)
+    pages = list(range(len(reader.pages)))
+    exported = set()
+    size = 0
+    for page, placements in zip(
+        pages,
+        parallel.map_pages(
+            parallel.page_image_placements, pdf, pages, password, opened=reader
+        ),
+    ):
+        for path, reference, *_ in placements:
+            if reference not in exported:
+                exported.add(reference)
+                size += len(reader.pages[page].images[path].data)
+    return size
+
+
+def extract_tables(pdf: bytes, password: Optional[str]) -> int:
+    plumber = parallel.open_plumber(pdf, password)
+    tables = parallel.map_pages(
+        partial(
+            parallel.page_tables, vertical_strategy="text", horizontal_strategy="text"
+        ),
+        pdf,
+        list(range(len(plumber.pages))),
+        password=password,
+        opened=plumber,
+        opener=parallel.open_plumber,
+    )
+    return sum(len(page_tables) for page_tables in tables)
+
+
+def compress_pdf(pdf: bytes, password: Optional[str]) -> int:
+    return len(tasks.compress_pdf(pdf, password))
+
+
+def remove_images(pdf: bytes, password: Optional[str]) -> int:
+    return len(tasks.reduce_size(pdf, password, remove_images=True))
+
+
+def reduce_image_quality(pdf: bytes, password: Optional[str]) -> int:
+    return len(tasks.reduce_size(pdf, password, quality=50, dpi=72))
+
+
+def watermark_pdf(pdf: bytes, password: Optional[str]) -> int:
+    update = incremental.open_update(pdf, password)
+    tasks.watermark_update(
+        update,
+        partial(tasks.create_watermark_canvas, "CONFIDENTIAL", 12, "#F90004", 0.8),
+    )
+    return len(update.to_bytes())
+
+
+def convert_pdf_to_word(pdf: bytes, password: Optional[str]) -> int:
+    return len(tasks.convert_to_word(pdf, password))
+
+
+def rotate_pdf(pdf: bytes, password: Optional[str]) -> int:
+    return len(tasks.rotate_pages(pdf, 90, password=password))
+
+
+def scale_pdf(pdf: bytes, password: Optional[str]) -> int:
+    return len(
+        tasks.scale_pages(
+            pdf, PaperSize.A4.width, PaperSize.A4.height, 1.0, password=password
+        )
+    )
+
+
+def merge_pdfs(pdf: bytes, password: Optional[str]) -> int:
+    output = BytesIO()
+    tasks.merge_pdfs(
+        [
+            tasks.MergeSource(pdf, "first", password),
+            tasks.MergeSource(pdf, "second", password),
+        ],
+        output,
+    )
+    return output.tell()
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    # Returns the size of its output, e.g. in bytes
+    func: Callable[[bytes, Optional[str]], int]
+    # The document kinds it runs on
+    kinds: Tuple[str, ...]
+    # Larger documents take too long for a routine run
+    max_pages: Optional[int] = None
+
+
+CASES = {
+    case.name: case
+    for case in (
+        Case("extract_text", extract_text, ("text", "encrypted")),
+        Case("extract_images", extract_images, ("image",)),
+        Case("extract_tables", extract_tables, ("table",), max_pages=1000),
+        Case("compress_pdf", compress_pdf, ("text", "image", "encrypted")),
+        Case("remove_images", remove_images, ("image",)),
+        Case("reduce_image_quality", reduce_image_quality, ("image",)),
+        Case("watermark_pdf", watermark_pdf, ("text", "encrypted")),
+        # pdf2docx takes seconds per page of ruled tables
+        Case("convert_pdf_to_word", convert_pdf_to_word, ("text",), max_pages=1000),
+        Case("rotate_pdf", rotate_pdf, ("text", "encrypted")),
+        Case("scale_pdf", scale_pdf, ("text", "image")),
+        Case("merge_pdfs", merge_pdfs, ("text", "image")),
+    )
+}
+
+
+@dataclass(frozen=True)
+class Result:
+    case: str
+    document: str
+    pages: int
+    input_bytes: int
+    output_size: int
+    seconds: float
+    peak_bytes: int
+
+    @property
+    def key(self) -> Tuple[str, str, int]:
+        return (self.case, self.document, self.pages)
+
+
+def measure(case: Case, kind: str, pages: int, repeat: int = 3) -> Result:
+    pdf = document(kind, pages)
+    password = _password(kind)
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_size = case.func(pdf, password)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        case.func(pdf, password)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        case.name, kind, pages, len(pdf), output_size, min(seconds), peak_bytes
+    )
+
+
+def compare(
+    results: List[Result], baseline: Dict, threshold: float
+) -> List[Tuple[Result, str]]:
+    """
+    List the measurements that regressed compared with a baseline.
+
+    Args:
+        results (List[Result]): The measurements.
+        baseline (Dict): Earlier results, as written by `main`.
+        threshold (float): How much slower, or how much more memory, counts as a
+            regression, e.g. 0.2 for 20%.
+
+    Returns:
+        List[Tuple[Result, str]]: Each regressed measurement, with a description.
+    """
+    previous = {
+        (result["case"], result["document"], result["pages"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        if (before := previous.get(result.key)) is None:
+            continue
+        for metric, minimum, scale, unit in (
+            ("seconds", MIN_SECONDS, 1, "s"),
+            ("peak_bytes", MIN_PEAK_BYTES, 1024 * 1024, "MB"),
+        ):
+            old, new = before[metric], getattr(result, metric)
+            if new > old * (1 + threshold) and new - old > minimum:
+                regressions.append(
+                    (
+                        result,
+                        f"{metric} {old / scale:.3f} -> {new / scale:.3f} {unit} "
+                        f"(+{(new / old - 1) * 100:.0f}%)",
+                    )
+                )
+    return regressions
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": str(parallel.max_workers()),
+        "pypdf": pypdf.__version__,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.suite", description=__doc__.strip().split("\n\n")[0]
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        nargs="+",
+        default=PAGE_COUNTS,
+        help="Page counts of the documents (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=CASES,
+        default=list(CASES),
+        metavar="CASE",
+        help=f"Operations to measure (default: all of {', '.join(CASES)})",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per measurement, of which the fastest counts (default: 3)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("benchmarks/results.json"),
+        help="Where to write the results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="Results to compare with, e.g. an earlier output"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative increase that counts as a regression (default: 0.2)",
+    )
+    args = parser.parse_args(argv)
+    # pdf2docx logs every page it parses
+    logging.disable(logging.INFO)
+
+    results = []
+    for name in args.cases:
+        case = CASES[name]
+        for kind in case.kinds:
+            for pages in sorted(args.pages):
+                if case.max_pages is not None and pages > case.max_pages:
+                    continue
+                result = measure(case, kind, pages, args.repeat)
+                results.append(result)
+                print(
+                    f"{result.case:<22} {kind:<10} {pages:>6} pages: "
+                    f"{result.seconds:8.3f} s, "
+                    f"peak {result.peak_bytes / 1024 / 1024:8.1f} MB",
+                    flush=True,
+                )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(
+        json.dumps(
+            {
+                "environment": _environment(),
+                "results": [asdict(result) for result in results],
+            },
+            indent=2,
+        )
+    )
+    print(f"Results written to {args.output}")
+
+    if args.baseline is None:
+        return 0
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.threshold
+    )
+    for result, description in regressions:
+        print(
+            f"REGRESSION {result.case} {result.document} {result.pages}: {description}"
+        )
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
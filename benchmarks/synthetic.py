@@ -0,0 +1,121 @@
+from io import BytesIO
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from utils import tasks
+
+
+def text_pdf(pages: int, lines: int = 40, compressed: bool = True) -> bytes:
+    """
+    Generate a deterministic text-only PDF.
+
+    Args:
+        pages (int): The number of pages.
+        lines (int): The number of lines of text per page.
+        compressed (bool): Whether to Flate-compress the content streams.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    packet = BytesIO()
+    can = canvas.Canvas(
+        packet, pagesize=letter, invariant=True, pageCompression=int(compressed)
+    )
+    for page in range(pages):
+        can.setFont("Helvetica", 10)
+        for line in range(lines):
+            can.drawString(
+                72,
+                740 - line * 16,
+                f"Page {page + 1}, line {line + 1}: the quick brown fox jumps over the lazy dog",
+            )
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def image_pdf(pages: int, copies: int = 1) -> bytes:
+    """
+    Generate a deterministic PDF with the same photo-like image on every page.
+
+    Args:
+        pages (int): The number of pages of each copy.
+        copies (int): The number of copies of the document to concatenate. Each copy
+            embeds its own font and image objects, as merged documents do.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    image = Image.effect_mandelbrot((640, 480), (-2.0, -1.5, 1.0, 1.5), 100)
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter, invariant=True, pageCompression=0)
+    for page in range(pages):
+        can.setFont("Helvetica", 10)
+        can.drawString(72, 740, f"Page {page + 1}")
+        can.drawImage(ImageReader(image.convert("RGB")), 72, 300, 400, 300)
+        can.showPage()
+    can.save()
+
+    writer = PdfWriter()
+    for _ in range(copies):
+        writer.append(PdfReader(BytesIO(packet.getvalue())))
+    packet = BytesIO()
+    writer.write(packet)
+    return packet.getvalue()
+
+
+def table_pdf(pages: int, rows: int = 30, columns: int = 5) -> bytes:
+    """
+    Generate a deterministic PDF with a ruled table on every page.
+
+    Args:
+        pages (int): The number of pages.
+        rows (int): The number of rows of each table, including the header.
+        columns (int): The number of columns of each table.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    xs = [72 + column * 94 for column in range(columns + 1)]
+    ys = [720 - row * 20 for row in range(rows + 1)]
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter, invariant=True)
+    for page in range(pages):
+        can.setFont("Helvetica", 9)
+        can.grid(xs, ys)
+        for row in range(rows):
+            for column in range(columns):
+                can.drawString(
+                    xs[column] + 4,
+                    ys[row] - 14,
+                    (
+                        f"Column {column + 1}"
+                        if row == 0
+                        else f"{page + 1}.{row}.{column + 1}"
+                    ),
+                )
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def encrypted_pdf(pages: int, password: str = "benchmark") -> bytes:
+    """
+    Generate a text-only PDF (see `text_pdf`) encrypted with AES-256 (revision 6).
+
+    The content is deterministic, but the encryption keys are random.
+
+    Args:
+        pages (int): The number of pages.
+        password (str): The user and owner password.
+
+    Returns:
+        bytes: The PDF document.
+    """
+    return tasks.encrypt_pdf(
+        text_pdf(pages), tasks.Protection(password, algorithm="AES-256")
+    )
@@ -0,0 +1,56 @@
+"""
+Compare the per-page merge watermark with the shared Form XObject watermark.
+
+Run from the repository root with `python -m benchmarks.watermark [pages]`.
+"""
+
+import sys
+import time
+from functools import partial
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+from benchmarks.synthetic import text_pdf
+from utils import documents, helpers, tasks
+
+WATERMARK = ("PDF-Workdesk Watermark", 12, "#F90004", 0.8)
+
+
+def _legacy(pdf: bytes) -> bytes:
+    writer = PdfWriter()
+    watermark_page = PdfReader(tasks.create_watermark_canvas(*WATERMARK)).pages[0]
+    for page in PdfReader(BytesIO(pdf)).pages:
+        page.merge_page(watermark_page)
+        writer.add_page(page)
+    with BytesIO() as fp:
+        writer.write(fp)
+        return fp.getvalue()
+
+
+def main(pages: int = 500) -> None:
+    pdf = text_pdf(pages)
+    print(f"{pages} pages, {len(pdf) / 1024:.0f} KB")
+
+    start = time.perf_counter()
+    output = _legacy(pdf)
+    print(
+        f"legacy (merge_page per page): {time.perf_counter() - start:.2f} s, "
+        f"{len(output) / 1024:.0f} KB"
+    )
+
+    start = time.perf_counter()
+    output = helpers.merge_watermark_into_pdf(
+        documents.DocumentHandle(
+            digest="benchmark", size=len(pdf), page_count=pages, pdf=pdf
+        ),
+        partial(tasks.create_watermark_canvas, *WATERMARK),
+    )
+    print(
+        f"shared Form XObject: {time.perf_counter() - start:.2f} s, "
+        f"{len(output) / 1024:.0f} KB"
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
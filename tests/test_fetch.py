@@ -0,0 +1,125 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.synthetic import text_pdf
+from utils.fetch import Download, DownloadError, PdfFetcher
+
+PDF = text_pdf(2, lines=2)
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2026 07:28:00 GMT"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        if self.path == "/etag.pdf":
+            if self.headers.get("If-None-Match") == ETAG:
+                self._send(304)
+            else:
+                self._send(200, PDF, {"ETag": ETAG})
+        elif self.path == "/dated.pdf":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self._send(304)
+            else:
+                self._send(200, PDF, {"Last-Modified": LAST_MODIFIED})
+        elif self.path == "/plain.pdf":
+            self._send(200, PDF)
+        elif self.path == "/page.html":
+            self._send(200, b"<html>" + b" " * 2048 + b"</html>")
+        elif self.path == "/large.pdf":
+            self._send(200, PDF + b" " * 4096)
+        elif self.path == "/streamed.pdf":
+            # No Content-Length, so the size is only known while reading
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(PDF + b" " * 4096)
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+    def _send(self, status, body=b"", headers=None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _url(server, path: str) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_fetch(server):
+    download = PdfFetcher().fetch(_url(server, "/etag.pdf"))
+    assert download.content == PDF
+    assert download.etag == ETAG
+    assert download.name == "etag.pdf"
+
+
+@pytest.mark.parametrize("path", ["/large.pdf", "/streamed.pdf"])
+def test_larger_than_max_size(server, path):
+    fetcher = PdfFetcher(max_size=len(PDF) + 1024)
+    with pytest.raises(DownloadError, match="is larger than"):
+        fetcher.fetch(_url(server, path))
+
+
+def test_not_a_pdf(server):
+    with pytest.raises(DownloadError, match="is not a PDF"):
+        PdfFetcher().fetch(_url(server, "/page.html"))
+
+
+def test_not_found(server):
+    with pytest.raises(DownloadError, match="404"):
+        PdfFetcher().fetch(_url(server, "/missing.pdf"))
+
+
+@pytest.mark.parametrize("path", ["/etag.pdf", "/dated.pdf"])
+def test_revalidates_cached_copy(server, path):
+    fetcher = PdfFetcher()
+    first = fetcher.fetch(_url(server, path))
+    second = fetcher.fetch(_url(server, path))
+    # The server answered the second request with 304 Not Modified
+    assert second is first
+    assert server.requests == [path, path]
+
+
+def test_doesnt_cache_without_validators(server):
+    fetcher = PdfFetcher()
+    first = fetcher.fetch(_url(server, "/plain.pdf"))
+    second = fetcher.fetch(_url(server, "/plain.pdf"))
+    assert second is not first
+    assert second.content == PDF
+
+
+def test_fetch_all(server):
+    paths = ["/etag.pdf", "/missing.pdf", "/dated.pdf", "/page.html", "/plain.pdf"]
+    results = PdfFetcher(max_workers=2).fetch_all([_url(server, p) for p in paths])
+    assert [type(result) for result in results] == [
+        Download,
+        DownloadError,
+        Download,
+        DownloadError,
+        Download,
+    ]
+    # In the order of the URLs, not of completion
+    assert [result.url for result in results if isinstance(result, Download)] == [
+        _url(server, path) for path in ("/etag.pdf", "/dated.pdf", "/plain.pdf")
+    ]
@@ -0,0 +1,77 @@
+import logging
+from functools import partial
+from io import BytesIO
+
+import pymupdf
+import pytest
+from pypdf import PdfReader
+
+from benchmarks.synthetic import text_pdf
+from utils import incremental, selection, tasks
+
+
+def _xref_table_pdf() -> bytes:
+    return text_pdf(4, lines=2)
+
+
+def _xref_stream_pdf() -> bytes:
+    # pypdf only writes cross-reference tables
+    with pymupdf.open(stream=text_pdf(4, lines=2)) as document:
+        return document.tobytes(use_objstms=1)
+
+
+def _xref(pdf: bytes) -> bytes:
+    start = PdfReader(BytesIO(pdf))._startxref
+    return pdf[start : start + 4]
+
+
+@pytest.mark.parametrize(
+    "make_pdf, xref",
+    [(_xref_table_pdf, b"xref"), (_xref_stream_pdf, None)],
+    ids=["table", "stream"],
+)
+def test_update_appends_the_same_kind_of_xref(make_pdf, xref, caplog):
+    pdf = make_pdf()
+    update = incremental.open_update(pdf)
+    tasks.rotate_update(update, 90, selection.PageSelection.parse("2-", 4))
+    output = update.to_bytes()
+
+    assert output.startswith(pdf)
+    if xref is None:
+        assert _xref(pdf) != b"xref" and _xref(output) != b"xref"
+    else:
+        assert _xref(pdf) == _xref(output) == xref
+
+    # Updating the update again, and reading it back, is warning-free
+    update = incremental.open_update(output)
+    tasks.rotate_update(update, 90, selection.PageSelection.parse("1", 4))
+    output = update.to_bytes()
+    with caplog.at_level(logging.WARNING, logger="pypdf"):
+        reader = PdfReader(BytesIO(output), strict=True)
+        assert [page.rotation for page in reader.pages] == [90, 90, 90, 90]
+    assert not caplog.records
+
+
+def test_added_objects_are_written():
+    pdf = text_pdf(2, lines=2)
+    update = incremental.open_update(pdf)
+    tasks.watermark_update(
+        update, partial(tasks.create_watermark_canvas, "DRAFT", 12, "#F90004", 0.8)
+    )
+    reader = PdfReader(BytesIO(update.to_bytes()), strict=True)
+    assert all("DRAFT" in page.extract_text() for page in reader.pages)
+    assert int(reader.trailer["/Size"]) > int(PdfReader(BytesIO(pdf)).trailer["/Size"])
+
+
+def test_update_without_changes_is_the_document():
+    pdf = text_pdf(2, lines=2)
+    assert incremental.open_update(pdf).to_bytes() == pdf
+
+
+def test_encrypted_documents_are_rewritten_decrypted():
+    pdf = tasks.encrypt_pdf(text_pdf(2, lines=2), tasks.Protection("secret"))
+    update = incremental.open_update(pdf, "secret")
+    tasks.rotate_update(update, 180)
+    reader = PdfReader(BytesIO(update.to_bytes()), strict=True)
+    assert not reader.is_encrypted
+    assert [page.rotation for page in reader.pages] == [180, 180]
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from utils.jobs import JobScheduler
+
+TIMEOUT = 60
+
+# Jobs run in worker processes, so their functions are module-level
+
+
+def count(steps, progress):
+    for done in range(1, steps + 1):
+        progress(done, steps)
+    return steps
+
+
+def wait_for(path, progress):
+    # Reports its progress until `path` exists, so it can be cancelled meanwhile
+    while not path.exists():
+        progress(1, 2)
+        time.sleep(0.05)
+    progress(2, 2)
+    return "released"
+
+
+def fail(progress):
+    raise ValueError("boom")
+
+
+@pytest.fixture
+def scheduler():
+    with JobScheduler(max_workers=1, max_finished=2) as scheduler:
+        yield scheduler
+
+
+def _wait_running(scheduler, job_id):
+    deadline = time.monotonic() + TIMEOUT
+    while (job := scheduler.get(job_id)).status == "queued":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return job
+
+
+def test_submit_runs_once_per_key(scheduler):
+    job_id = scheduler.submit("Count", count, 3, key="count")
+    assert scheduler.submit("Count", count, 3, key="count") == job_id
+
+    job = scheduler.wait(job_id, TIMEOUT)
+    assert (job.status, job.result) == ("done", 3)
+    # Done jobs are reused too
+    assert scheduler.submit("Count", count, 3, key="count") == job_id
+
+    # Failed jobs aren't
+    failed_id = scheduler.submit("Fail", fail, key="fail")
+    job = scheduler.wait(failed_id, TIMEOUT)
+    assert (job.status, job.error) == ("failed", "boom")
+    assert scheduler.submit("Fail", fail, key="fail") != failed_id
+
+
+def test_progress(scheduler, tmp_path):
+    gate = tmp_path / "gate"
+    job_id = scheduler.submit("Wait", wait_for, gate)
+
+    deadline = time.monotonic() + TIMEOUT
+    while (job := scheduler.get(job_id)).done == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert (job.status, job.done, job.total, job.fraction) == ("running", 1, 2, 0.5)
+
+    gate.touch()
+    job = scheduler.wait(job_id, TIMEOUT)
+    assert (job.status, job.result) == ("done", "released")
+
+
+def test_cancel(scheduler, tmp_path):
+    running_id = scheduler.submit("Wait", wait_for, tmp_path / "gate")
+    # Waits for the only worker
+    queued_id = scheduler.submit("Wait", wait_for, tmp_path / "other gate")
+    _wait_running(scheduler, running_id)
+
+    assert scheduler.cancel(queued_id)
+    assert scheduler.cancel(running_id)
+    assert scheduler.wait(running_id, TIMEOUT).status == "cancelled"
+    assert scheduler.wait(queued_id, TIMEOUT).status == "cancelled"
+    assert not scheduler.cancel(running_id)
+
+
+def test_evicts_oldest_finished_jobs(scheduler):
+    job_ids = [
+        scheduler.submit("Count", count, steps, key=("count", steps))
+        for steps in (1, 2, 3)
+    ]
+    for job_id in job_ids:
+        assert scheduler.wait(job_id, TIMEOUT).status == "done"
+
+    assert scheduler.get(job_ids[0]) is None
+    assert [scheduler.get(job_id).result for job_id in job_ids[1:]] == [2, 3]
+    # The evicted job's key no longer refers to it
+    assert scheduler.submit("Count", count, 1, key=("count", 1)) not in job_ids
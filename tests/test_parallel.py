@@ -0,0 +1,35 @@
+import sys
+import types
+from functools import partial
+
+from benchmarks.synthetic import text_pdf
+from utils import jobs, parallel, tasks
+
+
+def test_workers_dont_run_the_app_script(tmp_path, monkeypatch):
+    # Streamlit installs the app script as `__main__`, see `parallel.mp_context`
+    ran = tmp_path / "ran"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(ran)!r}, 'w').close()\n")
+    main = types.ModuleType("__main__")
+    main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+
+    pages = parallel.MIN_PARALLEL_PAGES
+    pdf = text_pdf(pages, lines=2)
+    text = list(
+        parallel.map_pages(
+            partial(parallel.page_text, mode="plain"),
+            pdf,
+            list(range(pages)),
+            workers=2,
+        )
+    )
+    assert text[-1].startswith(f"Page {pages}, line 1")
+
+    with jobs.JobScheduler(max_workers=1) as scheduler:
+        job = scheduler.wait(scheduler.submit("Compress", tasks.compress_pdf, pdf))
+    assert job.status == "done"
+
+    assert not ran.exists()
+    assert sys.modules["__main__"] is main
@@ -0,0 +1,35 @@
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+
+from benchmarks.synthetic import text_pdf
+from utils.pipeline import Compress, Pipeline, Rotate, Watermark
+
+PAGE_STAGES = (Rotate(90, pages="2-"), Watermark("CONFIDENTIAL", pages="1"))
+
+
+@pytest.mark.parametrize(
+    "stages",
+    [
+        # An incremental update of the document
+        PAGE_STAGES,
+        # A rewrite, whose objects are added to a `PdfWriter`
+        (*PAGE_STAGES, Compress(lossless=True)),
+    ],
+)
+def test_page_stages(stages):
+    pdf = text_pdf(3, lines=2)
+    result = Pipeline(stages).run(pdf)
+    assert [name for name, _ in result.timings] == [
+        "parse",
+        *(stage.name for stage in stages),
+        "write",
+    ]
+
+    reader = PdfReader(BytesIO(result.pdf), strict=True)
+    assert [page.rotation for page in reader.pages] == [0, 90, 90]
+    assert "CONFIDENTIAL" in reader.pages[0].extract_text()
+    assert "CONFIDENTIAL" not in reader.pages[1].extract_text()
+    if len(stages) == len(PAGE_STAGES):
+        assert result.pdf.startswith(pdf)
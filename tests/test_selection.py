@@ -0,0 +1,78 @@
+import pytest
+
+from utils.selection import PageSelection
+
+
+@pytest.mark.parametrize(
+    "text, pages",
+    [
+        ("3", [2]),
+        ("-1", [9]),
+        ("-3--1", [7, 8, 9]),
+        ("2-4", [1, 2, 3]),
+        ("8-", [7, 8, 9]),
+        ("1-:3", [0, 3, 6, 9]),
+        ("2-7:2", [1, 3, 5]),
+        (" 9, 1 - 2 ", [0, 1, 8]),
+        # Overlapping parts select their pages once, in ascending order
+        ("5-7, 1-6, 6", [0, 1, 2, 3, 4, 5, 6]),
+        ("1-10:2, 1-10:3", [0, 2, 3, 4, 6, 8, 9]),
+    ],
+)
+def test_parse(text, pages):
+    selection = PageSelection.parse(text, 10)
+    assert list(selection) == pages
+    assert len(selection) == len(pages)
+    assert [page in selection for page in range(10)] == [
+        page in pages for page in range(10)
+    ]
+
+
+@pytest.mark.parametrize("text", ["", "all", " ALL ", "1-", "1-3, 4-10"])
+def test_everything(text):
+    selection = PageSelection.parse(text, 10)
+    assert selection.is_everything
+    assert len(selection) == 10
+    assert str(selection) == "all"
+
+
+@pytest.mark.parametrize(
+    "text, error",
+    [
+        ("two", ValueError),
+        ("1-2-3", ValueError),
+        ("1,,2", ValueError),
+        ("5-2", ValueError),
+        ("1-5:0", ValueError),
+        ("0", IndexError),
+        ("11", IndexError),
+        ("-11", IndexError),
+        ("8-12", IndexError),
+    ],
+)
+def test_invalid(text, error):
+    with pytest.raises(error):
+        PageSelection.parse(text, 10)
+
+
+def test_contiguous_ranges_are_merged():
+    selection = PageSelection.parse("4-5, 1-2, 3", 10)
+    assert selection.ranges == (range(0, 5),)
+    assert not selection.is_everything
+
+
+@pytest.mark.parametrize(
+    "text, formatted",
+    [("3", "3"), ("2-5:2", "2-4:2"), ("-2-, 1-2", "1-2, 9-10"), ("1-10:3", "1-10:3")],
+)
+def test_str(text, formatted):
+    selection = PageSelection.parse(text, 10)
+    assert str(selection) == formatted
+    # Which parses back into the same selection
+    assert PageSelection.parse(str(selection), 10) == selection
+
+
+def test_empty_document():
+    selection = PageSelection.everything(0)
+    assert selection.is_everything
+    assert (list(selection), len(selection)) == ([], 0)
@@ -0,0 +1,115 @@
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    NameObject,
+    RectangleObject,
+    TextStringObject,
+)
+
+from benchmarks.synthetic import image_pdf, text_pdf
+from utils import selection, tasks
+
+
+def _link(destination) -> DictionaryObject:
+    return DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Annot"),
+            NameObject("/Subtype"): NameObject("/Link"),
+            NameObject("/Rect"): RectangleObject([0, 0, 10, 10]),
+            NameObject("/Dest"): destination,
+        }
+    )
+
+
+def _linked_pdf() -> bytes:
+    # Three pages, "intro" naming the second, and links on the first to the third
+    # (an explicit destination) and to "intro"
+    writer = PdfWriter(clone_from=PdfReader(BytesIO(text_pdf(3, lines=2))))
+    writer.add_named_destination("intro", 1)
+    third = ArrayObject([writer.pages[2].indirect_reference, NameObject("/Fit")])
+    writer.add_annotation(0, _link(third))
+    writer.add_annotation(0, _link(TextStringObject("intro")))
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def _links(reader, page):
+    return [
+        annotation.get_object()["/Dest"]
+        for annotation in reader.pages[page].get("/Annots", ())
+    ]
+
+
+def test_merge_renames_colliding_destinations():
+    pdf = _linked_pdf()
+    output = BytesIO()
+    tasks.merge_pdfs([tasks.MergeSource(pdf, "a"), tasks.MergeSource(pdf, "b")], output)
+    reader = PdfReader(output)
+    assert len(reader.pages) == 6
+
+    tree = reader.trailer["/Root"]["/Names"]["/Dests"]["/Names"]
+    assert list(tree[::2]) == ["intro", "intro (b, 2)"]
+    assert {
+        name: reader.get_destination_page_number(destination)
+        for name, destination in reader.named_destinations.items()
+    } == {"intro": 1, "intro (b, 2)": 4}
+
+    for page, name in ((0, "intro"), (3, "intro (b, 2)")):
+        explicit, named = _links(reader, page)
+        assert reader.get_page_number(explicit[0].get_object()) == page + 2
+        assert named == name
+
+
+def test_merge_keeps_destinations_of_selected_pages():
+    pdf = _linked_pdf()
+    output = BytesIO()
+    tasks.merge_pdfs(
+        [tasks.MergeSource(pdf, "a"), tasks.MergeSource(pdf, "b", pages=(2, 1, 0))],
+        output,
+    )
+    reader = PdfReader(output)
+    assert {
+        name: reader.get_destination_page_number(destination)
+        for name, destination in reader.named_destinations.items()
+    } == {"intro": 1, "intro (b, 2)": 4}
+    assert _links(reader, 5)[1] == "intro (b, 2)"
+
+
+def _image(page):
+    xobjects = page["/Resources"]["/XObject"]
+    return xobjects.raw_get(next(iter(xobjects)))
+
+
+def test_reencoded_image_replaces_the_shared_object():
+    pdf = image_pdf(3)
+    reader = PdfReader(BytesIO(tasks.reduce_size(pdf, quality=50)), strict=True)
+
+    references = {_image(page) for page in reader.pages}
+    assert len(references) == 1
+    image = references.pop().get_object()
+    assert image["/Filter"] == "/DCTDecode"
+    assert reader.pages[0].images[0].image.size == (640, 480)
+
+
+def test_compressed_contents_replace_the_pages_contents():
+    pdf = text_pdf(3, compressed=False)
+    output = tasks.compress_pdf(pdf)
+    assert len(output) < len(pdf)
+
+    reader = PdfReader(BytesIO(output), strict=True)
+    for number, page in enumerate(reader.pages, start=1):
+        assert page["/Contents"].get_object()["/Filter"] == "/FlateDecode"
+        assert page.extract_text().startswith(f"Page {number}, line 1")
+
+
+def test_removes_images_of_selected_pages_only():
+    pdf = image_pdf(3)
+    pages = selection.PageSelection.parse("2", 3)
+    reader = PdfReader(
+        BytesIO(tasks.reduce_size(pdf, remove_images=True, pages=pages)), strict=True
+    )
+    assert [len(page.images) for page in reader.pages] == [1, 0, 1]
@@ -0,0 +1,134 @@
+import logging
+
+import pytest
+
+from benchmarks.synthetic import text_pdf
+from utils import incremental, selection, tasks
+from utils.versions import VersionStore
+
+# Versions are stored as bytes, so most documents needn't be valid PDFs
+SIZE = 1000
+
+
+def _document(number: int) -> bytes:
+    return bytes([number]) * SIZE
+
+
+def _rotated(pdf: bytes, pages: str) -> bytes:
+    update = incremental.open_update(pdf)
+    tasks.rotate_update(update, 90, selection.PageSelection.parse(pages, 3))
+    return update.to_bytes()
+
+
+def test_records_incremental_updates_as_deltas():
+    store = VersionStore()
+    first = text_pdf(3, lines=2)
+    second = _rotated(first, "1")
+    third = _rotated(second, "2-")
+
+    store.record(first, "Upload", "a")
+    version = store.record(second, "Rotate PDF", "b")
+    assert (version.base, version.size) == (0, len(second))
+    assert bytes(version.data) == second[len(first) :]
+    store.record(third, "Rotate PDF", "c")
+    # A rewritten document is stored whole
+    assert store.record(first, "Compress PDF", "d").base is None
+
+    footprint = store.footprint()
+    assert (footprint.versions, footprint.deltas) == (4, 2)
+    # The deltas add up to the third version
+    assert footprint.stored == len(third) + len(first)
+    assert [store.pdf(version.id) for version in store.history] == [
+        first,
+        second,
+        third,
+        first,
+    ]
+    assert store.origin == "a"
+
+
+def test_undo_redo():
+    store = VersionStore()
+    with pytest.raises(IndexError):
+        store.undo()
+
+    for number in range(3):
+        store.record(_document(number), f"Operation {number}", str(number))
+    assert (store.can_undo, store.can_redo) == (True, False)
+    with pytest.raises(IndexError):
+        store.redo()
+
+    assert store.undo().label == "Operation 1"
+    assert store.undo().label == "Operation 0"
+    assert (store.position, store.can_undo, store.can_redo) == (0, False, True)
+    assert store.pdf() == _document(0)
+    assert store.redo().label == "Operation 1"
+    assert store.pdf() == _document(1)
+
+    # Recording after an undo discards the undone versions
+    store.record(_document(3), "Operation 3", "3")
+    assert [version.label for version in store.history] == [
+        "Operation 0",
+        "Operation 1",
+        "Operation 3",
+    ]
+    assert (store.position, store.can_redo) == (2, False)
+
+
+def test_spills_oldest_versions(tmp_path):
+    store = VersionStore(max_bytes=int(1.5 * SIZE), spill_dir=tmp_path)
+    for number in range(5):
+        store.record(_document(number), f"Operation {number}", str(number))
+
+    assert [version.spilled for version in store.history] == [True] * 4 + [False]
+    footprint = store.footprint()
+    assert (footprint.versions, footprint.stored, footprint.spilled) == (
+        5,
+        SIZE,
+        4 * SIZE,
+    )
+    assert footprint.memory <= store.max_bytes
+    assert len(list(tmp_path.iterdir())) == 4
+
+    for _ in range(4):
+        store.undo()
+    # Spilled versions are memory-mapped
+    assert bytes(store.pdf()) == _document(0)
+
+    store.close()
+    assert list(tmp_path.iterdir()) == []
+    assert store.current is None
+
+
+def test_evicts_oldest_versions_without_spill_dir(caplog):
+    store = VersionStore(max_bytes=SIZE // 2)
+    with caplog.at_level(logging.WARNING, logger="utils.versions"):
+        for number in range(4):
+            store.record(_document(number), f"Operation {number}", str(number))
+
+    # The current version and one undo step are kept, over the limit
+    assert [version.label for version in store.history] == [
+        "Operation 2",
+        "Operation 3",
+    ]
+    assert store.position == 1
+    assert store.footprint().memory == 2 * SIZE
+    assert "over its limit" in caplog.text
+
+    assert store.undo().label == "Operation 2"
+    assert store.pdf() == _document(2)
+
+
+def test_evicting_a_base_makes_its_delta_whole():
+    first = text_pdf(3, lines=2)
+    second = _rotated(first, "1")
+    third = _rotated(second, "2-")
+    store = VersionStore(max_bytes=len(third))
+    for label, pdf in (("Upload", first), ("Rotate", second), ("Rotate", third)):
+        store.record(pdf, label, label)
+
+    history = store.history
+    assert len(history) == 2
+    assert history[0].base is None and history[1].base == history[0].id
+    assert store.pdf(history[0].id) == second
+    assert store.pdf() == third
@@ -0,0 +1,253 @@
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    PdfObject,
+    StreamObject,
+)
+
+from utils import buffers
+
+# Where the bytes of a PDF go, measured from the cross-reference table without
+# decoding any stream. Like `parallel`, this module must not import Streamlit.
+
+CATEGORIES = (
+    "images",
+    "fonts",
+    "content streams",
+    "metadata",
+    "embedded files",
+    "structure",
+    "unreferenced",
+    "overhead",
+)
+
+# The reduction option that helps most when a category dominates the file
+HINTS = {
+    "images": "Reduce image quality, or remove images",
+    "fonts": "Lossless compression, which merges fonts embedded more than once",
+    "content streams": "Lossless compression",
+    "unreferenced": "Any option, as rewriting the PDF drops unreferenced objects",
+}
+
+# Objects under these keys belong to the category of the object referencing them
+_INHERITED = {"fonts", "metadata", "embedded files"}
+_KEY_CATEGORIES = {
+    "/FontFile": "fonts",
+    "/FontFile2": "fonts",
+    "/FontFile3": "fonts",
+    "/FontDescriptor": "fonts",
+    "/ToUnicode": "fonts",
+    "/Contents": "content streams",
+    "/Metadata": "metadata",
+    "/Info": "metadata",
+    "/EF": "embedded files",
+}
+_TYPE_CATEGORIES = {
+    "/Font": "fonts",
+    "/FontDescriptor": "fonts",
+    "/Metadata": "metadata",
+    "/EmbeddedFile": "embedded files",
+    "/Filespec": "embedded files",
+}
+# Walking a page's resources stops at other nodes of the page tree
+_PAGE_TREE_TYPES = {"/Page", "/Pages", "/Catalog"}
+
+
+@dataclass(frozen=True)
+class ObjectSize:
+    idnum: int
+    category: str
+    size: int
+    description: str
+    # Numbers of the pages using the object, starting from 1
+    pages: Tuple[int, ...] = ()
+
+
+@dataclass(frozen=True)
+class SizeReport:
+    file_size: int
+    # Bytes per category, adding up to the file size
+    categories: Dict[str, int]
+    unreferenced_objects: int
+    largest: List[ObjectSize]
+
+    def share(self, category: str) -> float:
+        return (
+            self.categories.get(category, 0) / self.file_size if self.file_size else 0
+        )
+
+
+def _references(obj: PdfObject) -> Iterator[Tuple[Optional[str], IndirectObject]]:
+    """Yield the indirect objects referenced by `obj`, with the key they're under."""
+    stack = [(None, obj)]
+    while stack:
+        key, obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            yield key, obj
+        elif isinstance(obj, DictionaryObject):
+            stack.extend((name, value) for name, value in obj.items())
+        elif isinstance(obj, ArrayObject):
+            stack.extend((key, value) for value in obj)
+
+
+def _category(obj: PdfObject, key: Optional[str], parent: Optional[str]) -> str:
+    if isinstance(obj, DictionaryObject):
+        if obj.get("/Subtype") == "/Image":
+            return "images"
+        if obj.get("/Subtype") == "/Form":
+            return "content streams"
+        if (category := _TYPE_CATEGORIES.get(obj.get("/Type"))) is not None:
+            return category
+    if (category := _KEY_CATEGORIES.get(key)) is not None:
+        return category
+    if parent in _INHERITED:
+        return parent
+    return "structure"
+
+
+def _describe(obj: PdfObject) -> str:
+    if not isinstance(obj, DictionaryObject):
+        return type(obj).__name__
+    parts = [str(obj[key]) for key in ("/Type", "/Subtype") if key in obj]
+    if obj.get("/Subtype") == "/Image":
+        parts.append(f"{obj.get('/Width')}×{obj.get('/Height')}")
+    if "/BaseFont" in obj:
+        parts.append(str(obj["/BaseFont"]))
+    if not parts:
+        parts.append("Stream" if isinstance(obj, StreamObject) else "Dictionary")
+    if isinstance(obj, StreamObject) and "/Filter" in obj:
+        filters = obj["/Filter"]
+        parts.append(
+            ", ".join(filters) if isinstance(filters, ArrayObject) else str(filters)
+        )
+    return " ".join(parts)
+
+
+def _classify(reader: PdfReader) -> Dict[int, str]:
+    """Walk the object graph from the trailer and categorize every object reached."""
+    categories: Dict[int, str] = {}
+    stack = [(key, reference, None) for key, reference in _references(reader.trailer)]
+    while stack:
+        key, reference, parent = stack.pop()
+        if reference.idnum in categories:
+            continue
+        obj = reference.get_object()
+        category = categories[reference.idnum] = _category(obj, key, parent)
+        stack.extend(
+            (child_key, child, category) for child_key, child in _references(obj)
+        )
+    return categories
+
+
+def _page_users(reader: PdfReader) -> Dict[int, Set[int]]:
+    """Map object numbers to the numbers of the pages using them."""
+    users: Dict[int, Set[int]] = defaultdict(set)
+    for number, page in enumerate(reader.pages, start=1):
+        if page.indirect_reference is not None:
+            users[page.indirect_reference.idnum].add(number)
+
+        visited: Set[int] = set()
+        stack = [
+            reference
+            for key, reference in _references(page)
+            if key not in ("/Parent", "/P")
+        ]
+        while stack:
+            reference = stack.pop()
+            if reference.idnum in visited:
+                continue
+            visited.add(reference.idnum)
+            obj = reference.get_object()
+            if isinstance(obj, DictionaryObject) and (
+                obj.get("/Type") in _PAGE_TREE_TYPES
+            ):
+                continue
+            users[reference.idnum].add(number)
+            stack.extend(child for _, child in _references(obj))
+    return users
+
+
+def _spans(reader: PdfReader, pdf: buffers.PdfData) -> Dict[int, int]:
+    """
+    Measure the bytes of each top-level object, from its offset to its `endobj`.
+
+    Stream data is skipped over by its length instead of being searched or decoded.
+    Objects stored in object streams are measured as part of their object stream.
+    """
+    offsets = sorted(
+        (offset, idnum)
+        for generation in reader.xref.values()
+        for idnum, offset in generation.items()
+        if 0 <= offset < len(pdf)
+    )
+    spans = {}
+    for index, (offset, idnum) in enumerate(offsets):
+        end = offsets[index + 1][0] if index + 1 < len(offsets) else len(pdf)
+        start = offset
+        obj = reader.get_object(idnum)
+        if isinstance(obj, StreamObject):
+            # Decrypted or re-read data is never longer than what's in the file
+            start += len(obj._data)
+        if (found := pdf.find(b"endobj", start, end)) != -1:
+            end = found + len(b"endobj")
+        spans[idnum] = end - offset
+    return spans
+
+
+def analyze_size(pdf: buffers.PdfData, reader: PdfReader, top: int = 10) -> SizeReport:
+    """
+    Break down the size of a PDF by category.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        reader (PdfReader): The parsed (and, if needed, decrypted) document.
+        top (int): How many of the largest objects to list.
+
+    Returns:
+        SizeReport: The bytes per category, from the `CATEGORIES`, and the largest
+            objects with the pages using them. Bytes outside any object (the
+            cross-reference table, trailer and whitespace) count as overhead.
+    """
+    categories = _classify(reader)
+    spans = _spans(reader, pdf)
+
+    for idnum in spans:
+        if idnum not in categories:
+            obj = reader.get_object(idnum)
+            # Object and cross-reference streams are never referenced by other objects
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") in (
+                "/ObjStm",
+                "/XRef",
+            ):
+                categories[idnum] = "structure"
+            else:
+                categories[idnum] = "unreferenced"
+
+    totals = dict.fromkeys(CATEGORIES, 0)
+    for idnum, size in spans.items():
+        totals[categories[idnum]] += size
+    totals["overhead"] = max(0, len(pdf) - sum(totals.values()))
+    # Objects stored in object streams have no bytes of their own, only a count
+    unreferenced = sum(category == "unreferenced" for category in categories.values())
+    unreferenced += sum(idnum not in categories for idnum in reader.xref_objStm)
+
+    users = _page_users(reader)
+    largest = [
+        ObjectSize(
+            idnum,
+            categories[idnum],
+            size,
+            _describe(reader.get_object(idnum)),
+            tuple(sorted(users.get(idnum, ()))),
+        )
+        for idnum, size in heapq.nlargest(top, spans.items(), key=lambda item: item[1])
+    ]
+
+    return SizeReport(len(pdf), totals, unreferenced, largest)
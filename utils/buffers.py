@@ -0,0 +1,93 @@
+import io
+import mmap
+from pathlib import Path
+from typing import BinaryIO, Union
+
+# Zero-copy access to PDFs spilled to disk (see `storage.read_upload`). Like
+# `parallel`, this module must not import Streamlit, as workers use it.
+
+# The read-ahead of streams over mapped documents; parsers read a few bytes at a time
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class MappedPdf(mmap.mmap):
+    """
+    A PDF file mapped read-only into memory, used in place of the PDF's bytes.
+
+    It supports `len`, `find`, slicing and the buffer protocol (e.g. for hashing)
+    without reading the whole file; use `open_stream` to parse it and `source` to
+    pass it to libraries that need bytes or a path. It pickles as its path, so
+    worker processes map the same file instead of receiving a copy.
+
+    The file must not be modified while it's mapped.
+    """
+
+    path: Path
+
+    @classmethod
+    def open(cls, path: Union[Path, str]) -> "MappedPdf":
+        with open(path, "rb") as file:
+            # The mapping stays valid after the file is closed
+            mapped = cls(file.fileno(), 0, access=mmap.ACCESS_READ)
+        mapped.path = Path(path)
+        return mapped
+
+    def __reduce__(self):
+        return MappedPdf.open, (str(self.path),)
+
+
+PdfData = Union[bytes, MappedPdf]
+
+
+class _MemoryStream(io.RawIOBase):
+    """A seekable stream over a memoryview, with its own position."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), len(self._view))
+        size = max(0, end - self._position)
+        buffer[:size] = self._view[self._position : end]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._position = offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def open_stream(pdf: PdfData) -> BinaryIO:
+    """
+    Open a stream over a PDF without copying it, e.g. for `PdfReader`.
+
+    Each stream has its own position, so a document can be parsed by several
+    readers at once.
+    """
+    if isinstance(pdf, MappedPdf):
+        return io.BufferedReader(
+            _MemoryStream(memoryview(pdf)), buffer_size=STREAM_BUFFER_SIZE
+        )
+    # `BytesIO` shares the bytes until it's written to
+    return io.BytesIO(pdf)
+
+
+def source(pdf: PdfData) -> Union[bytes, str]:
+    """The PDF as bytes, or the path of a mapped PDF, e.g. for pypdfium2 or st.pdf."""
+    return str(pdf.path) if isinstance(pdf, MappedPdf) else pdf
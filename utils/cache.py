@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import streamlit as st
+from streamlit.logger import get_logger
+
+from utils import metrics
+
+logger = get_logger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("PDF_WORKDESK_RESULT_CACHE_MB", "256")) * 1024 * 1024
+
+
+def digest(pdf: bytes) -> str:
+    return hashlib.blake2b(pdf, digest_size=16).hexdigest()
+
+
+def password_key(password: Optional[str]) -> Optional[str]:
+    # Identifies a password in keys of caches shared by sessions, without storing it
+    return digest(password.encode()) if password else None
+
+
+class ResultCache:
+    """
+    A thread-safe LRU cache of operation results, bounded by their total size in bytes.
+
+    Keys are expected to be content-addressed, e.g. (document digest, operation,
+    parameters), so entries can be shared between sessions.
+
+    With `record_metrics`, lookups are also counted in the measurements of the
+    running operations (see `metrics.timed`).
+    """
+
+    def __init__(
+        self, max_bytes: int = RESULT_CACHE_SIZE, record_metrics: bool = False
+    ):
+        self.max_bytes = max_bytes
+        self.record_metrics = record_metrics
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        # Values are stored with their size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if self.record_metrics:
+                    metrics.count_cache_lookup(hit=True)
+                return self._entries[key][0]
+            self.misses += 1
+            if self.record_metrics:
+                metrics.count_cache_lookup(hit=False)
+            return None
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        """
+        Store `value` under `key`, evicting the least recently used entries if needed.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value, usually bytes.
+            size (Optional[int]): The (estimated) size of `value` in bytes.
+                Defaults to `len(value)`.
+        """
+        size = len(value) if size is None else size
+
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+
+            # Entries larger than the whole budget would only flush everything else
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], bytes]) -> bytes:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        logger.debug("Result cache: %s", self.stats())
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+@st.cache_resource
+def result_cache() -> ResultCache:
+    # One cache shared by all sessions of this server
+    return ResultCache(record_metrics=True)
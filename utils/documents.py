@@ -0,0 +1,163 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+import pdfplumber
+from pypdf import PasswordType, PdfReader
+from pypdf.errors import FileNotDecryptedError
+from streamlit import session_state
+
+from utils import buffers, cache, parallel
+
+MAX_DOCUMENTS = int(os.getenv("PDF_WORKDESK_MAX_DOCUMENTS", "4"))
+
+DocumentKey = Tuple[str, Optional[str]]
+
+
+@dataclass(frozen=True)
+class DocumentHandle:
+    """
+    A cheap reference to a PDF's bytes, identified by their content digest.
+
+    Pass handles instead of bytes to `st.cache_data` functions (with
+    `hash_funcs=HASH_FUNCS`), so cache lookups hash the digest, not the document.
+    """
+
+    digest: str
+    size: int
+    # None if the document is encrypted and the page tree can't be read yet
+    page_count: Optional[int]
+    pdf: buffers.PdfData = field(compare=False, repr=False)
+
+
+HASH_FUNCS = {DocumentHandle: lambda document: document.digest}
+
+
+@dataclass
+class Document:
+    """A parsed PDF, shared by every helper that works on the same bytes and password."""
+
+    pdf: buffers.PdfData
+    reader: PdfReader
+    password: Optional[str] = None
+    key: Optional[DocumentKey] = None
+    refcount: int = 0
+    _plumber: Optional[pdfplumber.PDF] = field(default=None, repr=False)
+
+    @property
+    def plumber(self) -> pdfplumber.PDF:
+        if self._plumber is None:
+            self._plumber = parallel.open_plumber(self.pdf, self.password)
+        return self._plumber
+
+    def close(self) -> None:
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+
+
+class DocumentRegistry:
+    """
+    Parsed documents keyed by (content digest, password).
+
+    Documents held by a slot (e.g. the main or merge upload) are reference counted
+    and never evicted; the others are evicted least recently used first once more
+    than `max_documents` are open.
+
+    pypdf readers are not thread-safe, so each Streamlit session has its own
+    registry (see `registry`).
+    """
+
+    def __init__(self, max_documents: int = MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self._documents: "OrderedDict[DocumentKey, Document]" = OrderedDict()
+        self._slots: Dict[str, DocumentKey] = {}
+
+    def get(
+        self, digest: str, pdf: buffers.PdfData, password: Optional[str] = None
+    ) -> Document:
+        """
+        Get the parsed document for `pdf`, parsing it only if it isn't open yet.
+
+        Unencrypted documents are shared regardless of the password. If the password
+        is wrong, the undecrypted document is returned.
+        """
+        document = self._lookup((digest, None))
+        if document is None:
+            document = self._add(
+                (digest, None), Document(pdf, PdfReader(buffers.open_stream(pdf)))
+            )
+
+        if not document.reader.is_encrypted or not password:
+            return document
+
+        if (decrypted := self._lookup((digest, password))) is not None:
+            return decrypted
+
+        reader = PdfReader(buffers.open_stream(pdf))
+        if reader.decrypt(password) == PasswordType.NOT_DECRYPTED:
+            return document
+        return self._add((digest, password), Document(pdf, reader, password))
+
+    def hold(self, slot: str, document: Document) -> None:
+        """Keep `document` open for as long as `slot` refers to it."""
+        if self._slots.get(slot) == document.key:
+            return
+
+        self.release(slot)
+        self._slots[slot] = document.key
+        document.refcount += 1
+
+    def release(self, slot: str) -> None:
+        if (key := self._slots.pop(slot, None)) and key in self._documents:
+            self._documents[key].refcount -= 1
+            self._evict()
+
+    def _lookup(self, key: DocumentKey) -> Optional[Document]:
+        if key in self._documents:
+            self._documents.move_to_end(key)
+            return self._documents[key]
+        return None
+
+    def _add(self, key: DocumentKey, document: Document) -> Document:
+        document.key = key
+        self._documents[key] = document
+        self._evict()
+        return document
+
+    def _evict(self) -> None:
+        for key in list(self._documents):
+            if len(self._documents) <= self.max_documents:
+                break
+            if self._documents[key].refcount == 0:
+                self._documents.pop(key).close()
+
+
+def create_handle(pdf: buffers.PdfData, digest: Optional[str] = None) -> DocumentHandle:
+    # The digest can be passed when it's known, e.g. for versions of a document
+    digest = cache.digest(pdf) if digest is None else digest
+    try:
+        page_count = len(registry().get(digest, pdf).reader.pages)
+    except FileNotDecryptedError:
+        page_count = None
+    return DocumentHandle(digest, len(pdf), page_count, pdf)
+
+
+def handle_for(slot: str, source: str, read: Callable[[], bytes]) -> DocumentHandle:
+    """
+    Get the handle of the document loaded into `slot`.
+
+    The document is only read and hashed when `source` (e.g. the uploaded file's ID)
+    changes, not on every rerun.
+    """
+    cached = session_state.get(f"handle_{slot}")
+    if cached is None or cached[0] != source:
+        cached = session_state[f"handle_{slot}"] = (source, create_handle(read()))
+    return cached[1]
+
+
+def registry() -> DocumentRegistry:
+    if "documents" not in session_state:
+        session_state["documents"] = DocumentRegistry()
+    return session_state["documents"]
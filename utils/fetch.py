@@ -0,0 +1,185 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from tempfile import SpooledTemporaryFile
+from typing import List, Optional, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import cache
+
+MAX_DOWNLOAD_SIZE = int(os.getenv("PDF_WORKDESK_MAX_DOWNLOAD_MB", "100")) * 1024 * 1024
+# Downloaded documents kept for revalidation, shared by all sessions
+DOWNLOAD_CACHE_SIZE = (
+    int(os.getenv("PDF_WORKDESK_DOWNLOAD_CACHE_MB", "128")) * 1024 * 1024
+)
+FETCH_WORKERS = 4
+# (connect, read) timeouts in seconds; the read timeout applies between chunks
+TIMEOUT = (5, 30)
+CHUNK_SIZE = 64 * 1024
+# Downloads larger than this are buffered on disk until they are complete
+SPOOL_SIZE = 8 * 1024 * 1024
+# The PDF header may be preceded by some garbage, within the first 1024 bytes
+HEADER_WINDOW = 1024
+
+
+class DownloadError(Exception):
+    """The URL couldn't be downloaded, or doesn't point to a PDF."""
+
+
+@dataclass(frozen=True)
+class Download:
+    url: str
+    content: bytes = field(repr=False)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(unquote(urlparse(self.url).path)).name or "document.pdf"
+
+
+def new_session(pool_size: int = FETCH_WORKERS) -> requests.Session:
+    """A session that keeps up to `pool_size` connections per host alive and retries
+    failed connections and gateway errors."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=("GET",),
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class PdfFetcher:
+    """
+    Downloads PDFs over a pooled HTTP session.
+
+    Downloads are streamed into a spooled buffer, rejected as soon as they turn out
+    not to be a PDF or to be larger than `max_size`, and cached: fetching a URL
+    again only revalidates the cached copy with its ETag or Last-Modified date.
+
+    The session can be injected, e.g. one pointing at a local test server:
+
+        fetcher = PdfFetcher(session=requests.Session(), max_size=1024 * 1024)
+        pdf = fetcher.fetch("http://127.0.0.1:8000/sample.pdf").content
+
+    The app uses one fetcher shared by all sessions (see `fetcher`).
+    """
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        max_size: int = MAX_DOWNLOAD_SIZE,
+        timeout: Tuple[float, float] = TIMEOUT,
+        max_workers: int = FETCH_WORKERS,
+        cache_size: int = DOWNLOAD_CACHE_SIZE,
+    ):
+        self.session = new_session(max_workers) if session is None else session
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._downloads = cache.ResultCache(cache_size)
+
+    def fetch(self, url: str) -> Download:
+        """
+        Download a PDF, or revalidate the cached copy.
+
+        Raises:
+            DownloadError: If the request fails, the response isn't a PDF or it's
+                larger than `max_size`.
+        """
+        cached: Optional[Download] = self._downloads.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        try:
+            with self.session.get(
+                url, headers=headers, stream=True, timeout=self.timeout
+            ) as response:
+                if response.status_code == 304 and cached is not None:
+                    return cached
+                response.raise_for_status()
+                content = self._read(response)
+        except requests.RequestException as error:
+            raise DownloadError(f"Couldn't download {url}: {error}") from error
+
+        download = Download(
+            url,
+            content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        # Responses without validators can't be revalidated, so aren't kept
+        if download.etag or download.last_modified:
+            self._downloads.put(url, download, size=len(content))
+        return download
+
+    def fetch_all(self, urls: List[str]) -> List[Union[Download, DownloadError]]:
+        """
+        Download PDFs concurrently, over at most `max_workers` connections.
+
+        Returns:
+            List[Union[Download, DownloadError]]: The download of each URL, in
+                order, or the error it failed with.
+        """
+
+        def fetch(url: str) -> Union[Download, DownloadError]:
+            try:
+                return self.fetch(url)
+            except DownloadError as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(fetch, urls))
+
+    def _read(self, response: requests.Response) -> bytes:
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > self.max_size:
+            raise DownloadError(f"{response.url} is larger than {self._limit()}")
+
+        with SpooledTemporaryFile(max_size=SPOOL_SIZE) as buffer:
+            header = b""
+            for chunk in response.iter_content(CHUNK_SIZE):
+                # Checked before downloading the rest, e.g. of an HTML error page
+                if len(header) < HEADER_WINDOW:
+                    header += chunk[: HEADER_WINDOW - len(header)]
+                    if b"%PDF-" not in header and len(header) >= HEADER_WINDOW:
+                        raise DownloadError(f"{response.url} is not a PDF")
+
+                buffer.write(chunk)
+                if buffer.tell() > self.max_size:
+                    raise DownloadError(
+                        f"{response.url} is larger than {self._limit()}"
+                    )
+
+            if b"%PDF-" not in header:
+                raise DownloadError(f"{response.url} is not a PDF")
+
+            buffer.seek(0)
+            return buffer.read()
+
+    def _limit(self) -> str:
+        return f"{self.max_size / 1024 / 1024:.3g} MB"
+
+
+@st.cache_resource
+def fetcher() -> PdfFetcher:
+    # One connection pool and download cache shared by all sessions
+    return PdfFetcher()
@@ -1,41 +1,81 @@
 import contextlib
 import re
+import shutil
+import threading
+import uuid
+import zipfile
+from dataclasses import dataclass, replace
 from datetime import datetime
+from functools import partial
 from io import BytesIO
 from pathlib import Path
 from random import random
-from typing import Callable, Dict, Literal, Optional, Tuple, Union
+from tempfile import SpooledTemporaryFile
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import pandas as pd
-import pdfplumber
-import requests
+import pypdfium2 as pdfium
 import streamlit as st
-from pdf2docx import Converter
 from PIL import Image
-from pypdf import PdfReader, PdfWriter, Transformation
-from pypdf.errors import PdfReadError, PdfStreamError
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from pypdf import PaperSize, PdfReader, PdfWriter, Transformation
+from pypdf.errors import PdfStreamError
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    StreamObject,
+)
 from streamlit import session_state
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-
-def select_pages(container, key: str):
-    return container.text_input(
-        "Pages to extract from?",
-        placeholder="all",
-        help="""
+from utils import (
+    analysis,
+    buffers,
+    cache,
+    documents,
+    fetch,
+    incremental,
+    jobs,
+    metrics,
+    parallel,
+    selection,
+    storage,
+    tasks,
+    versions,
+)
+
+
+def select_pages(container, key: str, label: str = "Pages to extract from?") -> str:
+    return (
+        container.text_input(
+            label,
+            placeholder="all",
+            help="""
     Format
     ------
     **all:** all pages  
     **2:** 2nd page  
+    **-1:** last page  
     **1-3:** pages 1 to 3  
-    **2,4:** pages 2 and 4  
+    **5-:** page 5 to the last page  
+    **1-:2:** every other page, from page 1  
     **1-3,5:** pages 1 to 3 and 5""",
-        key=key,
-    ).lower()
+            key=key,
+        ).lower()
+        or "all"
+    )
 
 
+@metrics.instrument()
 @st.cache_data
 def image_to_pdf(stamp_img: Union[Path, str]) -> PdfReader:
     img = Image.open(stamp_img)
@@ -44,6 +84,7 @@ def image_to_pdf(stamp_img: Union[Path, str]) -> PdfReader:
     return PdfReader(img_as_pdf)
 
 
+@metrics.instrument()
 @st.cache_data
 def watermark_img(
     reader: PdfReader,
@@ -95,103 +136,356 @@ def get_password(key: Literal["main", "merge"]) -> Optional[str]:
     return password if password != "" else None
 
 
+@metrics.instrument()
+def open_document(
+    document: documents.DocumentHandle,
+    password: Optional[str],
+    key: Literal["main", "merge"],
+) -> PdfReader:
+    registry = documents.registry()
+    opened = registry.get(document.digest, document.pdf, password)
+    registry.hold(key, opened)
+    return opened.reader
+
+
+def get_reader(
+    document: documents.DocumentHandle, password: Optional[str] = None
+) -> PdfReader:
+    return documents.registry().get(document.digest, document.pdf, password).reader
+
+
+@metrics.instrument()
 def upload_pdf(
     key: Literal["main", "merge"], password: Optional[str]
-) -> Optional[Tuple[bytes, PdfReader]]:
+) -> Optional[Tuple[documents.DocumentHandle, PdfReader]]:
     if file := st.file_uploader(
         label="Upload a PDF",
         type=["pdf"],
         key=f"file_{key}",
     ):
-        session_state["file"] = file
         session_state["name"] = file.name
-        pdf = file.getvalue()
-        try:
-            reader = PdfReader(BytesIO(pdf), password=password)
-        except PdfReadError:
-            reader = PdfReader(BytesIO(pdf))
-        return pdf, reader
+        document = documents.handle_for(
+            key, file.file_id, lambda: storage.read_upload(file, key)
+        )
+        return document, open_document(document, password, key)
     return None, None
 
 
+@metrics.instrument()
 def load_pdf_from_url(
     key: Literal["main", "merge"], password: Optional[str]
-) -> Optional[Tuple[bytes, PdfReader]]:
+) -> Optional[Tuple[documents.DocumentHandle, PdfReader]]:
     url = st.text_input(
         "PDF URL",
         key=f"url_{key}",
         value="https://getsamplefiles.com/download/pdf/sample-1.pdf",
     )
 
-    @st.cache_data
-    def _cached_get_url(url: str) -> requests.Response:
-        return requests.get(url)
-
     if url != "":
         try:
-            response = _cached_get_url(url)
-            session_state["file"] = pdf = response.content
+            document = documents.handle_for(
+                key, url, lambda: fetch.fetcher().fetch(url).content
+            )
             session_state["name"] = url.split("/")[-1]
-            try:
-                reader = PdfReader(BytesIO(pdf), password=password)
-            except PdfReadError:
-                reader = PdfReader(BytesIO(pdf))
-            return pdf, reader
+            return document, open_document(document, password, key)
+        except fetch.DownloadError as error:
+            st.error(str(error), icon="❌")
         except PdfStreamError:
             st.error("The URL does not seem to be a valid PDF file.", icon="❌")
     return None, None
 
 
+@metrics.instrument()
 def load_pdf(
     key: Literal["main", "merge"] = "main",
-) -> Optional[Tuple[bytes, PdfReader, str, bool]]:
+) -> Optional[Tuple[documents.DocumentHandle, PdfReader, str, bool]]:
     option = get_option(key)
     password = get_password(key)
 
     # Map options to functions
-    option_functions: Dict[str, Callable[[str, str], Tuple[bytes, PdfReader]]] = {
+    option_functions: Dict[
+        str, Callable[[str, str], Tuple[documents.DocumentHandle, PdfReader]]
+    ] = {
         "Upload a PDF ⬆️": upload_pdf,
         "Load PDF from a URL 🌐": load_pdf_from_url,
     }
 
     if function := option_functions.get(option):
-        pdf, reader = function(key, password)
+        document, reader = function(key, password)
 
-        if pdf:
+        if document and key == "main":
+            document, reader = current_version(document, password)
+
+        if document:
             preview_pdf(
                 reader,
-                pdf,
+                document,
                 key,
                 password,
             )
-            return pdf, reader, password, reader.is_encrypted
+            return document, reader, password, reader.is_encrypted
 
     return None, None, "", False
 
 
-def handle_encrypted_pdf(reader: PdfReader, password: str, key: str) -> None:
-    if password:
-        session_state["decrypted_filename"] = f"unprotected_{session_state['name']}"
-        decrypt_pdf(
-            reader,
-            password,
-            filename=session_state["decrypted_filename"],
+def version_store(document: documents.DocumentHandle) -> versions.VersionStore:
+    """The history of the main document, started over when another one is loaded."""
+    store: Optional[versions.VersionStore] = session_state.get("versions")
+    if store is None or store.origin != document.digest:
+        if store is not None:
+            store.close()
+        store = session_state["versions"] = versions.VersionStore(
+            spill_dir=storage.session_dir() / "versions"
         )
+        store.record(document.pdf, "Original", document.digest)
+    return store
+
+
+@metrics.instrument()
+def current_version(
+    document: documents.DocumentHandle, password: Optional[str]
+) -> Tuple[documents.DocumentHandle, PdfReader]:
+    """
+    The current version of the loaded document, with undo and redo buttons once
+    operations have been applied to it.
+    """
+    store = version_store(document)
+    if len(store.history) > 1:
+        show_history(store)
+
+    version = store.current
+    if version.digest != document.digest:
+        document = documents.create_handle(store.pdf(), version.digest)
+    return document, open_document(document, password, "main")
+
+
+def show_history(store: versions.VersionStore) -> None:
+    footprint = store.footprint()
+    lcol, mcol, rcol = st.columns([4, 1, 1], vertical_alignment="center")
+    lcol.caption(
+        f"Version {store.position + 1} of {len(store.history)}: "
+        f"**{store.current.label}**. History: {footprint.memory / 1024:.0f} KB "
+        f"in memory, {footprint.spilled / 1024:.0f} KB on disk, "
+        f"{footprint.deltas} of {footprint.versions} versions stored as changes."
+    )
+    mcol.button(
+        "↩️ Undo",
+        key="undo_version",
+        on_click=store.undo,
+        disabled=not store.can_undo,
+        use_container_width=True,
+    )
+    rcol.button(
+        "↪️ Redo",
+        key="redo_version",
+        on_click=store.redo,
+        disabled=not store.can_redo,
+        use_container_width=True,
+    )
+
+
+@metrics.instrument()
+def apply_output(output: storage.PdfOutput, label: str) -> None:
+    """Make an operation's output the current version of the main document."""
+    store: versions.VersionStore = session_state["versions"]
+    if isinstance(output, (Path, str)):
+        # Spilled outputs are overwritten by the next output of the same operation
+        store.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = store.spill_dir / f"output_{uuid.uuid4().hex}.pdf"
+        shutil.copyfile(output, path)
+        pdf = buffers.MappedPdf.open(path)
+    else:
+        pdf = output
+    store.record(pdf, label, documents.create_handle(pdf).digest)
+    # Every panel works on the main document, not only the one applying the output
+    st.rerun()
+
+
+def apply_button(output: storage.PdfOutput, label: str, key: str) -> None:
+    st.button(
+        "✅ Apply to document",
+        key=f"apply_{key}",
+        on_click=apply_output,
+        args=(output, label),
+        help="Continue working on this result. Undo brings back the previous version.",
+        use_container_width=True,
+    )
+
+
+@metrics.instrument()
+def load_merge_documents() -> List[Tuple[str, documents.DocumentHandle]]:
+    """
+    Upload or download the documents to merge into the main one.
+
+    Returns:
+        List[Tuple[str, documents.DocumentHandle]]: The name and handle of each
+            document, uploads first, then URLs in the order listed.
+    """
+    files = st.file_uploader(
+        "PDFs to merge",
+        type=["pdf"],
+        accept_multiple_files=True,
+        key="files_merge",
+    )
+    urls = [
+        url.strip()
+        for url in st.text_area(
+            "PDF URLs to merge, one per line", key="urls_merge"
+        ).splitlines()
+        if url.strip()
+    ]
+
+    # Documents are only read (and hashed) once, keyed by file ID or URL
+    loaded: Dict[str, Tuple[str, documents.DocumentHandle]] = session_state.setdefault(
+        "merge_documents", {}
+    )
+    for file in files:
+        if file.file_id not in loaded:
+            loaded[file.file_id] = (
+                file.name,
+                documents.create_handle(
+                    storage.read_upload(file, f"merge_{file.file_id}")
+                ),
+            )
+
+    if missing := [url for url in urls if url not in loaded]:
+        for url, download in zip(missing, fetch.fetcher().fetch_all(missing)):
+            if isinstance(download, fetch.DownloadError):
+                st.error(str(download), icon="❌")
+            else:
+                loaded[url] = (download.name, documents.create_handle(download.content))
+
+    sources = [file.file_id for file in files] + urls
+    for source in loaded.keys() - set(sources):
+        del loaded[source]
+    return [loaded[source] for source in sources if source in loaded]
+
+
+PREVIEW_WIDTH = 400
+PREVIEW_PAGES = {"main": 6, "other": 2}
+PREVIEW_COLUMNS = {"main": 3, "other": 1}
+
+# PDFium isn't thread-safe, even across documents, and sessions run in threads
+_pdfium_lock = threading.Lock()
+
+
+@metrics.instrument()
+def render_pages(
+    document: documents.DocumentHandle,
+    pages: List[int],
+    password: Optional[str] = None,
+    width: int = PREVIEW_WIDTH,
+) -> List[bytes]:
+    """
+    Render pages to JPEG thumbnails, caching them per document and page.
+
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        pages (List[int]): The page indices.
+        password (Optional[str]): The password of the document.
+        width (int): The width of the thumbnails in pixels.
+
+    Returns:
+        List[bytes]: The thumbnail of each page.
+    """
+    result_cache = cache.result_cache()
+    keys = [
+        (document.digest, "page", page, width, cache.password_key(password))
+        for page in pages
+    ]
+    thumbnails = [result_cache.get(key) for key in keys]
+
+    if missing := [
+        index for index, thumbnail in enumerate(thumbnails) if not thumbnail
+    ]:
+        # The document is only opened if some pages aren't cached yet
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(buffers.source(document.pdf), password=password)
+            try:
+                for index in missing:
+                    page = pdf[pages[index]]
+                    image = page.render(scale=width / page.get_width()).to_pil()
+                    buffer = BytesIO()
+                    image.convert("RGB").save(buffer, format="JPEG", quality=75)
+                    thumbnails[index] = buffer.getvalue()
+                    result_cache.put(keys[index], thumbnails[index])
+            finally:
+                pdf.close()
+
+    return thumbnails
+
+
+@st.fragment
+def show_pages(
+    document: documents.DocumentHandle,
+    page_count: int,
+    key: str,
+    password: Optional[str] = None,
+) -> None:
+    """
+    Preview a document as thumbnails of a few pages at a time, or in the full viewer.
+
+    Paging only reruns this fragment, and only the visible pages are rendered and
+    sent to the browser. The full viewer sends the whole document.
+
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        page_count (int): The number of pages.
+        key (str): Identifies the preview, e.g. "main".
+        password (Optional[str]): The password of the document.
+    """
+    if st.toggle("Full viewer", key=f"full_viewer_{key}"):
         st.pdf(
-            f"unprotected_{session_state['name']}",
+            # The viewer can't decrypt documents itself
+            (
+                decrypted_pdf(document, password)
+                if password
+                else buffers.source(document.pdf)
+            ),
             height=600 if key == "main" else 250,
             key=str(random()),
         )
+        return
+
+    per_view = PREVIEW_PAGES.get(key, PREVIEW_PAGES["other"])
+    views = max(1, (page_count + per_view - 1) // per_view)
+    view = (
+        st.number_input(
+            f"View (of {views})",
+            min_value=1,
+            max_value=views,
+            # Per document, as the number of views changes with it
+            key=f"preview_view_{key}_{document.digest}",
+        )
+        if views > 1
+        else 1
+    )
+    pages = list(range((view - 1) * per_view, min(view * per_view, page_count)))
+    st.caption(f"Pages {pages[0] + 1}–{pages[-1] + 1} of {page_count}")
+
+    columns = st.columns(PREVIEW_COLUMNS.get(key, PREVIEW_COLUMNS["other"]))
+    for index, (page, thumbnail) in enumerate(
+        zip(pages, render_pages(document, pages, password))
+    ):
+        columns[index % len(columns)].image(thumbnail, caption=f"Page {page + 1}")
+
+
+def handle_encrypted_pdf(
+    document: documents.DocumentHandle,
+    reader: PdfReader,
+    password: str,
+    key: str,
+) -> None:
+    if password:
+        show_pages(document, len(reader.pages), key, password)
     else:
         st.error("Password required", icon="🔒")
 
 
-def handle_unencrypted_pdf(pdf: bytes, key: str) -> None:
-    st.pdf(
-        pdf,
-        height=600 if key == "main" else 250,
-        key=str(random()),
-    )
+def handle_unencrypted_pdf(
+    document: documents.DocumentHandle, reader: PdfReader, key: str
+) -> None:
+    show_pages(document, len(reader.pages), key)
 
 
 def display_metadata(reader: PdfReader) -> None:
@@ -209,27 +503,32 @@ def display_metadata(reader: PdfReader) -> None:
     st.dataframe(metadata)
 
 
+@metrics.instrument()
 def preview_pdf(
     reader: PdfReader,
-    pdf: bytes = None,
-    key: Literal["main", "other"] = "main",
+    document: documents.DocumentHandle,
+    key: str = "main",
     password: str = "",
 ) -> None:
+    """
+    Preview a document. The "main" preview comes with its metadata; other keys
+    (e.g. "original" and "reduced") get a compact preview.
+    """
     with contextlib.suppress(NameError):
         if key == "main":
             lcol, rcol = st.columns([2, 1])
-            with lcol.expander("📄 **Preview**", expanded=bool(pdf)):
+            with lcol.expander("📄 **Preview**", expanded=True):
                 if reader.is_encrypted:
-                    handle_encrypted_pdf(reader, password, key)
+                    handle_encrypted_pdf(document, reader, password, key)
                 else:
-                    handle_unencrypted_pdf(pdf, key)
+                    handle_unencrypted_pdf(document, reader, key)
 
             with rcol.expander("🗄️ **Metadata**"):
                 display_metadata(reader)
         elif reader.is_encrypted:
-            handle_encrypted_pdf(reader, password, key)
+            handle_encrypted_pdf(document, reader, password, key)
         else:
-            handle_unencrypted_pdf(pdf, key)
+            handle_unencrypted_pdf(document, reader, key)
 
 
 @st.cache_data
@@ -256,65 +555,283 @@ def convert_pdf_datetime(pdf_datetime: str) -> str:
     )
 
 
-@st.cache_data
-def parse_page_numbers(page_numbers_str):
-    # Split the input string by comma or hyphen
-    parts = page_numbers_str.split(",")
-
-    # Initialize an empty list to store parsed page numbers
-    parsed_page_numbers = []
-
-    # Iterate over each part
-    for part in parts:
-        # Remove any leading/trailing spaces
-        part = part.strip()
-
-        # If the part contains a hyphen, it represents a range
-        if "-" in part:
-            start, end = map(int, part.split("-"))
-            parsed_page_numbers.extend(range(start, end + 1))
-        else:
-            # Otherwise, it's a single page number
-            parsed_page_numbers.append(int(part))
+PageInput = Union[str, selection.PageSelection]
+
+
+def get_page_indices(
+    reader: PdfReader, pages: PageInput = "all"
+) -> selection.PageSelection:
+    """
+    Resolve the pages an operation applies to.
+
+    Args:
+        reader (PdfReader): The opened document.
+        pages (PageInput): A selection, or the text of one (see
+            `selection.PageSelection.parse`).
 
-    return [i - 1 for i in parsed_page_numbers]
+    Raises:
+        ValueError: If the text can't be parsed.
+        IndexError: If a page doesn't exist.
+    """
+    if isinstance(pages, selection.PageSelection):
+        return pages
+    return selection.PageSelection.parse(pages, len(reader.pages))
 
 
 def extract_text(
-    reader: PdfReader.pages,
-    page_numbers_str: str = "all",
+    reader: PdfReader,
+    document: documents.DocumentHandle,
+    pages: PageInput = "all",
     mode: Literal["plain", "layout"] = "plain",
-) -> str:
-    text = ""
+    password: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Extract text page by page, in parallel for large documents.
 
-    if page_numbers_str == "all":
-        for page in reader.pages:
-            text = text + " " + page.extract_text(extraction_mode=mode)
-    else:
-        pages = parse_page_numbers(page_numbers_str)
-        for page in pages:
-            text = text + " " + reader.pages[page].extract_text()
+    Page numbers are validated before any extraction starts, so invalid selections
+    raise immediately rather than while iterating.
 
-    return text
+    Args:
+        reader (PdfReader): The opened document, used for small documents.
+        document (documents.DocumentHandle): The PDF document, opened by each
+            worker process (see `worker_input`).
+        pages (PageInput): The pages to extract text from.
+        mode (Literal["plain", "layout"]): The extraction mode.
+        password (Optional[str]): The password of the document.
 
+    Returns:
+        Iterator[str]: The text of each selected page, in order.
+    """
+    pages = list(get_page_indices(reader, pages))
+    pdf, password = worker_input(document, password, len(pages))
+
+    return parallel.map_pages(
+        partial(parallel.page_text, mode=mode),
+        pdf,
+        pages,
+        password=password,
+        opened=reader,
+    )
 
-def extract_images(reader: PdfReader.pages, page_numbers_str: str = "all") -> str:
-    images = {}
-    if page_numbers_str == "all":
-        for page in reader.pages:
-            images |= {image.data: image.name for image in page.images}
 
-    else:
-        pages = parse_page_numbers(page_numbers_str)
-        for page in pages:
-            images.update(
-                {image.data: image.name for image in reader.pages[page].images}
+# Images whose encoded stream is already a complete image file are exported as is
+IMAGE_FILE_FILTERS = {"/DCTDecode": ".jpg", "/JPXDecode": ".jp2"}
+THUMBNAIL_SIZE = 256
+IMAGES_PER_PAGE = 12
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """An image XObject, described without decoding it."""
+
+    page: int
+    # Resource names from the page down to the image, e.g. ("/Fm0", "/Im1")
+    path: Tuple[str, ...]
+    width: int
+    height: int
+    filter: str
+    # Size of the encoded stream in bytes
+    size: int
+    digest: str
+    # Every selected page the image is used on
+    pages: Tuple[int, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return "/".join(name[1:] for name in self.path)
+
+
+def _image_xobject(reader: PdfReader, image: ImageInfo) -> StreamObject:
+    xobject = reader.pages[image.page]
+    for name in image.path:
+        xobject = xobject["/Resources"]["/XObject"][name]
+    return xobject
+
+
+def _page_images(
+    reader: PdfReader, page: int, digests: Dict[Tuple[int, int], str]
+) -> List[ImageInfo]:
+    # `digests` maps object references to digests, so shared images are hashed once
+    images = []
+
+    def walk(obj: DictionaryObject, ancestors: Tuple[str, ...], visited: set) -> None:
+        resources = obj.get("/Resources")
+        xobjects = resources.get("/XObject") if resources else None
+        if not isinstance(xobjects, DictionaryObject):
+            return
+
+        for name, xobject in xobjects.items():
+            xobject = xobject.get_object()
+            if not isinstance(xobject, StreamObject):
+                continue
+            reference = xobject.indirect_reference
+            reference = reference and (reference.idnum, reference.generation)
+
+            if xobject.get("/Subtype") != "/Image":
+                # Forms can draw images too, and can be nested
+                if reference not in visited:
+                    walk(xobject, (*ancestors, name), visited | {reference})
+                continue
+
+            if reference is None or reference not in digests:
+                # The encoded stream is hashed as stored, without decoding it
+                digest = cache.digest(xobject._data)
+                if reference is not None:
+                    digests[reference] = digest
+            else:
+                digest = digests[reference]
+
+            filters = xobject.get("/Filter", ())
+            images.append(
+                ImageInfo(
+                    page=page,
+                    path=(*ancestors, name),
+                    width=int(xobject.get("/Width", 0)),
+                    height=int(xobject.get("/Height", 0)),
+                    filter=(
+                        " ".join(filters)
+                        if isinstance(filters, ArrayObject)
+                        else str(filters)
+                    ),
+                    size=len(xobject._data),
+                    digest=digest,
+                )
             )
 
+    walk(reader.pages[page], (), set())
     return images
 
 
-def extract_tables(file, page_numbers_str):
+@metrics.instrument()
+def index_images(
+    document: documents.DocumentHandle,
+    pages: PageInput = "all",
+    password: Optional[str] = None,
+) -> List[ImageInfo]:
+    """
+    List the distinct images on the selected pages, without decoding them.
+
+    Images drawn more than once, whether through the same object or identical copies
+    of it, are listed once with every page they appear on. Each page's images are
+    cached per document.
+
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        pages (PageInput): The pages to list images from.
+        password (Optional[str]): The password of the document.
+
+    Returns:
+        List[ImageInfo]: The distinct images, in order of first appearance.
+    """
+    reader = get_reader(document, password)
+    pages = get_page_indices(reader, pages)
+
+    result_cache = cache.result_cache()
+    digests = {}
+    images: Dict[str, ImageInfo] = {}
+
+    for page in pages:
+        key = (document.digest, "images", page)
+        page_images = result_cache.get(key)
+        if page_images is None:
+            page_images = _page_images(reader, page, digests)
+            # Rough size of the entries, as the images themselves aren't kept
+            result_cache.put(key, page_images, size=200 * len(page_images))
+
+        for image in page_images:
+            if image.digest not in images:
+                images[image.digest] = replace(image, pages=(page,))
+            elif page not in (first := images[image.digest]).pages:
+                images[image.digest] = replace(first, pages=(*first.pages, page))
+
+    return list(images.values())
+
+
+@metrics.instrument()
+def image_thumbnail(
+    document: documents.DocumentHandle,
+    image: ImageInfo,
+    password: Optional[str] = None,
+    max_size: int = THUMBNAIL_SIZE,
+) -> bytes:
+    """
+    Render a downscaled PNG of an image, caching it per document and image.
+
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        image (ImageInfo): The image, as listed by `index_images`.
+        password (Optional[str]): The password of the document.
+        max_size (int): The maximum width and height of the thumbnail.
+
+    Returns:
+        bytes: The thumbnail as PNG.
+    """
+
+    def _thumbnail() -> bytes:
+        reader = get_reader(document, password)
+        xobject = _image_xobject(reader, image)
+
+        if image.filter == "/DCTDecode" and "/Decode" not in xobject:
+            # Let the JPEG decoder downscale while decoding, instead of decoding fully
+            thumbnail = Image.open(BytesIO(xobject._data))
+            thumbnail.draft("RGB", (max_size, max_size))
+        else:
+            thumbnail = reader.pages[image.page].images[image.path].image
+
+        thumbnail.thumbnail((max_size, max_size))
+        if thumbnail.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+            thumbnail = thumbnail.convert("RGB")
+
+        buffer = BytesIO()
+        thumbnail.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    return cache.result_cache().get_or_compute(
+        (document.digest, "thumbnail", image.digest, max_size), _thumbnail
+    )
+
+
+@metrics.instrument()
+def export_images(
+    document: documents.DocumentHandle,
+    images: List[ImageInfo],
+    password: Optional[str] = None,
+) -> BinaryIO:
+    """
+    Export the original images as a ZIP, writing and decoding one image at a time.
+
+    JPEG and JPEG 2000 images are exported exactly as stored in the document, the
+    others as decoded by pypdf (usually PNG).
+
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        images (List[ImageInfo]): The images, as listed by `index_images`.
+        password (Optional[str]): The password of the document.
+
+    Returns:
+        BinaryIO: The ZIP, kept on disk if it's larger than `storage.SPILL_THRESHOLD`.
+    """
+    reader = get_reader(document, password)
+    archive_file = SpooledTemporaryFile(max_size=storage.SPILL_THRESHOLD)
+
+    # Images are compressed already, so store them as they are
+    with zipfile.ZipFile(archive_file, "w", compression=zipfile.ZIP_STORED) as archive:
+        for image in images:
+            stem = f"page_{image.page + 1}_{image.name.replace('/', '_')}"
+            if image.filter in IMAGE_FILE_FILTERS:
+                archive.writestr(
+                    f"{stem}{IMAGE_FILE_FILTERS[image.filter]}",
+                    _image_xobject(reader, image)._data,
+                )
+            else:
+                decoded = reader.pages[image.page].images[image.path]
+                archive.writestr(f"{stem}{Path(decoded.name).suffix}", decoded.data)
+
+    archive_file.seek(0)
+    return archive_file
+
+
+def select_table_strategies() -> Tuple[str, str]:
     st.caption(
         "Adjust vertical and horizontal strategies for better extraction. Read details about the strategies [here](https://github.com/jsvine/pdfplumber?tab=readme-ov-file#table-extraction-strategies)."
     )
@@ -330,241 +847,419 @@ def extract_tables(file, page_numbers_str):
         index=2,
     )
 
-    header = st.checkbox("Header")
-
-    first_row_index = 1 if header else 0
-
-    with pdfplumber.open(
-        BytesIO(file) if isinstance(file, bytes) else file,
-        password=session_state["password"],
-    ) as table_pdf:
-        if page_numbers_str == "all":
-            for page in table_pdf.pages:
-                for table in page.extract_tables(
-                    {
-                        "vertical_strategy": vertical_strategy,
-                        "horizontal_strategy": horizontal_strategy,
-                    }
-                ):
-                    st.write(
-                        pd.DataFrame(
-                            table[first_row_index:],
-                            columns=table[0] if header else None,
-                        )
-                    )
-        else:
-            pages = parse_page_numbers(page_numbers_str)
-            for page in pages:
-                for page in table_pdf.pages[page : page + 1]:
-                    for table in page.extract_tables(
-                        {
-                            "vertical_strategy": vertical_strategy,
-                            "horizontal_strategy": horizontal_strategy,
-                        }
-                    ):
-                        st.write(
-                            pd.DataFrame(
-                                table[first_row_index:],
-                                columns=table[0] if header else None,
-                            )
-                        )
-
-
-def decrypt_pdf(reader: PdfReader, password: str, filename: str) -> None:
-    reader.decrypt(password)
-
-    writer = PdfWriter()
-
-    for page in reader.pages:
-        writer.add_page(page)
+    return vertical_strategy, horizontal_strategy
 
-    with open(filename, "wb") as f:
-        writer.write(f)
 
+Table = List[List[Optional[str]]]
 
-@st.cache_data
-def remove_images(pdf: bytes, remove_images: bool, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
-
-    if reader.is_encrypted:
-        reader.decrypt(password)
 
-    writer = PdfWriter()
+@metrics.instrument()
+def extract_tables(
+    document: documents.DocumentHandle,
+    pages: PageInput = "all",
+    vertical_strategy: str = "text",
+    horizontal_strategy: str = "text",
+    password: Optional[str] = None,
+) -> List[Tuple[int, Table]]:
+    """
+    Extract the raw rows of every table on the selected pages.
 
-    for page in reader.pages:
-        writer.add_page(page)
+    Each page's tables are cached per (document, page, strategies), so only pages
+    that weren't extracted before are processed, in parallel for large selections.
 
-    writer.add_metadata(reader.metadata)
+    Args:
+        document (documents.DocumentHandle): The PDF document.
+        pages (PageInput): The pages to extract tables from.
+        vertical_strategy (str): The pdfplumber vertical strategy.
+        horizontal_strategy (str): The pdfplumber horizontal strategy.
+        password (Optional[str]): The password of the document.
 
-    if remove_images:
-        writer.remove_images()
+    Returns:
+        List[Tuple[int, Table]]: The zero-based page index and rows of each table.
+    """
+    opened = documents.registry().get(document.digest, document.pdf, password)
+    pages = get_page_indices(opened.reader, pages)
+
+    result_cache = cache.result_cache()
+
+    def key(page: int) -> Tuple:
+        return (document.digest, "tables", page, vertical_strategy, horizontal_strategy)
+
+    tables = {page: result_cache.get(key(page)) for page in pages}
+
+    missing = [page for page, page_tables in tables.items() if page_tables is None]
+    pdf, pdf_password = worker_input(document, opened.password, len(missing))
+    for page, page_tables in zip(
+        missing,
+        parallel.map_pages(
+            partial(
+                parallel.page_tables,
+                vertical_strategy=vertical_strategy,
+                horizontal_strategy=horizontal_strategy,
+            ),
+            pdf,
+            missing,
+            password=pdf_password,
+            opened=opened.plumber,
+            opener=parallel.open_plumber,
+        ),
+    ):
+        tables[page] = page_tables
+        result_cache.put(
+            key(page),
+            page_tables,
+            size=sum(
+                len(cell or "")
+                for table in page_tables
+                for row in table
+                for cell in row
+            ),
+        )
 
-    bytes_stream = BytesIO()
-    writer.write(bytes_stream)
+    return [(page, table) for page in pages for table in tables[page]]
 
-    bytes_stream.seek(0)
 
-    return bytes_stream.getvalue()
+@metrics.instrument()
+def tables_to_frames(
+    tables: List[Tuple[int, Table]], header: bool = False
+) -> Dict[str, pd.DataFrame]:
+    """
+    Shape extracted table rows into DataFrames.
 
+    Args:
+        tables (List[Tuple[int, Table]]): The tables returned by `extract_tables`.
+        header (bool): Whether the first row of each table is its header.
 
-def reduce_image_quality(pdf: bytes, quality: int, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
+    Returns:
+        Dict[str, pd.DataFrame]: The tables, named after their page and position.
+    """
+    frames = {}
+    for index, (page, table) in enumerate(tables):
+        if header:
+            # Header cells can be empty or repeated, which Excel and Parquet reject
+            columns = [str(cell or f"column_{i}") for i, cell in enumerate(table[0])]
+            columns = [
+                column if columns.index(column) == i else f"{column}_{i}"
+                for i, column in enumerate(columns)
+            ]
+            frame = pd.DataFrame(table[1:], columns=columns)
+        else:
+            frame = pd.DataFrame(table, columns=[str(i) for i in range(len(table[0]))])
+        frames[f"page_{page + 1}_table_{index + 1}"] = frame
+    return frames
 
-    if reader.is_encrypted:
-        reader.decrypt(password)
 
-    writer = PdfWriter()
+@metrics.instrument()
+def export_tables(
+    frames: Dict[str, pd.DataFrame], file_format: Literal["CSV", "Excel", "Parquet"]
+) -> bytes:
+    """
+    Export tables as a ZIP of CSV or Parquet files, or as one Excel sheet per table.
 
-    for page in reader.pages:
-        writer.add_page(page)
+    Args:
+        frames (Dict[str, pd.DataFrame]): The tables returned by `tables_to_frames`.
+        file_format (Literal["CSV", "Excel", "Parquet"]): The export format.
 
-    writer.add_metadata(reader.metadata)
+    Returns:
+        bytes: The exported file.
+    """
+    buffer = BytesIO()
+
+    if file_format == "Excel":
+        with pd.ExcelWriter(buffer, engine="openpyxl") as excel:
+            for name, frame in frames.items():
+                # Sheet names are limited to 31 characters
+                frame.to_excel(excel, sheet_name=name[:31], index=False)
+        return buffer.getvalue()
+
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, frame in frames.items():
+            if file_format == "CSV":
+                archive.writestr(f"{name}.csv", frame.to_csv(index=False))
+            else:
+                archive.writestr(f"{name}.parquet", frame.to_parquet(index=False))
+    return buffer.getvalue()
+
+
+def selected_pages(
+    document: documents.DocumentHandle, pages: PageInput, password: Optional[str]
+) -> Optional[selection.PageSelection]:
+    """
+    Resolve the pages an operation applies to, as `tasks` take them: None for all
+    pages. See `get_page_indices`.
+    """
+    pages = get_page_indices(get_reader(document, password), pages)
+    return None if pages.is_everything else pages
 
-    for page in writer.pages:
-        for img in page.images:
-            img.replace(img.image, quality=quality)
 
-    bytes_stream = BytesIO()
-    writer.write(bytes_stream)
+@metrics.instrument()
+def rotate_pdf(
+    document: documents.DocumentHandle,
+    angle: int,
+    pages: PageInput = "all",
+    password: Optional[str] = None,
+) -> bytes:
+    """Rotate the selected pages, see `tasks.rotate_pages`. The output isn't encrypted."""
+    pages = selected_pages(document, pages, password)
 
-    bytes_stream.seek(0)
+    def _rotate() -> bytes:
+        pdf, pdf_password = job_input(document, password)
+        return tasks.rotate_pages(pdf, angle, pages, pdf_password)
 
-    return bytes_stream.getvalue()
+    return cache.result_cache().get_or_compute(
+        (document.digest, "rotate", angle, pages), _rotate
+    )
 
 
-@st.cache_data
-def compress_pdf(pdf: bytes, password: str) -> bytes:
-    reader = PdfReader(BytesIO(pdf))
+@metrics.instrument()
+def scale_pdf(
+    document: documents.DocumentHandle,
+    paper_size: str,
+    scale_content: float,
+    pages: PageInput = "all",
+    password: Optional[str] = None,
+) -> bytes:
+    """Scale the selected pages, see `tasks.scale_pages`. The output isn't encrypted."""
+    pages = selected_pages(document, pages, password)
+
+    def _scale() -> bytes:
+        pdf, pdf_password = job_input(document, password)
+        size = getattr(PaperSize, paper_size)
+        return tasks.scale_pages(
+            pdf, size.width, size.height, scale_content, pages, pdf_password
+        )
 
-    if reader.is_encrypted:
-        reader.decrypt(password)
+    return cache.result_cache().get_or_compute(
+        (document.digest, "scale", paper_size, scale_content, pages), _scale
+    )
 
-    writer = PdfWriter(clone_from=reader)
 
-    for page in writer.pages:
-        page.compress_content_streams()  # This is CPU intensive!
+@metrics.instrument()
+def decrypted_pdf(document: documents.DocumentHandle, password: str) -> bytes:
+    """
+    Remove the password of a document, once per document and password.
 
-    bytes_stream = BytesIO()
-    writer.write(bytes_stream)
-    bytes_stream.seek(0)
+    The decrypted document is kept in the result cache, so the preview, the
+    "Remove password" download and jobs share it.
+    """
+    return cache.result_cache().get_or_compute(
+        (document.digest, "decrypted", cache.password_key(password)),
+        lambda: storage.pdf_bytes(PdfWriter(clone_from=get_reader(document, password))),
+    )
 
-    return bytes_stream.getvalue()
 
+def job_input(
+    document: documents.DocumentHandle, password: Optional[str]
+) -> Tuple[buffers.PdfData, Optional[str]]:
+    """
+    The document and password to pass to a job: encrypted documents are passed
+    decrypted, so the job's workers don't decrypt them again.
+    """
+    if password and get_reader(document, password).is_encrypted:
+        return decrypted_pdf(document, password), None
+    return document.pdf, password
 
-@st.cache_data
-def convert_pdf_to_word(pdf):
-    cv = Converter(stream=pdf, password=session_state.password)
-    docx_stream = BytesIO()
-    cv.convert(docx_stream, start=0, end=None)
-    cv.close()
 
-    docx_stream.seek(0)
-    return docx_stream
+def worker_input(
+    document: documents.DocumentHandle, password: Optional[str], pages: int
+) -> Tuple[buffers.PdfData, Optional[str]]:
+    """
+    The document and password to pass to `parallel.map_pages` for this many pages:
+    decrypted like `job_input` if worker processes open it, as is otherwise.
+    """
+    if parallel.uses_workers(pages):
+        return job_input(document, password)
+    return document.pdf, password
 
 
-def hex_to_rgb(hex_color: str) -> Tuple[float, float, float]:
+def keep_password(
+    reader: PdfReader, password: Optional[str], key: str
+) -> Optional[tasks.Protection]:
     """
-    Convert a hexadecimal color code to an RGB color tuple.
-
-    Args:
-        hex_color (str): The hexadecimal color code.
+    Ask whether to restore the document's password on an operation's output.
 
     Returns:
-        Tuple[float, float, float]: The RGB color tuple
+        Optional[tasks.Protection]: The document's protection, if it's encrypted and
+            the user keeps it.
     """
-    hex_color = hex_color.lstrip("#")
-    return tuple(int(hex_color[i : i + 2], 16) / 255 for i in (0, 2, 4))
+    protection = tasks.protection_of(reader, password)
+    if protection is not None and st.checkbox(
+        "Keep password",
+        value=True,
+        key=f"keep_password_{key}",
+        help="Encrypt the output with the password, algorithm and permissions of this PDF",
+    ):
+        return protection
+    return None
+
+
+@metrics.instrument()
+def protected_data(
+    output: storage.PdfOutput, protection: Optional[tasks.Protection]
+) -> Callable[[], bytes]:
+    """Download data for an output, encrypted with `protection` when downloaded."""
+    data = storage.download_data(output)
+    if protection is None:
+        return data
+    return lambda: tasks.encrypt_pdf(data(), protection)
+
+
+@metrics.instrument()
+def size_report(
+    document: documents.DocumentHandle, password: Optional[str] = None
+) -> analysis.SizeReport:
+    """Break down the size of a document by category, caching it per document."""
+    key = (document.digest, "size report", cache.password_key(password))
+    result_cache = cache.result_cache()
+    report = result_cache.get(key)
+    if report is None:
+        report = analysis.analyze_size(document.pdf, get_reader(document, password))
+        # Rough size of the entry, as it only holds counts and short descriptions
+        result_cache.put(key, report, size=200 * (len(report.largest) + 1))
+    return report
+
+
+def show_size_report(report: analysis.SizeReport) -> None:
+    """Show where the bytes of a document go, and which option would help most."""
+    categories = {
+        category: size for category, size in report.categories.items() if size
+    }
+    st.dataframe(
+        {
+            "Category": list(categories),
+            "Size (KB)": [round(size / 1024, 2) for size in categories.values()],
+            "Share": [f"{report.share(category):.1%}" for category in categories],
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
 
+    largest = max(categories, key=categories.get, default=None)
+    if largest in analysis.HINTS and report.share(largest) >= 0.25:
+        st.caption(f"Most of this file is {largest}. Try: {analysis.HINTS[largest]}.")
+    if report.unreferenced_objects:
+        st.caption(
+            f"{report.unreferenced_objects} objects are not used by the document."
+        )
 
-def draw_watermark_grid(
-    can, stamp_label: str, step_x: int, step_y: int, width: float, height: float
-) -> None:
-    """
-    Draw a grid of watermarks on the given canvas.
+    st.write("**Largest objects**")
+    st.dataframe(
+        {
+            "Object": [obj.idnum for obj in report.largest],
+            "Category": [obj.category for obj in report.largest],
+            "Size (KB)": [round(obj.size / 1024, 2) for obj in report.largest],
+            "Description": [obj.description for obj in report.largest],
+            "Pages": [
+                (
+                    ", ".join(map(str, obj.pages))
+                    if len(obj.pages) <= 10
+                    # Objects used by many pages (e.g. shared fonts) would flood the table
+                    else f"{len(obj.pages)} pages"
+                )
+                for obj in report.largest
+            ],
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
 
-    Args:
-        can (canvas.Canvas): The canvas to draw the watermarks on.
-        stamp_label (str): The label to be displayed as the watermark.
-        step_x (int): The horizontal spacing between watermarks.
-        step_y (int): The vertical spacing between watermarks.
-        width (float): The width of the canvas.
-        height (float): The height of the canvas.
 
-    Returns:
-        None
+def show_job(job_id: Optional[str]) -> Optional[jobs.Job]:
     """
-    for x in range(-100, int(width) + 100, step_x):
-        for y in range(-100, int(height) + 100, step_y):
-            can.saveState()
-            can.translate(x, y)
-            can.rotate(45)
-            can.drawCentredString(0, 0, stamp_label)
-            can.restoreState()
+    Show the progress of a job until it has finished.
 
-
-def merge_watermark_into_pdf(pdf: bytes, watermark: BytesIO) -> bytes:
-    """
-    Merge a watermark into a PDF document.
+    Progress is polled by a fragment, so the job keeps running (and the rest of the
+    app stays responsive) while it's shown. The app reruns once the job finishes.
 
     Args:
-        pdf (bytes): The PDF document to merge the watermark into.
-        watermark (BytesIO): The watermark to merge into the PDF.
+        job_id (Optional[str]): The job, as returned by `jobs.submit`.
 
     Returns:
-        bytes: The merged PDF document.
+        Optional[jobs.Job]: The job if it has finished successfully, else None.
     """
-    writer = PdfWriter()
-    reader = PdfReader(BytesIO(pdf))
-    watermark_reader = PdfReader(watermark)
-    watermark_page = watermark_reader.pages[0]
-    for page in reader.pages:
-        page.merge_page(watermark_page)
-        writer.add_page(page)
-    with BytesIO() as fp:
-        writer.write(fp)
-        fp.seek(0)
-        return fp.read()
+    job = jobs.scheduler().get(job_id) if job_id else None
+    if job is None:
+        return None
+    if job.status == "done":
+        return job
+    if job.status == "failed":
+        st.error(f"{job.label} failed: {job.error}", icon="⚠️")
+        return None
+    if job.status == "cancelled":
+        st.info(f"{job.label} was cancelled")
+        return None
+
+    @st.fragment(run_every=jobs.POLL_INTERVAL)
+    def poll() -> None:
+        job = jobs.scheduler().get(job_id)
+        if job is None or not job.active:
+            st.rerun()
+
+        lcol, rcol = st.columns([3, 1])
+        lcol.progress(
+            job.fraction,
+            text=(
+                f"{job.label}: {job.fraction:.0%}"
+                if job.total
+                else f"{job.label}: {job.status}"
+            ),
+        )
+        if rcol.button("Cancel", key=f"cancel_{job_id}", use_container_width=True):
+            jobs.scheduler().cancel(job_id)
 
+    poll()
+    return None
 
-def create_watermark_canvas(
-    stamp_label: str, stamp_size: int, stamp_color: str, stamp_transparency: float
-) -> BytesIO:
+
+@metrics.instrument()
+def merge_watermark_into_pdf(
+    document: documents.DocumentHandle,
+    create_watermark: Callable[[float, float], BytesIO],
+    pages: Optional[selection.PageSelection] = None,
+    password: Optional[str] = None,
+) -> bytes:
     """
-    Create a watermark canvas with the given label, size, color, and transparency.
+    Merge a watermark into a PDF document, see `tasks.watermark_update`.
+
+    Only the watermarked pages are rewritten, in an incremental update, and the
+    output isn't encrypted.
 
     Args:
-        stamp_label (str): The label to be displayed as the watermark.
-        stamp_size (int): The font size of the watermark.
-        stamp_color (str): The color of the watermark in hexadecimal format.
-        stamp_transparency (float): The transparency of the watermark.
+        document (documents.DocumentHandle): The PDF document to merge the watermark into.
+        create_watermark (Callable[[float, float], BytesIO]): Creates the watermark
+            for a page width and height.
+        pages (Optional[selection.PageSelection]): The pages to watermark.
+            Defaults to all pages.
+        password (Optional[str]): The password of the document.
 
     Returns:
-        BytesIO: A BytesIO object containing the watermark canvas.
-    """
-    packet = BytesIO()
-    can = canvas.Canvas(packet, pagesize=letter)
-    can.setFont("Helvetica", stamp_size)
-    color = hex_to_rgb(stamp_color)
-    can.setFillColorRGB(*color)
-    can.setFillAlpha(stamp_transparency)
-    can.saveState()
-    draw_watermark_grid(
-        can, stamp_label, step_x=150, step_y=100, width=letter[0], height=letter[1]
-    )
-    can.save()
-    packet.seek(0)
-    return packet
+        bytes: The merged PDF document.
+    """
+    update = incremental.open_update(*job_input(document, password))
+    tasks.watermark_update(update, create_watermark, pages)
+    return update.to_bytes()
 
 
-@st.cache_data
+@metrics.instrument()
+@st.cache_data(hash_funcs=documents.HASH_FUNCS)
 def watermark_pdf(
-    pdf: bytes,
+    document: documents.DocumentHandle,
     stamp_label: str,
     stamp_size: int,
     stamp_color: str,
     stamp_transparency: float,
+    pages: PageInput = "all",
+    password: Optional[str] = None,
 ) -> bytes:
-    watermark = create_watermark_canvas(
-        stamp_label, stamp_size, stamp_color, stamp_transparency
+    return merge_watermark_into_pdf(
+        document,
+        partial(
+            tasks.create_watermark_canvas,
+            stamp_label,
+            stamp_size,
+            stamp_color,
+            stamp_transparency,
+        ),
+        pages=selected_pages(document, pages, password),
+        password=password,
     )
-    return merge_watermark_into_pdf(pdf, watermark)
@@ -0,0 +1,339 @@
+import copy
+import re
+import struct
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+)
+
+from utils import buffers, parallel
+
+# Transforms that only change some objects of a document (e.g. rotating a few pages)
+# append the changed objects to it as an incremental update, instead of rewriting the
+# whole document. Like `parallel`, this module must not import Streamlit.
+
+# What `startxref` points at in documents that can be appended to
+_XREF = re.compile(rb"xref|\d+\s+\d+\s+obj")
+# Page attributes that can be set on nodes of the page tree instead of each page
+_INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class IncrementalUpdate:
+    """
+    Changes to a PDF, written after its original bytes (ISO 32000-1, 7.5.6).
+
+    Pages are modified through `page`, other objects of the document in place,
+    through `reader`, and registered with `replace`; new objects are registered
+    with `add`. Only those objects (and the page tree nodes leading to the pages)
+    are parsed and written, so the cost of an update doesn't depend on the size of
+    the document, apart from copying its bytes. Use `open_update` to create one.
+    """
+
+    def __init__(self, pdf: buffers.PdfData, reader: PdfReader):
+        self.pdf = pdf
+        self.reader = reader
+        self._size = int(reader.trailer["/Size"])
+        # Object number -> (generation, object)
+        self._objects: Dict[int, Tuple[int, PdfObject]] = {}
+        self._pages: Dict[int, PageObject] = {}
+
+    @property
+    def page_count(self) -> int:
+        return int(self.reader.root_object["/Pages"]["/Count"])
+
+    def page(self, index: int) -> PageObject:
+        """
+        A page to modify in place, written with the update.
+
+        Unlike `PdfReader.pages`, which parses every page when the first one is
+        accessed, only the page tree nodes leading to the page are read. The
+        attributes the page inherits from them are copied into it, as
+        `PdfReader.pages` does.
+        """
+        if index in self._pages:
+            return self._pages[index]
+        if not 0 <= index < self.page_count:
+            raise IndexError(f"Page index {index} out of range")
+
+        reference = self.reader.root_object.raw_get("/Pages")
+        remaining = index
+        inherited = {}
+        while "/Kids" in (node := reference.get_object()):
+            inherited.update(
+                (key, node.raw_get(key)) for key in _INHERITABLE if key in node
+            )
+            kids = node["/Kids"]
+            if node.get("/Count") == len(kids):
+                # Each kid holds one page, so the page is found without reading them
+                reference, remaining = kids[remaining], 0
+                continue
+            for kid in kids:
+                kid_node = kid.get_object()
+                count = int(kid_node.get("/Count", 1)) if "/Kids" in kid_node else 1
+                if remaining < count:
+                    reference = kid
+                    break
+                remaining -= count
+            else:
+                raise IndexError(f"Page index {index} out of range")
+
+        page = PageObject(self.reader, reference)
+        page.update(node)
+        for key, value in inherited.items():
+            page.setdefault(NameObject(key), value)
+        self.replace(reference, page)
+        self._pages[index] = page
+        return page
+
+    def get_object(self, reference: IndirectObject) -> Optional[PdfObject]:
+        # Resolves references to added objects, see `add`
+        if reference.idnum in self._objects:
+            return self._objects[reference.idnum][1]
+        return self.reader.get_object(reference)
+
+    def replace(self, reference: IndirectObject, obj: PdfObject) -> None:
+        """Write `obj` in place of the object `reference` points at."""
+        self._objects[reference.idnum] = (reference.generation, obj)
+
+    def add(self, obj: PdfObject) -> IndirectObject:
+        """Add a new object to the document, returning a reference to it."""
+        idnum = max(self._size, max(self._objects, default=0) + 1)
+        self._objects[idnum] = (0, obj)
+        return IndirectObject(idnum, 0, self)
+
+    def edit(self, container: DictionaryObject, key: str) -> DictionaryObject:
+        """
+        The dictionary under `key` of `container`, to modify in place.
+
+        The dictionary is created if it's missing, and written with the update if
+        it's an indirect object. `container` itself must be part of the update.
+        """
+        value = container.raw_get(key) if key in container else None
+        if value is None:
+            value = container[NameObject(key)] = DictionaryObject()
+        if isinstance(value, IndirectObject):
+            self.replace(value, value.get_object())
+            return value.get_object()
+        return value
+
+    def copy(
+        self,
+        obj: PdfObject,
+        _copied: Optional[Dict[Tuple[int, int], IndirectObject]] = None,
+    ) -> PdfObject:
+        """Copy an object of another document, with the objects it references."""
+        copied = {} if _copied is None else _copied
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key not in copied:
+                # Registered before its content is copied, for cyclic references
+                copied[key] = self.add(NullObject())
+                self.replace(copied[key], self.copy(obj.get_object(), copied))
+            return copied[key]
+        if isinstance(obj, DictionaryObject):
+            result = copy.copy(obj)
+            for name, value in obj.items():
+                result[name] = self.copy(value, copied)
+            return result
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value, copied) for value in obj)
+        return obj
+
+    def write(self, stream: BinaryIO) -> None:
+        """Write the original document, followed by the update."""
+        stream.write(memoryview(self.pdf))
+        if bytes(self.pdf[-1:]) not in (b"\n", b"\r"):
+            stream.write(b"\n")
+        if not self._objects:
+            return
+
+        # Object number -> (offset, generation)
+        entries = {}
+        for idnum, (generation, obj) in sorted(self._objects.items()):
+            entries[idnum] = (stream.tell(), generation)
+            stream.write(f"{idnum} {generation} obj\n".encode())
+            obj.write_to_stream(stream)
+            stream.write(b"\nendobj\n")
+
+        trailer = DictionaryObject(
+            {
+                NameObject("/Size"): NumberObject(max(self._size, max(entries) + 1)),
+                NameObject("/Prev"): NumberObject(self.reader._startxref),
+            }
+        )
+        for key in ("/Root", "/Info", "/ID"):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+
+        # The update uses the same kind of cross-reference section as the document
+        start = self.reader._startxref
+        if bytes(self.pdf[start : start + 4]) == b"xref":
+            _write_xref_table(stream, entries, trailer)
+        else:
+            _write_xref_stream(stream, entries, trailer)
+
+    def to_bytes(self) -> bytes:
+        stream = BytesIO()
+        self.write(stream)
+        return stream.getvalue()
+
+
+class WriterUpdate:
+    """
+    The interface of `IncrementalUpdate` over a `PdfWriter`, so transforms written
+    for updates (e.g. `tasks.rotate_update`) can be one step of a whole rewrite.
+
+    The writer's objects are its own, so they're changed in place and `replace`
+    has nothing to do.
+    """
+
+    def __init__(self, writer: PdfWriter):
+        self.writer = writer
+
+    @property
+    def page_count(self) -> int:
+        return len(self.writer.pages)
+
+    def page(self, index: int) -> PageObject:
+        return self.writer.pages[index]
+
+    def get_object(self, reference: IndirectObject) -> Optional[PdfObject]:
+        return self.writer.get_object(reference)
+
+    def replace(self, reference: IndirectObject, obj: PdfObject) -> None:
+        pass
+
+    def add(self, obj: PdfObject) -> IndirectObject:
+        # pypdf has no public way to add an object, see `requirements.txt`
+        return self.writer._add_object(obj)
+
+    def edit(self, container: DictionaryObject, key: str) -> DictionaryObject:
+        value = container.get(key)
+        if value is None:
+            value = container[NameObject(key)] = DictionaryObject()
+        return value
+
+    def copy(self, obj: PdfObject) -> PdfObject:
+        return obj.clone(self.writer)
+
+
+Update = Union[IncrementalUpdate, WriterUpdate]
+
+
+def _sections(numbers: Iterable[int]) -> Iterator[List[int]]:
+    """Split object numbers into runs of consecutive numbers."""
+    section: List[int] = []
+    for number in sorted(numbers):
+        if section and number != section[-1] + 1:
+            yield section
+            section = []
+        section.append(number)
+    if section:
+        yield section
+
+
+def _write_xref_table(
+    stream: BinaryIO, entries: Dict[int, Tuple[int, int]], trailer: DictionaryObject
+) -> None:
+    start = stream.tell()
+    # Object 0, the head of the list of free objects, starts the first subsection
+    # (ISO 32000-1, 7.5.4); readers otherwise take the table for a broken one
+    stream.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+    for section in _sections(entries):
+        stream.write(f"{section[0]} {len(section)}\n".encode())
+        for idnum in section:
+            offset, generation = entries[idnum]
+            stream.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+    stream.write(b"trailer\n")
+    trailer.write_to_stream(stream)
+    stream.write(f"\nstartxref\n{start}\n%%EOF\n".encode())
+
+
+def _write_xref_stream(
+    stream: BinaryIO, entries: Dict[int, Tuple[int, int]], trailer: DictionaryObject
+) -> None:
+    # The cross-reference stream is a new object, listed in itself
+    idnum = int(trailer["/Size"])
+    start = stream.tell()
+    entries = {**entries, idnum: (start, 0)}
+
+    width = max(4, (start.bit_length() + 7) // 8)
+    xref = StreamObject()
+    xref.set_data(
+        b"".join(
+            b"\x01" + offset.to_bytes(width, "big") + struct.pack(">H", generation)
+            for offset, generation in (entries[number] for number in sorted(entries))
+        )
+    )
+    xref.update(trailer)
+    xref.update(
+        {
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/Size"): NumberObject(idnum + 1),
+            NameObject("/Index"): ArrayObject(
+                NumberObject(number)
+                for section in _sections(entries)
+                for number in (section[0], len(section))
+            ),
+            NameObject("/W"): ArrayObject(
+                [NumberObject(1), NumberObject(width), NumberObject(2)]
+            ),
+        }
+    )
+
+    stream.write(f"{idnum} 0 obj\n".encode())
+    xref.write_to_stream(stream)
+    stream.write(f"\nendobj\nstartxref\n{start}\n%%EOF\n".encode())
+
+
+def wrap_contents(
+    update: Update,
+    page: DictionaryObject,
+    before: IndirectObject,
+    after: IndirectObject,
+) -> None:
+    """
+    Draw the content streams `before` and `after` around a page's content.
+
+    The page's own content streams are referenced, not decoded or copied, so
+    streams shared by many pages (e.g. "q" and "Q") cost one object in total.
+    """
+    contents = page.raw_get("/Contents") if "/Contents" in page else ArrayObject()
+    if isinstance(contents, IndirectObject) and isinstance(
+        contents.get_object(), ArrayObject
+    ):
+        contents = contents.get_object()
+    elif isinstance(contents, StreamObject):
+        contents = ArrayObject([update.add(contents)])
+    elif not isinstance(contents, ArrayObject):
+        contents = ArrayObject([contents])
+    page[NameObject("/Contents")] = ArrayObject([before, *contents, after])
+
+
+def open_update(
+    pdf: buffers.PdfData, password: Optional[str] = None
+) -> IncrementalUpdate:
+    """
+    Open a PDF to change it with an incremental update.
+
+    Encrypted documents, and documents whose cross-reference table pypdf had to
+    reconstruct, are rewritten once, decrypted, so the update can be appended.
+    """
+    reader = parallel.open_reader(pdf, password)
+    start = reader._startxref
+    if reader.is_encrypted or not _XREF.match(bytes(pdf[start : start + 32])):
+        rewritten = BytesIO()
+        PdfWriter(clone_from=reader).write(rewritten)
+        pdf = rewritten.getvalue()
+        reader = parallel.open_reader(pdf, None)
+    return IncrementalUpdate(pdf, reader)
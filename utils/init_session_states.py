@@ -2,17 +2,16 @@ from streamlit import session_state
 
 
 def init():
-    session_state["decrypted_filename"] = (
-        None
-        if "decrypted_filename" not in session_state
-        else session_state["decrypted_filename"]
-    )
     session_state["password"] = (
         "" if "password" not in session_state else session_state["password"]
     )
     session_state["is_encrypted"] = (
         False if "is_encrypted" not in session_state else session_state["is_encrypted"]
     )
+    session_state["outputs"] = (
+        {} if "outputs" not in session_state else session_state["outputs"]
+    )
+    session_state["jobs"] = [] if "jobs" not in session_state else session_state["jobs"]
 
 
 if __name__ == "__main__":
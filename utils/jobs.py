@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Hashable, List, Literal, Optional
+
+import streamlit as st
+from streamlit import session_state
+from streamlit.logger import get_logger
+
+from utils import parallel
+
+logger = get_logger(__name__)
+
+JOB_WORKERS = int(os.getenv("PDF_WORKDESK_JOB_WORKERS", "2"))
+# Finished jobs keep their result, so only the most recent ones are kept
+MAX_FINISHED_JOBS = int(os.getenv("PDF_WORKDESK_MAX_FINISHED_JOBS", "16"))
+POLL_INTERVAL = 1.0
+
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+
+
+@dataclass
+class Job:
+    id: str
+    label: str
+    key: Optional[Hashable] = None
+    # The name to download the result under
+    file_name: Optional[str] = None
+    status: JobStatus = "queued"
+    done: int = 0
+    total: int = 0
+    result: Any = field(default=None, repr=False)
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.submitted
+
+
+class JobScheduler:
+    """
+    Runs long operations as jobs in a bounded pool of worker processes.
+
+    Jobs are identified by an ID, publish their progress through a dict shared with
+    the workers and keep their result until they are forgotten or evicted, so they
+    outlive the script run that submitted them. Jobs submitted with the same `key`
+    are only run once.
+
+    The scheduler doesn't depend on a running Streamlit app, e.g.:
+
+        with JobScheduler(max_workers=1) as scheduler:
+            job = scheduler.wait(scheduler.submit("Compress", tasks.reduce_size, pdf))
+
+    The app uses one scheduler shared by all sessions (see `scheduler`).
+    """
+
+    def __init__(
+        self, max_workers: int = JOB_WORKERS, max_finished: int = MAX_FINISHED_JOBS
+    ):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+        self._keys: Dict[Hashable, str] = {}
+        self._lock = threading.RLock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._shared = None
+
+    def __enter__(self) -> "JobScheduler":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+    def submit(
+        self,
+        label: str,
+        func: Callable[..., Any],
+        *args,
+        key: Optional[Hashable] = None,
+        file_name: Optional[str] = None,
+        **kwargs,
+    ) -> str:
+        """
+        Submit `func(*args, **kwargs, progress=...)` as a job.
+
+        Args:
+            label (str): The name of the job, e.g. the operation.
+            func (Callable[..., Any]): A picklable (module-level) function that
+                accepts a `progress(done, total)` callback, e.g. from `utils.tasks`.
+            key (Optional[Hashable]): Identifies the job's result, e.g. (document
+                digest, operation, parameters). If a job with the same key is queued,
+                running or done, its ID is returned instead of running `func` again.
+            file_name (Optional[str]): The name to download the result under.
+
+        Returns:
+            str: The job ID.
+        """
+        with self._lock:
+            if key is not None and key in self._keys:
+                job = self._jobs[self._keys[key]]
+                if job.status not in ("failed", "cancelled"):
+                    return job.id
+
+            job = Job(uuid.uuid4().hex, label, key=key, file_name=file_name)
+            run = partial(parallel.run_job, func, job.id)
+            try:
+                job.future = self._pool().submit(run, self._shared, args, kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. ran out of memory), so start a fresh pool
+                logger.warning("Job pool is broken, restarting it")
+                self._executor = None
+                job.future = self._pool().submit(run, self._shared, args, kwargs)
+
+            self._jobs[job.id] = job
+            if key is not None:
+                self._keys[key] = job.id
+
+        job.future.add_done_callback(partial(self._finish, job))
+        return job.id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get a job with its latest progress, or None if it was forgotten or evicted."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.active:
+                if (progress := self._shared.get(job_id)) is not None:
+                    job.status = "running"
+                    job.done, job.total = progress
+            return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Wait for a job to finish, or for `timeout` seconds, and return it."""
+        job = self.get(job_id)
+        if job is not None and (future := job.future) is not None:
+            if wait_futures([future], timeout).done:
+                # Done callbacks can run after waiters are woken up
+                self._finish(job, future)
+        return self.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job. Queued jobs never start; running jobs stop the next time they
+        report their progress.
+
+        Returns:
+            bool: Whether the job was still queued or running.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            if not job.future.cancel():
+                self._shared[("cancel", job_id)] = True
+            return True
+
+    def forget(self, job_id: str) -> None:
+        """Drop a finished job and its result, or cancel it if it hasn't finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job.active:
+                self.cancel(job_id)
+            else:
+                self._remove(job)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, manager = self._executor, self._manager
+            self._executor = self._manager = None
+
+        # Not under the lock, as the callbacks of the last jobs still need it
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+            self._shared = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = parallel.mp_context()
+            if self._manager is None:
+                self._manager = context.Manager()
+                self._shared = self._manager.dict()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context
+            )
+        return self._executor
+
+    def _finish(self, job: Job, future: Future) -> None:
+        with self._lock:
+            if job.finished is not None:
+                return
+
+            if future.cancelled():
+                job.status = "cancelled"
+            elif (error := future.exception()) is None:
+                job.status = "done"
+                job.result = future.result()
+            elif isinstance(error, parallel.JobCancelled):
+                job.status = "cancelled"
+            else:
+                logger.warning("Job %s failed: %r", job.label, error)
+                job.status = "failed"
+                job.error = str(error) or type(error).__name__
+
+            job.finished = time.monotonic()
+            job.future = None
+            if self._shared is not None:
+                self._shared.pop(job.id, None)
+                self._shared.pop(("cancel", job.id), None)
+            self._evict()
+
+    def _remove(self, job: Job) -> None:
+        del self._jobs[job.id]
+        if job.key is not None and self._keys.get(job.key) == job.id:
+            del self._keys[job.key]
+
+    def _evict(self) -> None:
+        finished = sorted(
+            (job for job in self._jobs.values() if not job.active),
+            key=lambda job: job.finished,
+        )
+        for job in finished[: max(0, len(finished) - self.max_finished)]:
+            self._remove(job)
+
+
+@st.cache_resource
+def scheduler() -> JobScheduler:
+    # One pool shared by all sessions of this server, so jobs survive reruns
+    return JobScheduler()
+
+
+def submit(label: str, func: Callable[..., Any], *args, **kwargs) -> str:
+    """Submit a job (see `JobScheduler.submit`) and list it in this session's jobs."""
+    job_id = scheduler().submit(label, func, *args, **kwargs)
+    if job_id not in session_state["jobs"]:
+        session_state["jobs"].append(job_id)
+    return job_id
+
+
+def session_jobs() -> List[Job]:
+    """This session's jobs, oldest first, leaving out the ones evicted since."""
+    jobs = [job for job_id in session_state["jobs"] if (job := scheduler().get(job_id))]
+    session_state["jobs"] = [job.id for job in jobs]
+    return jobs
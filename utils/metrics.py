@@ -0,0 +1,330 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from pypdf import PdfReader
+from streamlit.logger import get_logger
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.exceptions import ScriptControlException
+
+from utils import buffers
+
+logger = get_logger(__name__)
+
+# Shows the debug panel in the sidebar, and measures peak memory, which slows every
+# allocation down
+DEBUG = os.getenv("PDF_WORKDESK_DEBUG", "") not in ("", "0")
+# Serves the metrics on this port of localhost if set, see `serve`
+METRICS_PORT = int(os.getenv("PDF_WORKDESK_METRICS_PORT", "0"))
+# Measurements kept for the debug panel and the JSON lines export, of all sessions
+MAX_MEASUREMENTS = 1000
+
+
+@dataclass
+class Measurement:
+    """One run of a timed block, e.g. an operation's panel or a helper."""
+
+    label: str
+    # The Streamlit session that ran the block, if any
+    session: Optional[str]
+    # Unix time
+    started: float
+    wall_seconds: float = 0.0
+    # CPU time of the thread that ran the block; worker processes aren't included
+    cpu_seconds: float = 0.0
+    # How far memory allocated by Python rose above its level at the start of the
+    # block, in debug mode. `tracemalloc` has one peak for the whole process, so
+    # this is an upper bound: it includes what other threads (e.g. other sessions)
+    # allocated, and the peak since the earliest block still running started.
+    peak_bytes: Optional[int] = None
+    pages: Optional[int] = None
+    input_bytes: Optional[int] = None
+    output_bytes: Optional[int] = None
+    # Lookups in the result cache, see `cache.ResultCache`
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # The type of the exception the block raised, if any
+    error: Optional[str] = None
+
+
+@dataclass
+class _Frame:
+    measurement: Measurement
+    # Traced memory when the block started
+    base: int = 0
+
+
+class _Totals:
+    """Monotonic counters per label, for Prometheus."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.pages = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.peak_bytes = 0
+
+
+_local = threading.local()
+_lock = threading.Lock()
+_measurements: Deque[Measurement] = deque(maxlen=MAX_MEASUREMENTS)
+_totals: Dict[str, _Totals] = {}
+_server: Optional[ThreadingHTTPServer] = None
+# Blocks running in any thread. The traced peak is only reset when there are none,
+# so resetting it never hides a running block's peak.
+_running = 0
+
+
+def current_session() -> Optional[str]:
+    """The ID of the Streamlit session running in this thread, if any."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else None
+
+
+def _frames() -> List[_Frame]:
+    # The blocks open in this thread, outermost first
+    if not hasattr(_local, "frames"):
+        _local.frames = []
+    return _local.frames
+
+
+@contextmanager
+def timed(label: str) -> Iterator[Measurement]:
+    """
+    Measure a block of code, and log its wall time.
+
+    Can be used as a context manager or as a decorator. Every Streamlit rerun
+    (full or fragment-only) logs one line per timed block, so idle panels can
+    be checked for doing no work. The block can fill in the fields of the
+    measurement it's given that can't be measured, e.g. `pages`.
+
+    Blocks can be nested: the outer block's measurement includes the inner ones.
+
+    Args:
+        label (str): The name to log the timing under.
+    """
+    global _running
+    frame = _Frame(Measurement(label, current_session(), time.time()))
+    frames = _frames()
+    if DEBUG and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    with _lock:
+        if tracing := tracemalloc.is_tracing():
+            if not _running:
+                tracemalloc.reset_peak()
+            frame.base = tracemalloc.get_traced_memory()[0]
+        _running += 1
+    frames.append(frame)
+
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield frame.measurement
+    except ScriptControlException:
+        # Reruns and stops aren't errors
+        raise
+    except Exception as e:
+        frame.measurement.error = type(e).__name__
+        raise
+    finally:
+        measurement = frame.measurement
+        measurement.wall_seconds = time.perf_counter() - start
+        measurement.cpu_seconds = time.thread_time() - cpu_start
+        frames.pop()
+        with _lock:
+            _running -= 1
+            if tracing and tracemalloc.is_tracing():
+                measurement.peak_bytes = tracemalloc.get_traced_memory()[1] - frame.base
+        _record(measurement)
+        logger.info("%s took %.1f ms", label, measurement.wall_seconds * 1000)
+
+
+def _size(value: Any) -> Optional[int]:
+    if isinstance(value, (bytes, bytearray, memoryview, buffers.MappedPdf)):
+        return len(value)
+    return None
+
+
+def _describe(measurement: Measurement, arguments: List[Any]) -> None:
+    # The first documents among the arguments are taken as the input, e.g. a
+    # reader for the page count and the bytes it reads for the size
+    for value in arguments:
+        # `documents.DocumentHandle`, which can't be imported here
+        if isinstance(getattr(value, "page_count", None), int) and hasattr(
+            value, "digest"
+        ):
+            measurement.pages = measurement.pages or value.page_count
+            measurement.input_bytes = measurement.input_bytes or value.size
+        elif isinstance(value, PdfReader) and measurement.pages is None:
+            try:
+                measurement.pages = len(value.pages)
+            except Exception:
+                # e.g. encrypted and not decrypted yet
+                pass
+        elif measurement.input_bytes is None:
+            measurement.input_bytes = _size(value)
+
+
+def instrument(label: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    Measure every call of a function, see `timed`.
+
+    The page count and input size are taken from the first document passed to the
+    function (a `documents.DocumentHandle`, a `PdfReader` or PDF bytes), and the
+    output size from its result, if it's bytes.
+
+    Args:
+        label (Optional[str]): The name to record calls under. Defaults to the
+            function's name.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(label or func.__name__) as measurement:
+                _describe(measurement, [*args, *kwargs.values()])
+                result = func(*args, **kwargs)
+                measurement.output_bytes = _size(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def count_cache_lookup(hit: bool) -> None:
+    """Count a result cache lookup in the blocks open in this thread."""
+    for frame in _frames():
+        if hit:
+            frame.measurement.cache_hits += 1
+        else:
+            frame.measurement.cache_misses += 1
+
+
+def _record(measurement: Measurement) -> None:
+    with _lock:
+        _measurements.append(measurement)
+        totals = _totals.setdefault(measurement.label, _Totals())
+        totals.calls += 1
+        totals.errors += measurement.error is not None
+        totals.wall_seconds += measurement.wall_seconds
+        totals.cpu_seconds += measurement.cpu_seconds
+        totals.pages += measurement.pages or 0
+        totals.input_bytes += measurement.input_bytes or 0
+        totals.output_bytes += measurement.output_bytes or 0
+        totals.cache_hits += measurement.cache_hits
+        totals.cache_misses += measurement.cache_misses
+        totals.peak_bytes = max(totals.peak_bytes, measurement.peak_bytes or 0)
+
+
+def measurements(session: Optional[str] = None) -> List[Measurement]:
+    """The most recent measurements, oldest first, optionally of one session."""
+    with _lock:
+        return [
+            measurement
+            for measurement in _measurements
+            if session is None or measurement.session == session
+        ]
+
+
+def to_json_lines(measurements: List[Measurement]) -> str:
+    return "".join(
+        json.dumps(asdict(measurement)) + "\n" for measurement in measurements
+    )
+
+
+# Prometheus metric name, type and help, per field of `_Totals`
+_PROMETHEUS = {
+    "calls": ("calls_total", "counter", "Runs of the block"),
+    "errors": ("errors_total", "counter", "Runs that raised an exception"),
+    "wall_seconds": ("wall_seconds_total", "counter", "Wall time"),
+    "cpu_seconds": ("cpu_seconds_total", "counter", "CPU time of the running thread"),
+    "pages": ("pages_total", "counter", "Pages of the input documents"),
+    "input_bytes": ("input_bytes_total", "counter", "Size of the input documents"),
+    "output_bytes": ("output_bytes_total", "counter", "Size of the outputs"),
+    "cache_hits": ("cache_hits_total", "counter", "Result cache hits"),
+    "cache_misses": ("cache_misses_total", "counter", "Result cache misses"),
+    "peak_bytes": (
+        "peak_memory_bytes",
+        "gauge",
+        "Highest peak memory allocated by Python during a run, in debug mode",
+    ),
+}
+
+
+def to_prometheus() -> str:
+    """The totals per label, in the Prometheus text exposition format."""
+    with _lock:
+        totals = {label: vars(values).copy() for label, values in _totals.items()}
+
+    lines = []
+    for field, (name, kind, description) in _PROMETHEUS.items():
+        name = f"pdf_workdesk_operation_{name}"
+        lines.append(f"# HELP {name} {description}.")
+        lines.append(f"# TYPE {name} {kind}")
+        for label, values in sorted(totals.items()):
+            escaped = label.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{name}{{operation="{escaped}"}} {values[field]}')
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            body = to_prometheus()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/measurements.jsonl":
+            body = to_json_lines(measurements())
+            content_type = "application/x-ndjson"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        # Scrapes would flood the app's log
+        pass
+
+
+def serve(port: int = METRICS_PORT) -> Optional[int]:
+    """
+    Serve the metrics from a background thread, once per process.
+
+    `/metrics` returns the totals per label in the Prometheus text format, and
+    `/measurements.jsonl` the most recent measurements as JSON lines. Only
+    connections from this machine are accepted.
+
+    Args:
+        port (int): The port to listen on, or 0 not to serve.
+
+    Returns:
+        Optional[int]: The port the metrics are served on, if they are.
+    """
+    global _server
+    with _lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+            _server.daemon_threads = True
+            threading.Thread(
+                target=_server.serve_forever, name="metrics", daemon=True
+            ).start()
+            logger.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+        return _server.server_address[1] if _server is not None else None
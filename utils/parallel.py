@@ -0,0 +1,466 @@
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import types
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice, repeat
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
+
+import pdfplumber
+from PIL import Image
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    ContentStream,
+    DictionaryObject,
+    IndirectObject,
+    StreamObject,
+)
+
+from utils import buffers
+
+if TYPE_CHECKING:
+    from pdf2docx import Converter
+
+# Below this many pages, spinning up worker processes costs more than it saves
+MIN_PARALLEL_PAGES = 32
+CHUNK_SIZE = 8
+
+# Set in each worker process by `_init_worker`
+_opened: Any = None
+
+
+# Modules the forkserver imports once, so workers forked from it start with them
+WORKER_PRELOAD = ["utils.parallel", "utils.tasks", "utils.pipeline"]
+
+# Streamlit runs the app script as `__main__`, and multiprocessing runs `__main__`
+# again in every new process, so processes are started with this empty module as
+# `__main__` instead (see `_worker_main`)
+_WORKER_MAIN = types.ModuleType("__main__")
+_main_lock = threading.Lock()
+
+
+@contextmanager
+def _worker_main() -> Iterator[None]:
+    with _main_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = _WORKER_MAIN
+        try:
+            yield
+        finally:
+            # Unless a script run installed its own in the meantime
+            if sys.modules["__main__"] is _WORKER_MAIN:
+                sys.modules["__main__"] = main
+
+
+if sys.platform != "win32":
+    # Forkservers aren't available on Windows
+    class _ForkServerProcess(multiprocessing.context.ForkServerProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            with _worker_main():
+                return multiprocessing.context.ForkServerProcess._Popen(process_obj)
+
+    class _ForkServerContext(multiprocessing.context.ForkServerContext):
+        Process = _ForkServerProcess
+
+
+class _SpawnProcess(multiprocessing.context.SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        with _worker_main():
+            return multiprocessing.context.SpawnProcess._Popen(process_obj)
+
+
+class _SpawnContext(multiprocessing.context.SpawnContext):
+    Process = _SpawnProcess
+
+
+@lru_cache(maxsize=None)
+def mp_context() -> multiprocessing.context.BaseContext:
+    """
+    The context of every process pool, which doesn't run the app script in workers.
+
+    Forking the multi-threaded Streamlit server is unsafe, so a clean forkserver is
+    preferred, with spawn as the fallback.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = _ForkServerContext()
+        context.set_forkserver_preload(WORKER_PRELOAD)
+        return context
+    return _SpawnContext()
+
+
+def max_workers() -> int:
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def open_reader(pdf: buffers.PdfData, password: Optional[str]) -> PdfReader:
+    reader = PdfReader(buffers.open_stream(pdf))
+    if reader.is_encrypted:
+        reader.decrypt(password)
+    return reader
+
+
+def open_plumber(pdf: buffers.PdfData, password: Optional[str]) -> pdfplumber.PDF:
+    return pdfplumber.open(buffers.open_stream(pdf), password=password or "")
+
+
+def open_converter(pdf: buffers.PdfData, password: Optional[str]) -> "Converter":
+    # pdf2docx is slow to import, so only workers converting to Word import it
+    from pdf2docx import Converter
+
+    if isinstance(pdf, buffers.MappedPdf):
+        # Lets MuPDF read the file itself
+        converter = Converter(str(pdf.path), password=password)
+    else:
+        converter = Converter(stream=pdf, password=password)
+    # Opens (and decrypts) the document and sets up its pages
+    converter.load_pages()
+    return converter
+
+
+class JobCancelled(Exception):
+    """Raised in a job's worker process when the job is cancelled."""
+
+
+def run_job(
+    func: Callable[..., Any],
+    job_id: str,
+    shared: MutableMapping,
+    args: Tuple,
+    kwargs: Dict[str, Any],
+) -> Any:
+    """
+    Run a job's function in a worker process, see `utils.jobs.JobScheduler`.
+
+    `func` is called with a `progress(done, total)` callback, which publishes its
+    progress in `shared` and raises `JobCancelled` once the job is cancelled.
+    """
+
+    def progress(done: int, total: int) -> None:
+        if shared.get(("cancel", job_id)):
+            raise JobCancelled(job_id)
+        shared[job_id] = (done, total)
+
+    # Tells the scheduler the job is running
+    shared[job_id] = (0, 0)
+    return func(*args, progress=progress, **kwargs)
+
+
+def _init_worker(
+    opener: Callable[[buffers.PdfData, Optional[str]], Any],
+    pdf: buffers.PdfData,
+    password: Optional[str],
+) -> None:
+    global _opened
+    _opened = opener(pdf, password)
+
+
+# Page tasks live here rather than in `helpers` so workers don't import Streamlit
+
+
+def page_text(reader: PdfReader, page: int, mode: str) -> str:
+    return reader.pages[page].extract_text(extraction_mode=mode)
+
+
+def page_tables(
+    plumber: pdfplumber.PDF,
+    page: int,
+    vertical_strategy: str,
+    horizontal_strategy: str,
+) -> List[List[List[Optional[str]]]]:
+    plumber_page = plumber.pages[page]
+    tables = plumber_page.extract_tables(
+        {
+            "vertical_strategy": vertical_strategy,
+            "horizontal_strategy": horizontal_strategy,
+        }
+    )
+    # Handles can be long-lived and shared, so don't keep every page's parsed objects
+    plumber_page.close()
+    return tables
+
+
+def page_contents_flate(reader: PdfReader, page: int, level: int) -> Optional[bytes]:
+    """Flate-compress a page's content, or None if it's already Flate-compressed."""
+    contents = reader.pages[page].get("/Contents")
+    if contents is None:
+        return None
+
+    contents = contents.get_object()
+    streams = [
+        stream.get_object()
+        for stream in (contents if isinstance(contents, ArrayObject) else [contents])
+    ]
+    if all(
+        stream.get("/Filter") in ("/FlateDecode", ["/FlateDecode"])
+        for stream in streams
+    ):
+        return None
+
+    # Content streams of a page are concatenated, separated by whitespace
+    return zlib.compress(b"\n".join(stream.get_data() for stream in streams), level)
+
+
+Matrix = Tuple[float, float, float, float, float, float]
+IDENTITY: Matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+ImagePath = Tuple[str, ...]
+
+
+def _multiply(m: Matrix, n: Matrix) -> Matrix:
+    a, b, c, d, e, f = m
+    return (
+        a * n[0] + b * n[2],
+        a * n[1] + b * n[3],
+        c * n[0] + d * n[2],
+        c * n[1] + d * n[3],
+        e * n[0] + f * n[2] + n[4],
+        e * n[1] + f * n[3] + n[5],
+    )
+
+
+def page_image_placements(
+    reader: PdfReader, page: int
+) -> List[Tuple[ImagePath, Tuple[int, int], Tuple[int, int], float, float]]:
+    """
+    List the images drawn on a page, including inside forms, with the size they're
+    drawn at.
+
+    Returns:
+        List[Tuple[ImagePath, Tuple[int, int], Tuple[int, int], float, float]]: The
+            resource names from the page down to the image, its object reference,
+            its size in pixels and its width and height on the page in points, for
+            every time it's drawn.
+    """
+    placements = []
+
+    def walk(obj, contents, ancestors: ImagePath, ctm: Matrix, visited: set) -> None:
+        xobjects = obj["/Resources"].get("/XObject") if "/Resources" in obj else None
+        xobjects = xobjects.get_object() if xobjects is not None else None
+        if contents is None or not isinstance(xobjects, DictionaryObject):
+            return
+
+        stack = []
+        for operands, operator in ContentStream(contents, reader).operations:
+            if operator == b"q":
+                stack.append(ctm)
+            elif operator == b"Q" and stack:
+                ctm = stack.pop()
+            elif operator == b"cm":
+                ctm = _multiply(tuple(map(float, operands)), ctm)
+            elif operator == b"Do" and operands[0] in xobjects:
+                name = operands[0]
+                reference = xobjects.raw_get(name)
+                xobject = reference.get_object()
+                if not isinstance(reference, IndirectObject) or not isinstance(
+                    xobject, StreamObject
+                ):
+                    continue
+                key = (reference.idnum, reference.generation)
+
+                if xobject.get("/Subtype") == "/Image":
+                    # Images fill the unit square, scaled by the current matrix
+                    placements.append(
+                        (
+                            (*ancestors, name),
+                            key,
+                            (
+                                int(xobject.get("/Width", 0)),
+                                int(xobject.get("/Height", 0)),
+                            ),
+                            math.hypot(ctm[0], ctm[1]),
+                            math.hypot(ctm[2], ctm[3]),
+                        )
+                    )
+                elif xobject.get("/Subtype") == "/Form" and key not in visited:
+                    matrix = tuple(map(float, xobject.get("/Matrix", IDENTITY)))
+                    walk(
+                        xobject,
+                        xobject,
+                        (*ancestors, name),
+                        _multiply(matrix, ctm),
+                        visited | {key},
+                    )
+
+    page_object = reader.pages[page]
+    walk(page_object, page_object.get_contents(), (), IDENTITY, set())
+    return placements
+
+
+def page_images_jpeg(
+    reader: PdfReader,
+    page: int,
+    images: Dict[int, List[Tuple[ImagePath, Optional[Tuple[int, int]]]]],
+    quality: int,
+    grayscale: bool,
+) -> List[Optional[Tuple[bytes, int, int, str]]]:
+    """
+    Re-encode images of a page as JPEG.
+
+    Args:
+        reader (PdfReader): The PDF document.
+        page (int): The page index.
+        images (Dict[int, List[Tuple[ImagePath, Optional[Tuple[int, int]]]]]): The
+            path of each image to re-encode per page, and the size in pixels to
+            downsample it to, if any.
+        quality (int): The JPEG quality.
+        grayscale (bool): Whether to convert images to grayscale.
+
+    Returns:
+        List[Optional[Tuple[bytes, int, int, str]]]: The JPEG, its width, height and
+            color space for each image, or None to keep the original, e.g. because
+            the JPEG isn't smaller.
+    """
+    results = []
+    for path, size in images[page]:
+        xobject = reader.pages[page]
+        for name in path:
+            xobject = xobject["/Resources"]["/XObject"][name]
+
+        # Masks and bilevel images don't survive lossy re-encoding
+        if (
+            xobject.get("/ImageMask")
+            or "/Mask" in xobject
+            or "/Decode" in xobject
+            or xobject.get("/BitsPerComponent", 8) < 8
+        ):
+            results.append(None)
+            continue
+
+        image = reader.pages[page].images[path].image
+        # Transparency is kept in the image's soft mask
+        image = image.convert("L" if grayscale or image.mode in ("L", "LA") else "RGB")
+        if size is not None:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() >= len(xobject._data):
+            results.append(None)
+        else:
+            results.append(
+                (
+                    buffer.getvalue(),
+                    image.width,
+                    image.height,
+                    "/DeviceGray" if image.mode == "L" else "/DeviceRGB",
+                )
+            )
+    return results
+
+
+def docx_pages(converter: "Converter", pages: List[int]) -> List[Optional[Dict]]:
+    # pdf2docx analyses every font in the document whenever it parses pages, so
+    # pages are parsed a chunk at a time
+    pages_set = set(pages)
+    for page in converter.pages:
+        page.skip_parsing = page.id not in pages_set
+
+    settings = converter.default_settings
+    converter.parse_document(**settings).parse_pages(**settings)
+
+    # Pages that failed to parse are left out, as pdf2docx does
+    return [
+        converter.pages[page].store() if converter.pages[page].finalized else None
+        for page in pages
+    ]
+
+
+def _run_chunk(
+    func: Callable[[Any, Any], Any], batch: bool, pages: List[int]
+) -> List[Any]:
+    if batch:
+        return func(_opened, pages)
+    return [func(_opened, page) for page in pages]
+
+
+def _chunks(pages: Iterable[int], size: int) -> Iterator[List[int]]:
+    pages = iter(pages)
+    while chunk := list(islice(pages, size)):
+        yield chunk
+
+
+def uses_workers(pages: int, workers: Optional[int] = None) -> bool:
+    """Whether `map_pages` processes this many pages in worker processes."""
+    return (workers or max_workers()) > 1 and pages >= MIN_PARALLEL_PAGES
+
+
+def map_pages(
+    func: Callable[[Any, int], Any],
+    pdf: buffers.PdfData,
+    pages: List[int],
+    password: Optional[str] = None,
+    opened: Any = None,
+    opener: Callable[[buffers.PdfData, Optional[str]], Any] = open_reader,
+    workers: Optional[int] = None,
+    batch: bool = False,
+) -> Iterator[Any]:
+    """
+    Yield `func(opened, page)` for every page, in order, as results become available.
+
+    Pages are processed in chunks by a pool of worker processes, each of which opens
+    the document with `opener` once. Small documents, or `workers=1`, are processed
+    serially in this process, reusing `opened` if given.
+
+    Args:
+        func (Callable[[Any, int], Any]): A picklable (module-level) function.
+        pdf (buffers.PdfData): The PDF document.
+        pages (List[int]): Zero-based page indices to process.
+        password (Optional[str]): The password to decrypt the document with.
+        opened (Any): The document already opened by `opener`, for the serial path.
+        opener (Callable[[buffers.PdfData, Optional[str]], Any]): Opens the document, e.g.
+            `open_reader` (pypdf) or `open_plumber` (pdfplumber).
+        workers (Optional[int]): Number of worker processes. Defaults to the CPU count.
+        batch (bool): Call `func(opened, pages)` once per chunk of pages instead,
+            for work with a high fixed cost per call. It must return one result
+            per page.
+
+    Yields:
+        Any: The result of `func` for each page, in the order of `pages`.
+    """
+    workers = workers or max_workers()
+
+    if not uses_workers(len(pages), workers):
+        if opened is None:
+            opened = opener(pdf, password)
+        if batch:
+            for chunk in _chunks(pages, CHUNK_SIZE):
+                yield from func(opened, chunk)
+        else:
+            for page in pages:
+                yield func(opened, page)
+        return
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context(),
+        initializer=_init_worker,
+        initargs=(opener, pdf, password),
+    )
+    try:
+        for results in executor.map(
+            _run_chunk, repeat(func), repeat(batch), _chunks(pages, CHUNK_SIZE)
+        ):
+            yield from results
+    finally:
+        # Stop promptly if the consumer stops iterating early
+        executor.shutdown(wait=False, cancel_futures=True)
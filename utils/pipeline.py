@@ -0,0 +1,336 @@
+"""
+Apply several operations to a PDF in one pass, with one final write.
+
+Run from the repository root with
+`python -m utils.pipeline definition.json output_dir input.pdf [input.pdf ...]`,
+where the definition is a JSON list of stages, e.g.
+`[{"stage": "rotate", "angle": 90, "pages": "1-3"}, {"stage": "compress", "lossless": true}]`.
+"""
+
+import json
+import sys
+import time
+from dataclasses import dataclass
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union
+
+from pypdf import PdfReader, PdfWriter
+
+from utils import buffers, incremental, parallel, selection, tasks
+
+# Like `parallel`, this module must not import Streamlit, so pipelines can run as
+# jobs and from scripts.
+
+
+def _no_progress(done: int, total: int) -> None:
+    pass
+
+
+def _pages(text: str, page_count: int) -> Optional[selection.PageSelection]:
+    # None selects every page, which lets operations take their faster paths
+    pages = selection.PageSelection.parse(text, page_count)
+    return None if pages.is_everything else pages
+
+
+@dataclass(frozen=True)
+class Rotate:
+    name: ClassVar[str] = "rotate"
+
+    # Clockwise, in degrees
+    angle: int
+    pages: str = "all"
+
+    def apply(self, update: incremental.Update) -> None:
+        tasks.rotate_update(update, self.angle, _pages(self.pages, update.page_count))
+
+
+@dataclass(frozen=True)
+class Scale:
+    name: ClassVar[str] = "scale"
+
+    # The paper size, in points, e.g. `PaperSize.A4`
+    width: float
+    height: float
+    scale_content: float = 1.0
+    pages: str = "all"
+
+    def apply(self, update: incremental.Update) -> None:
+        tasks.scale_update(
+            update,
+            self.width,
+            self.height,
+            self.scale_content,
+            _pages(self.pages, update.page_count),
+        )
+
+
+@dataclass(frozen=True)
+class Watermark:
+    name: ClassVar[str] = "watermark"
+
+    label: str
+    size: int = 12
+    color: str = "#F90004"
+    opacity: float = 0.8
+    pages: str = "all"
+
+    def apply(self, update: incremental.Update) -> None:
+        tasks.watermark_update(
+            update,
+            partial(
+                tasks.create_watermark_canvas,
+                self.label,
+                self.size,
+                self.color,
+                self.opacity,
+            ),
+            _pages(self.pages, update.page_count),
+        )
+
+
+@dataclass(frozen=True)
+class Compress:
+    """The options of `tasks.reduce_size`."""
+
+    name: ClassVar[str] = "compress"
+
+    remove_duplication: bool = False
+    remove_images: bool = False
+    quality: Optional[int] = None
+    dpi: Optional[int] = None
+    grayscale: bool = False
+    lossless: bool = False
+    pages: str = "all"
+
+
+@dataclass(frozen=True)
+class Encrypt(tasks.Protection):
+    """Encrypt the output, as the last stage."""
+
+    name: ClassVar[str] = "encrypt"
+
+
+Stage = Union[Rotate, Scale, Watermark, Compress, Encrypt]
+STAGES = {stage.name: stage for stage in (Rotate, Scale, Watermark, Compress, Encrypt)}
+
+
+@dataclass(frozen=True)
+class PipelineResult:
+    pdf: bytes
+    # Wall time in seconds of each stage, in the order they were defined, after
+    # "parse" and before "write"
+    timings: Tuple[Tuple[str, float], ...]
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    """
+    Operations to apply to a PDF, in order: any number of page stages (`Rotate`,
+    `Scale` and `Watermark`), then optionally `Compress`, then optionally `Encrypt`.
+
+    The document is parsed once, and written once after the last stage. Without
+    `Compress` or `Encrypt`, only the changed pages are written, in an incremental
+    update (see `incremental`); otherwise the document is rewritten.
+
+    `Compress` re-encodes and compresses the pages' own content and images before
+    the page stages run, as its workers read them from the input document, which
+    gives the same document as running it after them. Images are downsampled for
+    the size they're drawn at before scaling.
+    """
+
+    stages: Tuple[Stage, ...]
+
+    def __post_init__(self):
+        order = [{Compress: 1, Encrypt: 2}.get(type(stage), 0) for stage in self.stages]
+        if order != sorted(order) or order.count(1) > 1 or order.count(2) > 1:
+            raise ValueError(
+                "Page stages must come first, followed by at most one compress "
+                "stage and at most one encrypt stage"
+            )
+
+    @classmethod
+    def from_config(cls, config: List[Dict[str, Any]]) -> "Pipeline":
+        """
+        Create a pipeline from a list of stages, e.g. loaded from JSON.
+
+        Each stage is a dictionary with the stage's name under "stage", e.g.
+        "rotate", and its fields, e.g. `{"stage": "rotate", "angle": 90}`.
+        """
+        stages = []
+        for stage in config:
+            options = dict(stage)
+            name = options.pop("stage")
+            if name not in STAGES:
+                raise ValueError(
+                    f"Unknown stage {name!r}, expected one of {list(STAGES)}"
+                )
+            stages.append(STAGES[name](**options))
+        return cls(tuple(stages))
+
+    def run(
+        self,
+        pdf: buffers.PdfData,
+        password: Optional[str] = None,
+        progress: tasks.Progress = _no_progress,
+    ) -> PipelineResult:
+        """
+        Apply the stages to a PDF.
+
+        Args:
+            pdf (buffers.PdfData): The PDF document.
+            password (Optional[str]): The password of the document. The output
+                isn't encrypted, unless the pipeline has an `Encrypt` stage.
+            progress (tasks.Progress): Called with the number of stages done so
+                far, scaled by the progress of the compress stage, and the total.
+
+        Returns:
+            PipelineResult: The PDF and the time spent in each stage.
+        """
+        # Stages are validated to be in order: pages, then compress, then encrypt
+        page_stages = [
+            stage for stage in self.stages if not isinstance(stage, (Compress, Encrypt))
+        ]
+        compress, encrypt = (
+            next((stage for stage in self.stages if isinstance(stage, kind)), None)
+            for kind in (Compress, Encrypt)
+        )
+        timings = [0.0] * len(self.stages)
+        done = 0
+
+        start = time.perf_counter()
+        if compress is None and encrypt is None:
+            writer = None
+            update = incremental.open_update(pdf, password)
+        else:
+            reader = parallel.open_reader(pdf, password)
+            writer = PdfWriter(clone_from=reader)
+            update = incremental.WriterUpdate(writer)
+        parsed = time.perf_counter() - start
+
+        if compress is not None:
+            # Runs first, see above
+            start = time.perf_counter()
+            _compress(
+                compress,
+                writer,
+                pdf,
+                password,
+                reader,
+                partial(_stage_progress, progress, done, len(self.stages)),
+            )
+            timings[len(page_stages)] += time.perf_counter() - start
+            done += 1
+            progress(done, len(self.stages))
+
+        for index, stage in enumerate(page_stages):
+            start = time.perf_counter()
+            stage.apply(update)
+            timings[index] += time.perf_counter() - start
+            done += 1
+            progress(done, len(self.stages))
+
+        if compress is not None and (compress.remove_duplication or compress.lossless):
+            # Also merges the objects the page stages added, e.g. watermarks
+            start = time.perf_counter()
+            writer.compress_identical_objects()
+            timings[len(page_stages)] += time.perf_counter() - start
+
+        if encrypt is not None:
+            start = time.perf_counter()
+            tasks.encrypt(writer, encrypt)
+            timings[-1] += time.perf_counter() - start
+            progress(len(self.stages), len(self.stages))
+
+        start = time.perf_counter()
+        if writer is None:
+            output = update.to_bytes()
+        else:
+            stream = BytesIO()
+            writer.write(stream)
+            output = stream.getvalue()
+        written = time.perf_counter() - start
+
+        return PipelineResult(
+            output,
+            (
+                ("parse", parsed),
+                *(
+                    (stage.name, seconds)
+                    for stage, seconds in zip(self.stages, timings)
+                ),
+                ("write", written),
+            ),
+        )
+
+
+def _stage_progress(
+    progress: tasks.Progress, stage: int, stages: int, done: int, total: int
+) -> None:
+    # Reports the progress of one of several stages as a share of all of them
+    progress(stage * total + done, stages * total)
+
+
+def _compress(
+    compress: Compress,
+    writer: PdfWriter,
+    pdf: buffers.PdfData,
+    password: Optional[str],
+    reader: PdfReader,
+    progress: tasks.Progress,
+) -> None:
+    # Runs before the page stages change the pages' content, see `Pipeline`
+    pages = _pages(compress.pages, len(writer.pages))
+    reduce_quality = compress.quality is not None and not compress.remove_images
+    steps = reduce_quality + compress.lossless
+    if compress.remove_images:
+        tasks.remove_page_images(writer, pages)
+    if reduce_quality:
+        tasks.recompress_images(
+            writer,
+            pdf,
+            password,
+            quality=compress.quality,
+            dpi=compress.dpi,
+            grayscale=compress.grayscale,
+            progress=partial(_stage_progress, progress, 0, steps),
+            pages=pages,
+        )
+    if compress.lossless:
+        tasks.compress_contents(
+            writer,
+            pdf,
+            password,
+            progress=partial(_stage_progress, progress, steps - 1, steps),
+            pages=pages,
+            reader=reader,
+        )
+
+
+def run_pipeline(
+    pdf: buffers.PdfData,
+    password: Optional[str],
+    pipeline: Pipeline,
+    progress: tasks.Progress = _no_progress,
+) -> PipelineResult:
+    """`Pipeline.run`, as a job (see `utils.jobs`)."""
+    return pipeline.run(pdf, password, progress)
+
+
+def main(definition: str, output_dir: str, *inputs: str) -> None:
+    pipeline = Pipeline.from_config(json.loads(Path(definition).read_text()))
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    for path in map(Path, inputs):
+        result = pipeline.run(path.read_bytes())
+        (output_dir / path.name).write_bytes(result.pdf)
+        print(
+            f"{path.name}: {len(result.pdf) / 1024:.0f} KB, "
+            + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in result.timings)
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -1,6 +1,7 @@
 import streamlit as st
 from st_social_media_links import SocialMediaIcons
 
+from utils import cache, metrics
 from utils.version import __version__
 
 
@@ -61,5 +62,64 @@ def render():
         )
 
 
+def render_debug():
+    # This session's measurements, see `metrics.DEBUG`
+    with st.sidebar:
+        with st.expander("🐞 Debug"):
+            measurements = metrics.measurements(metrics.current_session())
+            if measurements:
+                st.dataframe(
+                    [
+                        {
+                            "Operation": measurement.label,
+                            "Wall (ms)": round(measurement.wall_seconds * 1000, 1),
+                            "CPU (ms)": round(measurement.cpu_seconds * 1000, 1),
+                            "Peak (MB)": (
+                                None
+                                if measurement.peak_bytes is None
+                                else round(measurement.peak_bytes / 1024 / 1024, 1)
+                            ),
+                            "Pages": measurement.pages,
+                            "In (KB)": (
+                                None
+                                if measurement.input_bytes is None
+                                else round(measurement.input_bytes / 1024)
+                            ),
+                            "Out (KB)": (
+                                None
+                                if measurement.output_bytes is None
+                                else round(measurement.output_bytes / 1024)
+                            ),
+                            "Cache hits": measurement.cache_hits,
+                            "Cache misses": measurement.cache_misses,
+                            "Error": measurement.error,
+                        }
+                        # Most recent first
+                        for measurement in reversed(measurements)
+                    ],
+                    hide_index=True,
+                )
+            else:
+                st.caption("Nothing measured yet")
+
+            stats = cache.result_cache().stats()
+            st.caption(
+                f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['entries']} entries, {stats['size_bytes'] / 1024 / 1024:.1f} "
+                f"of {stats['max_bytes'] / 1024 / 1024:.0f} MB"
+            )
+            if (port := metrics.serve()) is not None:
+                st.caption(f"Prometheus metrics: http://127.0.0.1:{port}/metrics")
+
+            st.download_button(
+                "📥 Download measurements (JSON lines)",
+                data=metrics.to_json_lines(measurements),
+                file_name="measurements.jsonl",
+                mime="application/x-ndjson",
+                on_click="ignore",
+                use_container_width=True,
+            )
+
+
 if __name__ == "__main__":
     render()
@@ -0,0 +1,123 @@
+import heapq
+import re
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+# Page selections, shared by every operation. Like `parallel`, this module must not
+# import Streamlit, as workers use it.
+
+# e.g. "3", "-1" (the last page), "2-5", "5-" (page 5 to the end), "1-:2" (odd pages)
+_PART = re.compile(
+    r"^(?P<start>-?\d+)(?:\s*(?P<dash>-)\s*(?P<stop>-?\d+)?)?(?:\s*:\s*(?P<step>\d+))?$"
+)
+
+
+@dataclass(frozen=True)
+class PageSelection:
+    """
+    A set of pages of a document, stored as ranges of zero-based page indices.
+
+    Selections never list their pages: they're iterated lazily, in ascending order
+    and without duplicates, and membership is checked against the ranges. Use
+    `parse` to read one from user input, and `everything` to select all pages.
+    """
+
+    ranges: Tuple[range, ...]
+    page_count: int
+
+    @classmethod
+    def everything(cls, page_count: int) -> "PageSelection":
+        return cls((range(page_count),) if page_count else (), page_count)
+
+    @classmethod
+    def parse(cls, text: str, page_count: int) -> "PageSelection":
+        """
+        Parse a comma-separated list of pages and ranges of page numbers.
+
+        Page numbers start from 1; negative numbers count from the end, so -1 is the
+        last page. Ranges include both ends, may be left open (`5-`) and may take a
+        step (`1-10:2`). "all", or nothing, selects every page.
+
+        Raises:
+            ValueError: If a part can't be parsed, or a range is empty.
+            IndexError: If a page doesn't exist in a document of `page_count` pages.
+        """
+        text = text.strip().lower()
+        if text in ("", "all"):
+            return cls.everything(page_count)
+
+        ranges = []
+        for part in text.split(","):
+            match = _PART.match(part.strip())
+            if match is None:
+                raise ValueError(f"Invalid page selection: {part.strip()!r}")
+
+            start = _index(int(match["start"]), page_count)
+            if match["stop"] is not None:
+                stop = _index(int(match["stop"]), page_count)
+            else:
+                stop = page_count - 1 if match["dash"] else start
+            step = int(match["step"] or 1)
+            if step == 0 or stop < start:
+                raise ValueError(f"Empty page range: {part.strip()!r}")
+            ranges.append(range(start, stop + 1, step))
+
+        return cls(_normalize(ranges), page_count)
+
+    @property
+    def is_everything(self) -> bool:
+        return self.ranges == (range(self.page_count),) or self.page_count == 0
+
+    def __iter__(self) -> Iterator[int]:
+        previous = None
+        for page in heapq.merge(*self.ranges):
+            if page != previous:
+                yield page
+            previous = page
+
+    def __len__(self) -> int:
+        if all(range_.step == 1 for range_ in self.ranges):
+            # Contiguous ranges are merged, so they don't overlap
+            return sum(len(range_) for range_ in self.ranges)
+        return sum(1 for _ in self)
+
+    def __contains__(self, page: object) -> bool:
+        return any(page in range_ for range_ in self.ranges)
+
+    def __str__(self) -> str:
+        if self.is_everything:
+            return "all"
+        parts = []
+        for range_ in self.ranges:
+            last = range_[-1] + 1
+            if len(range_) == 1:
+                parts.append(str(last))
+            else:
+                parts.append(f"{range_.start + 1}-{last}")
+                if range_.step != 1:
+                    parts[-1] += f":{range_.step}"
+        return ", ".join(parts)
+
+
+def _index(number: int, page_count: int) -> int:
+    """The zero-based index of a page number, counting from the end if negative."""
+    index = number - 1 if number > 0 else page_count + number
+    if number == 0 or not 0 <= index < page_count:
+        raise IndexError(f"Page {number} doesn't exist in {page_count} pages")
+    return index
+
+
+def _normalize(ranges: List[range]) -> Tuple[range, ...]:
+    """Sort ranges by their first page and merge contiguous ones that overlap or touch."""
+    merged: List[range] = []
+    for range_ in sorted(ranges, key=lambda range_: (range_.start, range_.stop)):
+        previous: Optional[range] = merged[-1] if merged else None
+        if (
+            previous is not None
+            and previous.step == range_.step == 1
+            and range_.start <= previous.stop
+        ):
+            merged[-1] = range(previous.start, max(previous.stop, range_.stop))
+        else:
+            merged.append(range_)
+    return tuple(merged)
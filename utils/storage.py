@@ -0,0 +1,90 @@
+import os
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Union
+
+from pypdf import PdfWriter
+from streamlit import session_state
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from utils import buffers
+
+# Outputs larger than this are kept on disk instead of in the session's memory
+SPILL_THRESHOLD = int(os.getenv("PDF_WORKDESK_SPILL_THRESHOLD_MB", "50")) * 1024 * 1024
+
+# Uploads larger than this are spooled to disk and memory-mapped, so parsing them
+# doesn't copy them
+UPLOAD_SPILL_THRESHOLD = (
+    int(os.getenv("PDF_WORKDESK_UPLOAD_SPILL_THRESHOLD_MB", "32")) * 1024 * 1024
+)
+
+PdfOutput = Union[bytes, Path]
+
+
+def session_dir() -> Path:
+    # The directory is removed when the session (and with it this object) goes away
+    if "tmp_dir" not in session_state:
+        session_state["tmp_dir"] = TemporaryDirectory(prefix="pdf-workdesk-")
+    return Path(session_state["tmp_dir"].name)
+
+
+def pdf_bytes(writer: PdfWriter) -> bytes:
+    buffer = BytesIO()
+    writer.write(buffer)
+    # `getvalue` hands over the buffer without copying it
+    return buffer.getvalue()
+
+
+def keep(pdf: bytes, name: str) -> PdfOutput:
+    """
+    Keep a PDF in this session's output slot `name`, replacing the previous output.
+
+    Args:
+        pdf (bytes): The PDF produced by an operation.
+        name (str): The output slot, e.g. the operation that produced it.
+
+    Returns:
+        PdfOutput: The PDF bytes, or the path of the spilled file if the PDF is
+            larger than `SPILL_THRESHOLD`. Both can be passed to `st.pdf`.
+    """
+    if len(pdf) > SPILL_THRESHOLD:
+        output = session_dir() / f"{name}.pdf"
+        output.write_bytes(pdf)
+    else:
+        output = pdf
+
+    session_state["outputs"][name] = output
+    return output
+
+
+def write_pdf(writer: PdfWriter, name: str) -> PdfOutput:
+    return keep(pdf_bytes(writer), name)
+
+
+def download_data(output: PdfOutput) -> Callable[[], bytes]:
+    # Outputs are only sent (and spilled ones read back) when the user actually
+    # downloads them
+    return output.read_bytes if isinstance(output, Path) else lambda: output
+
+
+def read_upload(file: UploadedFile, slot: str) -> buffers.PdfData:
+    """
+    Read an upload for the document `slot`, e.g. "main".
+
+    Returns:
+        buffers.PdfData: The upload's bytes or, if it's larger than
+            `UPLOAD_SPILL_THRESHOLD`, a memory map of it spilled to this session's
+            directory. Spilled uploads are only removed with the directory, as
+            jobs reopen them by path, possibly after another file was uploaded.
+    """
+    if file.size <= UPLOAD_SPILL_THRESHOLD:
+        return file.getvalue()
+
+    # A new file per upload, as files that are still mapped must not be modified
+    path = session_dir() / f"upload_{slot}_{file.file_id}.pdf"
+    with open(path, "wb") as spilled:
+        # `getbuffer` is a view of the upload, so it isn't copied on the way
+        spilled.write(file.getbuffer())
+
+    return buffers.MappedPdf.open(path)
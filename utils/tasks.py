@@ -0,0 +1,1017 @@
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from pypdf import ObjectDeletionFlag, PageObject, PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    RectangleObject,
+    StreamObject,
+    TextStringObject,
+)
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from utils import buffers, incremental, parallel, selection
+
+# Long-running operations, run as jobs in worker processes (see `utils.jobs`).
+# They take and return bytes and, like `parallel`, must not import Streamlit.
+
+logger = logging.getLogger(__name__)
+
+Progress = Callable[[int, int], None]
+
+
+def _no_progress(done: int, total: int) -> None:
+    pass
+
+
+def convert_to_word(
+    pdf: buffers.PdfData,
+    password: Optional[str] = None,
+    progress: Progress = _no_progress,
+    pages: Optional[selection.PageSelection] = None,
+) -> bytes:
+    """
+    Convert a PDF to a Word document, parsing chunks of pages in parallel.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        password (Optional[str]): The password of the document.
+        progress (Progress): Called with the number of pages parsed so far and the
+            total number of pages.
+        pages (Optional[selection.PageSelection]): The pages to convert; None for
+            all pages.
+
+    Returns:
+        bytes: The Word document.
+    """
+    converter = parallel.open_converter(pdf, password)
+    # Pages that aren't parsed are left out of the Word document
+    pages = list(
+        selection.PageSelection.everything(len(converter.pages))
+        if pages is None
+        else pages
+    )
+
+    try:
+        # Each worker parses its chunks with its own converter; the parsed layouts
+        # are then assembled into one document here. Small documents are parsed
+        # serially by this converter, which restoring its own layouts leaves as is.
+        for done, layout in enumerate(
+            parallel.map_pages(
+                parallel.docx_pages,
+                pdf,
+                pages,
+                password=password,
+                opened=converter,
+                opener=parallel.open_converter,
+                batch=True,
+            ),
+            start=1,
+        ):
+            if layout is not None:
+                converter.pages[layout["id"]].restore(layout)
+            progress(done, len(pages))
+
+        docx_stream = BytesIO()
+        converter.make_docx(docx_stream, **converter.default_settings)
+    finally:
+        converter.close()
+
+    return docx_stream.getvalue()
+
+
+# The algorithms `PdfWriter.encrypt` supports, from the most compatible to the most secure
+ALGORITHMS = ("RC4-40", "RC4-128", "AES-128", "AES-256-R5", "AES-256")
+
+
+@dataclass(frozen=True)
+class Protection:
+    """How to encrypt a PDF: the passwords, the algorithm and the permissions."""
+
+    user_password: str = field(repr=False)
+    # Defaults to the user password
+    owner_password: Optional[str] = field(default=None, repr=False)
+    algorithm: str = "AES-256-R5"
+    # The permission flags (/P) of the encryption dictionary; None for all
+    permissions: Optional[int] = None
+
+
+def _algorithm(encryption: DictionaryObject) -> str:
+    """The entry of `ALGORITHMS` closest to an encryption dictionary."""
+    version = encryption.get("/V", 0)
+    if version == 5:
+        return "AES-256" if encryption.get("/R") == 6 else "AES-256-R5"
+    if version == 4:
+        method = encryption.get("/CF", {}).get(encryption.get("/StmF"), {}).get("/CFM")
+        return "AES-128" if method == "/AESV2" else "RC4-128"
+    if version in (2, 3):
+        return "RC4-128" if encryption.get("/Length", 40) > 40 else "RC4-40"
+    return "RC4-40"
+
+
+def protection_of(reader: PdfReader, password: Optional[str]) -> Optional[Protection]:
+    """
+    The protection of an encrypted document, to apply it again to outputs.
+
+    Only the password the document was opened with is known, so it becomes the
+    user password (and, as the owner password defaults to it, the owner password)
+    of the outputs. The algorithm and permissions are kept.
+
+    Returns:
+        Optional[Protection]: The protection, or None if the document isn't
+            encrypted or no password is known.
+    """
+    if not (reader.is_encrypted and password):
+        return None
+    encryption = reader.trailer["/Encrypt"].get_object()
+    return Protection(
+        password,
+        algorithm=_algorithm(encryption),
+        permissions=int(encryption["/P"]) & 0xFFFFFFFF,
+    )
+
+
+def encrypt(writer: PdfWriter, protection: Protection) -> None:
+    """Encrypt a writer's document when it's written."""
+    options = {}
+    if protection.permissions is not None:
+        options["permissions_flag"] = protection.permissions
+    writer.encrypt(
+        protection.user_password,
+        protection.owner_password,
+        algorithm=protection.algorithm,
+        **options,
+    )
+
+
+def encrypt_pdf(
+    pdf: buffers.PdfData,
+    protection: Protection,
+    password: Optional[str] = None,
+) -> bytes:
+    """
+    Encrypt a PDF, e.g. to restore the protection of an operation's output.
+
+    The document is cloned as a whole rather than copied page by page, so its
+    outline, forms and other document-level objects are kept.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        protection (Protection): The passwords, algorithm and permissions to
+            encrypt with.
+        password (Optional[str]): The current password of the document, if any;
+            it's replaced.
+
+    Returns:
+        bytes: The encrypted PDF.
+    """
+    writer = PdfWriter(clone_from=parallel.open_reader(pdf, password))
+    encrypt(writer, protection)
+    bytes_stream = BytesIO()
+    writer.write(bytes_stream)
+    return bytes_stream.getvalue()
+
+
+def rotate_pages(
+    pdf: buffers.PdfData,
+    angle: int,
+    pages: Optional[selection.PageSelection] = None,
+    password: Optional[str] = None,
+) -> bytes:
+    """
+    Rotate pages clockwise by a multiple of 90 degrees.
+
+    Only the dictionaries of the selected pages are rewritten, in an incremental
+    update (see `incremental`), so rotating a few pages of a large document doesn't
+    copy the rest of it.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        angle (int): The angle, in degrees.
+        pages (Optional[selection.PageSelection]): The pages to rotate; None for
+            all pages.
+        password (Optional[str]): The password of the document. The output isn't
+            encrypted.
+
+    Returns:
+        bytes: The rotated PDF.
+    """
+    update = incremental.open_update(pdf, password)
+    rotate_update(update, angle, pages)
+    return update.to_bytes()
+
+
+def rotate_update(
+    update: incremental.Update,
+    angle: int,
+    pages: Optional[selection.PageSelection] = None,
+) -> None:
+    """Rotate pages of an update, see `rotate_pages`."""
+    for index in (
+        selection.PageSelection.everything(update.page_count)
+        if pages is None
+        else pages
+    ):
+        update.page(index).rotate(angle)
+
+
+def _content_stream(data: bytes) -> DecodedStreamObject:
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream
+
+
+def scale_pages(
+    pdf: buffers.PdfData,
+    width: float,
+    height: float,
+    scale_content: float = 1.0,
+    pages: Optional[selection.PageSelection] = None,
+    password: Optional[str] = None,
+) -> bytes:
+    """
+    Scale pages to a paper size, and their content independently of it.
+
+    Like `rotate_pages`, only the selected pages are rewritten. Their content
+    streams aren't decoded: the scaling is drawn around them by streams shared by
+    all pages of the same size.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        width (float): The new page width, in points.
+        height (float): The new page height, in points.
+        scale_content (float): Scale the content by this factor, on top of the
+            scaling to the new size.
+        pages (Optional[selection.PageSelection]): The pages to scale; None for
+            all pages.
+        password (Optional[str]): The password of the document. The output isn't
+            encrypted.
+
+    Returns:
+        bytes: The scaled PDF.
+    """
+    update = incremental.open_update(pdf, password)
+    scale_update(update, width, height, scale_content, pages)
+    return update.to_bytes()
+
+
+def scale_update(
+    update: incremental.Update,
+    width: float,
+    height: float,
+    scale_content: float = 1.0,
+    pages: Optional[selection.PageSelection] = None,
+) -> None:
+    """Scale pages of an update, see `scale_pages`."""
+    restore_state = update.add(_content_stream(b"\nQ\n"))
+    # One "save state and scale" stream per scaling
+    save_states: Dict[Tuple[float, float], IndirectObject] = {}
+
+    for index in (
+        selection.PageSelection.everything(update.page_count)
+        if pages is None
+        else pages
+    ):
+        page = update.page(index)
+        scale_x = width / float(page.mediabox.width)
+        scale_y = height / float(page.mediabox.height)
+
+        for box in ("/MediaBox", "/CropBox", "/TrimBox", "/BleedBox", "/ArtBox"):
+            if box in page:
+                page[NameObject(box)] = RectangleObject(page[box]).scale(
+                    scale_x, scale_y
+                )
+        for annotation in page.get("/Annots", ()):
+            if isinstance(annotation, IndirectObject):
+                update.replace(annotation, annotation.get_object())
+            rectangle = annotation.get_object().get("/Rect")
+            if isinstance(rectangle, ArrayObject):
+                annotation.get_object()[NameObject("/Rect")] = RectangleObject(
+                    rectangle
+                ).scale(scale_x, scale_y)
+
+        matrix = (scale_x * scale_content, scale_y * scale_content)
+        if matrix not in save_states:
+            save_states[matrix] = update.add(
+                _content_stream(
+                    f"q {matrix[0]:.6f} 0 0 {matrix[1]:.6f} 0 0 cm\n".encode()
+                )
+            )
+        incremental.wrap_contents(update, page, save_states[matrix], restore_state)
+
+
+def hex_to_rgb(hex_color: str) -> Tuple[float, float, float]:
+    """
+    Convert a hexadecimal color code to an RGB color tuple.
+
+    Args:
+        hex_color (str): The hexadecimal color code.
+
+    Returns:
+        Tuple[float, float, float]: The RGB color tuple
+    """
+    hex_color = hex_color.lstrip("#")
+    return tuple(int(hex_color[i : i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def draw_watermark_grid(
+    can, stamp_label: str, step_x: int, step_y: int, width: float, height: float
+) -> None:
+    """
+    Draw a grid of watermarks on the given canvas.
+
+    Args:
+        can (canvas.Canvas): The canvas to draw the watermarks on.
+        stamp_label (str): The label to be displayed as the watermark.
+        step_x (int): The horizontal spacing between watermarks.
+        step_y (int): The vertical spacing between watermarks.
+        width (float): The width of the canvas.
+        height (float): The height of the canvas.
+
+    Returns:
+        None
+    """
+    for x in range(-100, int(width) + 100, step_x):
+        for y in range(-100, int(height) + 100, step_y):
+            can.saveState()
+            can.translate(x, y)
+            can.rotate(45)
+            can.drawCentredString(0, 0, stamp_label)
+            can.restoreState()
+
+
+def create_watermark_canvas(
+    stamp_label: str,
+    stamp_size: int,
+    stamp_color: str,
+    stamp_transparency: float,
+    width: float = letter[0],
+    height: float = letter[1],
+) -> BytesIO:
+    """
+    Create a watermark canvas with the given label, size, color, and transparency.
+
+    Args:
+        stamp_label (str): The label to be displayed as the watermark.
+        stamp_size (int): The font size of the watermark.
+        stamp_color (str): The color of the watermark in hexadecimal format.
+        stamp_transparency (float): The transparency of the watermark.
+        width (float): The width of the canvas.
+        height (float): The height of the canvas.
+
+    Returns:
+        BytesIO: A BytesIO object containing the watermark canvas.
+    """
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pagesize=(width, height))
+    can.setFont("Helvetica", stamp_size)
+    color = hex_to_rgb(stamp_color)
+    can.setFillColorRGB(*color)
+    can.setFillAlpha(stamp_transparency)
+    can.saveState()
+    draw_watermark_grid(
+        can, stamp_label, step_x=150, step_y=100, width=width, height=height
+    )
+    can.save()
+    packet.seek(0)
+    return packet
+
+
+def watermark_xobject(update: incremental.Update, watermark: BytesIO) -> IndirectObject:
+    """
+    Add a watermark to a PDF as a Form XObject, so pages can share it.
+
+    Args:
+        update (incremental.Update): The update to add the watermark to.
+        watermark (BytesIO): A single-page PDF containing the watermark.
+
+    Returns:
+        IndirectObject: A reference to the Form XObject.
+    """
+    watermark_page = PdfReader(watermark).pages[0]
+
+    xobject = DecodedStreamObject()
+    xobject.set_data(watermark_page.get_contents().get_data())
+    xobject.update(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): watermark_page.mediabox,
+            NameObject("/Resources"): update.copy(watermark_page["/Resources"]),
+        }
+    )
+    return update.add(xobject.flate_encode())
+
+
+def watermark_update(
+    update: incremental.Update,
+    create_watermark: Callable[[float, float], BytesIO],
+    pages: Optional[selection.PageSelection] = None,
+) -> None:
+    """
+    Draw a watermark over pages of an update.
+
+    The watermark is drawn once per distinct page size and embedded once as a Form
+    XObject that every page references, instead of copying it into each page's
+    content stream.
+
+    Args:
+        update (incremental.Update): The update to watermark the pages of.
+        create_watermark (Callable[[float, float], BytesIO]): Creates the watermark
+            for a page width and height, e.g. `create_watermark_canvas`.
+        pages (Optional[selection.PageSelection]): The pages to watermark; None for
+            all pages.
+    """
+    # Wrap the existing content in q/Q so its graphics state can't leak into the
+    # watermark. The opening operator is shared by all pages.
+    save_state = DecodedStreamObject()
+    save_state.set_data(b"q\n")
+    save_state = update.add(save_state)
+
+    # One Form XObject per page size, and one drawing operation per XObject and origin
+    watermarks: Dict[Tuple[float, float], Tuple[NameObject, IndirectObject]] = {}
+    draw_operations: Dict[Tuple[NameObject, float, float], IndirectObject] = {}
+
+    for index in range(update.page_count) if pages is None else pages:
+        page = update.page(index)
+        box = page.mediabox
+
+        size = (float(box.width), float(box.height))
+        if size not in watermarks:
+            watermarks[size] = (
+                NameObject(f"/PdfWorkdeskWatermark{len(watermarks)}"),
+                watermark_xobject(update, create_watermark(*size)),
+            )
+        name, xobject = watermarks[size]
+
+        update.edit(update.edit(page, "/Resources"), "/XObject")[name] = xobject
+
+        key = (name, float(box.left), float(box.bottom))
+        if key not in draw_operations:
+            draw = DecodedStreamObject()
+            draw.set_data(f"\nQ q 1 0 0 1 {key[1]} {key[2]} cm {name} Do Q\n".encode())
+            draw_operations[key] = update.add(draw)
+
+        incremental.wrap_contents(update, page, save_state, draw_operations[key])
+
+
+def _scaled_progress(progress: Progress, stage: int, stages: int) -> Progress:
+    # Reports the progress of one of several stages as a share of all of them
+    return lambda done, total: progress(stage * total + done, stages * total)
+
+
+def recompress_images(
+    writer: PdfWriter,
+    pdf: buffers.PdfData,
+    password: Optional[str] = None,
+    quality: int = 75,
+    dpi: Optional[int] = None,
+    grayscale: bool = False,
+    progress: Progress = _no_progress,
+    pages: Optional[selection.PageSelection] = None,
+) -> None:
+    """
+    Re-encode the images of a PDF as JPEG, in a pool of worker processes.
+
+    Each image is re-encoded once, however many times it's drawn, and only replaced
+    if the JPEG is smaller. Images with masks or fewer than 8 bits per component are
+    kept.
+
+    Args:
+        writer (PdfWriter): The pages of `pdf`, added in order, where images are
+            replaced.
+        pdf (buffers.PdfData): The PDF document.
+        password (Optional[str]): The password of the document.
+        quality (int): The JPEG quality.
+        dpi (Optional[int]): Downsample images to this resolution at the largest
+            size they're drawn at, if they have more pixels than that.
+        grayscale (bool): Convert images to grayscale.
+        progress (Progress): Called with the number of pages processed so far by
+            both passes and the total.
+        pages (Optional[selection.PageSelection]): Only re-encode the images drawn
+            on these pages, which also changes them on other pages they're drawn
+            on; None for all pages.
+    """
+    reader = parallel.open_reader(pdf, password)
+    pages = list(
+        selection.PageSelection.everything(len(reader.pages))
+        if pages is None
+        else pages
+    )
+
+    # First pass: find where each image is drawn and the largest size it's drawn at
+    images: Dict[Tuple[int, int], Dict] = {}
+    for done, (page, placements) in enumerate(
+        zip(
+            pages,
+            parallel.map_pages(
+                parallel.page_image_placements,
+                pdf,
+                pages,
+                password=password,
+                opened=reader,
+            ),
+        ),
+        start=1,
+    ):
+        for path, key, pixels, width, height in placements:
+            image = images.setdefault(
+                key, {"page": page, "path": path, "pixels": pixels, "points": (0, 0)}
+            )
+            image["points"] = tuple(map(max, image["points"], (width, height)))
+        _scaled_progress(progress, 0, 2)(done, len(pages))
+
+    # Second pass: re-encode each image on the first page it's drawn on
+    plan: Dict[int, List] = {}
+    for image in images.values():
+        size = None
+        (pixels_x, pixels_y), (points_x, points_y) = image["pixels"], image["points"]
+        if dpi is not None and pixels_x and pixels_y:
+            scale = max(points_x / 72 * dpi / pixels_x, points_y / 72 * dpi / pixels_y)
+            if scale < 1:
+                size = (
+                    max(1, round(pixels_x * scale)),
+                    max(1, round(pixels_y * scale)),
+                )
+        plan.setdefault(image["page"], []).append((image["path"], size))
+
+    plan_pages = sorted(plan)
+    for done, (page, results) in enumerate(
+        zip(
+            plan_pages,
+            parallel.map_pages(
+                partial(
+                    parallel.page_images_jpeg,
+                    images=plan,
+                    quality=quality,
+                    grayscale=grayscale,
+                ),
+                pdf,
+                plan_pages,
+                password=password,
+                opened=reader,
+            ),
+        ),
+        start=1,
+    ):
+        for (path, _), result in zip(plan[page], results):
+            if result is not None:
+                _replace_image(writer, writer.pages[page], path, *result)
+        _scaled_progress(progress, 1, 2)(done, len(plan_pages))
+
+    logger.info(
+        "Re-encoded images: %d distinct images on %d pages",
+        len(images),
+        len(plan_pages),
+    )
+
+
+def _replace_image(
+    writer: PdfWriter,
+    page: PageObject,
+    path: Tuple[str, ...],
+    data: bytes,
+    width: int,
+    height: int,
+    color_space: str,
+) -> None:
+    xobjects = page
+    for name in path[:-1]:
+        xobjects = xobjects["/Resources"]["/XObject"][name]
+    xobjects = xobjects["/Resources"]["/XObject"]
+    reference = xobjects.raw_get(path[-1])
+    old = reference.get_object()
+
+    image = StreamObject.initialize_from_dictionary(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(width),
+            NameObject("/Height"): NumberObject(height),
+            NameObject("/ColorSpace"): NameObject(color_space),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+            NameObject("/Filter"): NameObject("/DCTDecode"),
+            # Already encoded
+            "__streamdata__": data,
+        }
+    )
+    # Soft masks are resampled to the image's size by viewers
+    if "/SMask" in old:
+        image[NameObject("/SMask")] = old.raw_get("/SMask")
+
+    # Every page and form drawing the image shares this object. pypdf has no public
+    # way to replace an object, see `requirements.txt`.
+    writer._replace_object(reference, image)
+
+
+def _replace_contents(
+    writer: PdfWriter, page: PageObject, data: bytes, replaced: Set[int]
+) -> None:
+    contents = StreamObject.initialize_from_dictionary(
+        {NameObject("/Filter"): NameObject("/FlateDecode"), "__streamdata__": data}
+    )
+
+    # Reuse the (first) replaced stream's object number, as new objects would leave
+    # free entries in the cross-reference table. Other streams become unreferenced.
+    reference = page.raw_get("/Contents")
+    if isinstance(reference.get_object(), ArrayObject):
+        reference = reference.get_object()[0]
+
+    # Streams shared with pages processed before are kept for them. pypdf has no
+    # public way to add or replace objects, see `requirements.txt`.
+    if isinstance(reference, IndirectObject) and reference.idnum not in replaced:
+        replaced.add(reference.idnum)
+        writer._replace_object(reference, contents)
+    else:
+        reference = writer._add_object(contents)
+    page[NameObject("/Contents")] = reference
+
+
+def compress_contents(
+    writer: PdfWriter,
+    pdf: buffers.PdfData,
+    password: Optional[str] = None,
+    level: int = -1,
+    progress: Progress = _no_progress,
+    pages: Optional[selection.PageSelection] = None,
+    reader: Optional[PdfReader] = None,
+) -> None:
+    """
+    Flate-compress the content streams of a PDF that aren't yet, in a pool of
+    worker processes.
+
+    Args:
+        writer (PdfWriter): The pages of `pdf`, in order, whose content streams are
+            replaced.
+        pdf (buffers.PdfData): The PDF document.
+        password (Optional[str]): The password of the document.
+        level (int): The zlib compression level, from 0 to 9, or -1 for the default.
+        progress (Progress): Called with the number of pages compressed so far and
+            the total number of pages.
+        pages (Optional[selection.PageSelection]): The pages to compress; None for
+            all pages.
+        reader (Optional[PdfReader]): `pdf`, if it's already open.
+    """
+    reader = parallel.open_reader(pdf, password) if reader is None else reader
+    pages = list(
+        selection.PageSelection.everything(len(writer.pages))
+        if pages is None
+        else pages
+    )
+    replaced = set()
+    for done, (page, data) in enumerate(
+        zip(
+            pages,
+            parallel.map_pages(
+                partial(parallel.page_contents_flate, level=level),
+                pdf,
+                pages,
+                password=password,
+                opened=reader,
+            ),
+        ),
+        start=1,
+    ):
+        if data is not None:
+            _replace_contents(writer, writer.pages[page], data, replaced)
+        progress(done, len(pages))
+
+
+@contextmanager
+def _stage(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def compress_pdf(
+    pdf: buffers.PdfData,
+    password: Optional[str] = None,
+    progress: Progress = _no_progress,
+    level: int = -1,
+    timings: Optional[Dict[str, float]] = None,
+    protection: Optional[Protection] = None,
+    pages: Optional[selection.PageSelection] = None,
+) -> bytes:
+    """
+    Compress a PDF losslessly.
+
+    Content streams that aren't Flate-compressed yet are compressed by a pool of
+    worker processes, then identical objects (e.g. fonts, images and forms embedded
+    more than once) are merged and unreferenced ones dropped.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        password (Optional[str]): The password of the document.
+        progress (Progress): Called with the number of pages compressed so far and
+            the total number of pages.
+        level (int): The zlib compression level, from 0 to 9, or -1 for the default.
+        timings (Optional[Dict[str, float]]): Filled with the wall time in seconds
+            of each stage.
+        protection (Optional[Protection]): Encrypt the output with it. By
+            default, the output isn't encrypted.
+        pages (Optional[selection.PageSelection]): Only compress the content
+            streams of these pages; None for all pages. Identical objects are
+            merged across the whole document.
+
+    Returns:
+        bytes: The compressed PDF.
+    """
+    timings = {} if timings is None else timings
+
+    with _stage(timings, "parse"):
+        reader = parallel.open_reader(pdf, password)
+        writer = PdfWriter(clone_from=reader)
+
+    with _stage(timings, "content streams"):
+        compress_contents(writer, pdf, password, level, progress, pages, reader)
+
+    with _stage(timings, "deduplicate"):
+        writer.compress_identical_objects()
+
+    with _stage(timings, "write"):
+        if protection is not None:
+            encrypt(writer, protection)
+        bytes_stream = BytesIO()
+        writer.write(bytes_stream)
+
+    logger.info(
+        "Compressed PDF: %s",
+        ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()),
+    )
+    return bytes_stream.getvalue()
+
+
+def _own_resources(writer: PdfWriter, obj: DictionaryObject) -> None:
+    """
+    Give a page or form its own resources and copies of the forms it draws, with
+    placeholders for its images.
+
+    pypdf removes images by deleting the image and form objects, wherever they're
+    used; after this, it only deletes objects of this page.
+    """
+    resources = DictionaryObject(obj.get("/Resources", DictionaryObject()))
+    xobjects = DictionaryObject(resources.get("/XObject", DictionaryObject()))
+    for name, xobject in xobjects.items():
+        subtype = xobject.get_object().get("/Subtype")
+        if subtype == "/Form":
+            form = xobject.get_object().clone(writer, force_duplicate=True)
+            _own_resources(writer, form)
+            xobjects[name] = form.indirect_reference
+        elif subtype == "/Image":
+            # Removed from this page's resources along with the image
+            xobjects[name] = DictionaryObject(
+                {NameObject("/Subtype"): NameObject("/Image")}
+            )
+    resources[NameObject("/XObject")] = xobjects
+    obj[NameObject("/Resources")] = resources
+
+
+def remove_page_images(
+    writer: PdfWriter, pages: Optional[selection.PageSelection] = None
+) -> None:
+    """Remove the images drawn on some pages of a writer; None for all pages."""
+    if pages is None or pages.is_everything:
+        writer.remove_images()
+        return
+    for page in pages:
+        _own_resources(writer, writer.pages[page])
+        writer.remove_objects_from_page(writer.pages[page], ObjectDeletionFlag.IMAGES)
+
+
+def reduce_size(
+    pdf: buffers.PdfData,
+    password: Optional[str] = None,
+    remove_duplication: bool = False,
+    remove_images: bool = False,
+    quality: Optional[int] = None,
+    dpi: Optional[int] = None,
+    grayscale: bool = False,
+    lossless: bool = False,
+    progress: Progress = _no_progress,
+    protection: Optional[Protection] = None,
+    pages: Optional[selection.PageSelection] = None,
+) -> bytes:
+    """
+    Reduce the size of a PDF, applying the selected stages in order.
+
+    The password is removed, unless `protection` restores it.
+
+    Args:
+        pdf (buffers.PdfData): The PDF document.
+        password (Optional[str]): The password of the document.
+        remove_duplication (bool): Rewrite the document so repeated objects are
+            referenced instead of embedded again.
+        remove_images (bool): Remove all images.
+        quality (Optional[int]): Re-encode images with this JPEG quality, unless
+            images are removed. See `recompress_images`.
+        dpi (Optional[int]): Downsample re-encoded images to this resolution.
+        grayscale (bool): Convert re-encoded images to grayscale.
+        lossless (bool): Compress losslessly, see `compress_pdf`.
+        progress (Progress): Called with the progress of all stages, as the number
+            of steps done so far and the total.
+        protection (Optional[Protection]): Encrypt the output with it, as the
+            last stage.
+        pages (Optional[selection.PageSelection]): Only remove, re-encode and
+            compress the images and content of these pages; None for all pages.
+
+    Returns:
+        bytes: The reduced PDF.
+    """
+    reader = parallel.open_reader(pdf, password)
+    reduce_quality = quality is not None and not remove_images
+
+    if not (remove_duplication or remove_images or reduce_quality or lossless):
+        writer = PdfWriter(clone_from=reader)
+        if protection is not None:
+            encrypt(writer, protection)
+        bytes_stream = BytesIO()
+        writer.write(bytes_stream)
+        return bytes_stream.getvalue()
+
+    stages = reduce_quality + lossless
+    if remove_duplication or remove_images or reduce_quality:
+        writer = PdfWriter()
+        for page in reader.pages:
+            writer.add_page(page)
+        if reader.metadata:
+            writer.add_metadata(reader.metadata)
+
+        if remove_images:
+            remove_page_images(writer, pages)
+        if reduce_quality:
+            recompress_images(
+                writer,
+                pdf,
+                password,
+                quality=quality,
+                dpi=dpi,
+                grayscale=grayscale,
+                progress=_scaled_progress(progress, 0, stages),
+                pages=pages,
+            )
+
+        if protection is not None and not lossless:
+            encrypt(writer, protection)
+        bytes_stream = BytesIO()
+        writer.write(bytes_stream)
+        if not lossless:
+            return bytes_stream.getvalue()
+        pdf, password = bytes_stream.getvalue(), None
+
+    return compress_pdf(
+        pdf,
+        password,
+        progress=_scaled_progress(progress, stages - 1, stages),
+        protection=protection,
+        pages=pages,
+    )
+
+
+@dataclass(frozen=True)
+class MergeSource:
+    """A document to merge, and the pages to take from it."""
+
+    pdf: buffers.PdfData = field(repr=False)
+    # The title of the document's bookmark
+    name: str
+    password: Optional[str] = None
+    # Page indices, in order; None for all pages
+    pages: Optional[Tuple[int, ...]] = None
+
+
+def _rename_destinations(
+    writer: PdfWriter, first_page: int, renamed: Dict[str, str]
+) -> None:
+    # Links on the pages just merged that go to renamed destinations. Links to
+    # explicit destinations (arrays) were already pointed at the merged pages.
+    for page in writer.pages[first_page:]:
+        for annotation in page.get("/Annots", ()):
+            annotation = annotation.get_object()
+            for target, key in ((annotation, "/Dest"), (annotation.get("/A"), "/D")):
+                if target is None:
+                    continue
+                target = target.get_object()
+                name = target.get(key)
+                if isinstance(name, (str, NameObject)) and name in renamed:
+                    target[NameObject(key)] = TextStringObject(renamed[name])
+
+
+def _drop_duplicate_names(writer: PdfWriter, names: Set[str]) -> None:
+    # `PdfWriter.append` can copy a destination under a name an earlier document
+    # already uses: the earlier document keeps the name, as its entry comes first
+    tree = writer.get_named_dest_root()
+    seen = set()
+    entries = []
+    for name, destination in zip(tree[::2], tree[1::2]):
+        if name in names:
+            if name in seen:
+                continue
+            seen.add(name)
+        entries += [name, destination]
+    tree[:] = entries
+
+
+def merge_pdfs(
+    sources: List[MergeSource],
+    output: Union[str, Path, BinaryIO],
+    bookmarks: bool = True,
+    progress: Progress = _no_progress,
+    protection: Optional[Protection] = None,
+) -> Union[str, Path, BinaryIO]:
+    """
+    Merge documents, in order, into one.
+
+    Bookmarks (outlines) and named destinations are kept. Destinations with a name
+    already used by an earlier document are renamed, along with the links to them.
+    Objects that are identical across documents (e.g. fonts and logos) are only
+    stored once.
+
+    Documents are parsed one at a time, only for the objects their pages use, but
+    the merged document is kept in memory until it's deduplicated and written to
+    `output`, so memory grows with the output, as with any `PdfWriter`.
+
+    Args:
+        sources (List[MergeSource]): The documents and their pages.
+        output (Union[str, Path, BinaryIO]): The path or stream to write to.
+        bookmarks (bool): Add a bookmark per document, with its own bookmarks
+            under it.
+        progress (Progress): Called with the number of documents merged so far
+            and the total.
+        protection (Optional[Protection]): Encrypt the merged document with it.
+
+    Returns:
+        Union[str, Path, BinaryIO]: `output`, e.g. so jobs return the path written.
+    """
+    writer = PdfWriter()
+    names: Set[str] = set()
+    # Writing and deduplicating count as one more step
+    steps = len(sources) + 1
+
+    for done, source in enumerate(sources, start=1):
+        reader = parallel.open_reader(source.pdf, source.password)
+        first_page = len(writer.pages)
+
+        destinations = reader.named_destinations
+        collisions = names & destinations.keys()
+        names |= destinations.keys()
+
+        writer.append(
+            reader,
+            outline_item=source.name if bookmarks else None,
+            pages=None if source.pages is None else list(source.pages),
+        )
+
+        # The pages just merged, by the source page they were copied from
+        copied = {
+            reader.pages[page].indirect_reference.idnum: merged
+            for page, merged in zip(
+                range(len(reader.pages)) if source.pages is None else source.pages,
+                writer.pages[first_page:],
+            )
+        }
+        if collisions:
+            _drop_duplicate_names(writer, collisions)
+        renamed = {}
+        for name in collisions:
+            destination = destinations[name]
+            if not isinstance(destination.page, IndirectObject):
+                continue
+            if (merged := copied.get(destination.page.idnum)) is None:
+                continue
+            renamed[name] = new_name = f"{name} ({source.name}, {done})"
+            names.add(new_name)
+            array = ArrayObject(destination.dest_array)
+            array[0] = merged.indirect_reference
+            writer.add_named_destination_array(TextStringObject(new_name), array)
+        if renamed:
+            _rename_destinations(writer, first_page, renamed)
+
+        # pypdf remembers the objects it copied by the reader's id, which a later
+        # reader could reuse
+        writer.reset_translation(reader)
+
+        progress(done, steps)
+
+    writer.compress_identical_objects()
+    if protection is not None:
+        encrypt(writer, protection)
+    writer.write(output)
+    progress(steps, steps)
+
+    logger.info("Merged %d documents into %d pages", len(sources), len(writer.pages))
+    return output
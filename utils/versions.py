@@ -0,0 +1,280 @@
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils import buffers
+
+logger = logging.getLogger(__name__)
+
+# The history of a document as operations are applied to it. Like `parallel`, this
+# module must not import Streamlit.
+
+# Versions beyond this many bytes in memory are spilled to disk, oldest first
+MAX_HISTORY_BYTES = int(os.getenv("PDF_WORKDESK_MAX_HISTORY_MB", "128")) * 1024 * 1024
+# How many of the most recently current versions are kept whole in memory
+MATERIALIZED_VERSIONS = 3
+
+
+@dataclass(frozen=True)
+class Version:
+    id: int
+    # The operation that produced the version, e.g. "Rotate PDF"
+    label: str
+    digest: str
+    size: int
+    # The version whose bytes this one starts with, if it's stored as a delta
+    base: Optional[int]
+    # The bytes following the base's, or the whole document. Mapped once spilled.
+    data: buffers.PdfData = field(compare=False, repr=False)
+
+    @property
+    def spilled(self) -> bool:
+        return isinstance(self.data, buffers.MappedPdf)
+
+
+@dataclass(frozen=True)
+class Footprint:
+    versions: int
+    # Versions stored as deltas over an earlier version
+    deltas: int
+    # Bytes of the versions kept in memory
+    stored: int
+    # Bytes of whole documents kept for undo and redo, besides the stored ones
+    materialized: int
+    # Bytes of the versions spilled to disk
+    spilled: int
+
+    @property
+    def memory(self) -> int:
+        return self.stored + self.materialized
+
+
+class VersionStore:
+    """
+    A linear undo/redo history of a document, with copy-on-write versions.
+
+    Operations that change a few objects (see `incremental`) return the previous
+    version followed by the changed objects, so such a version only stores the bytes
+    it adds to the previous one, and refers to the previous one for the others.
+    Other versions store the whole document.
+
+    Undo and redo only move the current position in the history. The last few
+    current versions are kept whole (`MATERIALIZED_VERSIONS`), so going back and
+    forth between them never copies or rereads a document; older versions are put
+    back together from their deltas when they become current again.
+
+    Once the history takes more than `max_bytes` of memory, counting the whole
+    copies kept for undo and redo, those copies are dropped, then the oldest
+    versions are spilled to `spill_dir` and memory-mapped or, without a
+    `spill_dir`, dropped from the history. The current version is always kept in
+    memory, and at least one undo step is always kept.
+    """
+
+    def __init__(
+        self, max_bytes: int = MAX_HISTORY_BYTES, spill_dir: Optional[Path] = None
+    ):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        # The digest of the first version, e.g. to tell which upload the history is of
+        self.origin: Optional[str] = None
+        self._versions: Dict[int, Version] = {}
+        # Version IDs, oldest first
+        self._history: List[int] = []
+        self._position = -1
+        self._next_id = 0
+        self._materialized: "OrderedDict[int, buffers.PdfData]" = OrderedDict()
+
+    @property
+    def history(self) -> List[Version]:
+        return [self._versions[version_id] for version_id in self._history]
+
+    @property
+    def position(self) -> int:
+        """The index of the current version in `history`."""
+        return self._position
+
+    @property
+    def current(self) -> Optional[Version]:
+        return self._versions[self._history[self._position]] if self._history else None
+
+    @property
+    def can_undo(self) -> bool:
+        return self._position > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self._position < len(self._history) - 1
+
+    def record(self, pdf: buffers.PdfData, label: str, digest: str) -> Version:
+        """
+        Make `pdf` the current version, discarding the versions that were undone.
+
+        Args:
+            pdf (buffers.PdfData): The document, usually the output of an operation
+                applied to the current version. It must not be modified afterwards.
+            label (str): The operation that produced it.
+            digest (str): The content digest of `pdf`, e.g. `DocumentHandle.digest`.
+
+        Returns:
+            Version: The new current version.
+        """
+        for version_id in self._history[self._position + 1 :]:
+            self._drop(version_id)
+        del self._history[self._position + 1 :]
+
+        base = None
+        data = pdf
+        if (parent := self.current) is not None and parent.size < len(pdf):
+            # Slices of memoryviews compare their bytes without copying them
+            if memoryview(pdf)[: parent.size] == memoryview(self.pdf()):
+                base = parent.id
+                data = bytes(memoryview(pdf)[parent.size :])
+
+        version = Version(self._next_id, label, digest, len(pdf), base, data)
+        self._next_id += 1
+        self._versions[version.id] = version
+        self._history.append(version.id)
+        self._position = len(self._history) - 1
+        if self.origin is None:
+            self.origin = digest
+
+        self._materialize(version.id, pdf)
+        self._enforce_limit()
+        return version
+
+    def undo(self) -> Version:
+        if not self.can_undo:
+            raise IndexError("Nothing to undo")
+        self._position -= 1
+        return self.current
+
+    def redo(self) -> Version:
+        if not self.can_redo:
+            raise IndexError("Nothing to redo")
+        self._position += 1
+        return self.current
+
+    def pdf(self, version_id: Optional[int] = None) -> buffers.PdfData:
+        """The whole document of a version, by default of the current one."""
+        version_id = self.current.id if version_id is None else version_id
+        if version_id in self._materialized:
+            self._materialized.move_to_end(version_id)
+            return self._materialized[version_id]
+
+        chunks = []
+        version = self._versions[version_id]
+        while version.base is not None:
+            chunks.append(version.data)
+            version = self._versions[version.base]
+        chunks.append(version.data)
+        pdf = version.data if len(chunks) == 1 else b"".join(reversed(chunks))
+        self._materialize(version_id, pdf)
+        return pdf
+
+    def footprint(self) -> Footprint:
+        stored = [version for version in self._versions.values() if not version.spilled]
+        # Whole versions are materialized as their own data
+        data = {id(version.data) for version in stored}
+        return Footprint(
+            versions=len(self._versions),
+            deltas=sum(version.base is not None for version in self._versions.values()),
+            stored=sum(len(version.data) for version in stored),
+            materialized=sum(
+                len(pdf)
+                for pdf in self._materialized.values()
+                if id(pdf) not in data and not isinstance(pdf, buffers.MappedPdf)
+            ),
+            spilled=sum(
+                len(version.data)
+                for version in self._versions.values()
+                if version.spilled
+            ),
+        )
+
+    def close(self) -> None:
+        """Drop every version, removing the spilled ones from disk."""
+        for version_id in list(self._versions):
+            self._drop(version_id)
+        self._history.clear()
+        self._position = -1
+
+    def _materialize(self, version_id: int, pdf: buffers.PdfData) -> None:
+        self._materialized[version_id] = pdf
+        self._materialized.move_to_end(version_id)
+        while len(self._materialized) > MATERIALIZED_VERSIONS:
+            self._materialized.popitem(last=False)
+
+    def _drop(self, version_id: int) -> None:
+        version = self._versions.pop(version_id)
+        self._materialized.pop(version_id, None)
+        # Documents mapped by the caller (e.g. spilled uploads) aren't the store's
+        if version.spilled and version.data.path.parent == self.spill_dir:
+            version.data.path.unlink(missing_ok=True)
+
+    def _enforce_limit(self) -> None:
+        """
+        Bring the memory the history takes under `max_bytes`.
+
+        The whole copies kept for undo and redo go first, then the oldest versions
+        are spilled or, without a `spill_dir`, evicted. The current version and the
+        one before it are never evicted: the limit is exceeded rather than losing
+        the last undo step.
+        """
+        current = self.current.id
+        for version_id in list(self._materialized):
+            if self.footprint().memory <= self.max_bytes:
+                return
+            if version_id != current:
+                del self._materialized[version_id]
+
+        if self.spill_dir is not None:
+            candidates = [
+                version_id for version_id in self._history if version_id != current
+            ]
+        else:
+            # The oldest undo steps, then the furthest redo steps
+            candidates = [
+                *self._history[: max(self._position - 1, 0)],
+                *reversed(self._history[self._position + 1 :]),
+            ]
+        for version_id in candidates:
+            if self.footprint().memory <= self.max_bytes:
+                return
+            if self.spill_dir is not None:
+                if not self._versions[version_id].spilled:
+                    self._spill(version_id)
+            else:
+                self._evict(version_id)
+
+        if (memory := self.footprint().memory) > self.max_bytes:
+            logger.warning(
+                "Document history takes %d bytes, over its limit of %d, to keep the "
+                "last undo step",
+                memory,
+                self.max_bytes,
+            )
+
+    def _spill(self, version_id: int) -> None:
+        version = self._versions[version_id]
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f"version_{version_id}.pdf"
+        path.write_bytes(version.data)
+        self._versions[version_id] = replace(version, data=buffers.MappedPdf.open(path))
+        if self._materialized.get(version_id) is version.data:
+            del self._materialized[version_id]
+
+    def _evict(self, version_id: int) -> None:
+        """Drop a version other than the current one, making the version based on it whole."""
+        for child in list(self._versions.values()):
+            if child.base == version_id:
+                self._versions[child.id] = replace(
+                    child, base=None, data=self.pdf(child.id)
+                )
+        index = self._history.index(version_id)
+        self._drop(version_id)
+        del self._history[index]
+        if index < self._position:
+            self._position -= 1